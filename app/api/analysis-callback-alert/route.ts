@@ -0,0 +1,25 @@
+import { type NextRequest, NextResponse } from "next/server"
+import { notifyLiveAlerts } from "@/lib/notifications"
+import { readResultPayload } from "@/lib/result-format"
+
+// Alerts of the Flask service's live detection: blocks of a growing log that scored at or
+// above its alert threshold. They belong to no upload, so they are pushed to the
+// notification stream instead of being stored.
+export async function POST(request: NextRequest) {
+  try {
+    const { source, results } = await readResultPayload(request)
+
+    if (!Array.isArray(results)) {
+      return NextResponse.json({ error: "Missing required fields" }, { status: 400 })
+    }
+
+    console.log(`🚨 Received ${results.length} live alerts from ${source || "unknown source"}`)
+
+    notifyLiveAlerts(source || "unknown", results)
+
+    return NextResponse.json({ success: true, alerts_received: results.length })
+  } catch (error) {
+    console.error("Live alert callback error:", error)
+    return NextResponse.json({ error: "Failed to process live alerts" }, { status: 500 })
+  }
+}
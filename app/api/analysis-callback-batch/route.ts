@@ -0,0 +1,50 @@
+import { type NextRequest, NextResponse } from "next/server"
+import { sql } from "@/lib/db"
+import { notifyAnalysisProgress } from "@/lib/notifications"
+import { type AnalysisResult, readResultPayload } from "@/lib/result-format"
+
+export async function POST(request: NextRequest) {
+  try {
+    const { upload_id, batch_seq, blocks_sent, results } = await readResultPayload(request)
+
+    if (!upload_id || batch_seq === undefined || !Array.isArray(results)) {
+      return NextResponse.json({ error: "Missing required fields" }, { status: 400 })
+    }
+
+    // Re-sent batches are harmless: rows are upserted on (upload_id, block_id)
+    const processedAt = new Date().toISOString()
+    const BATCH_SIZE = 500
+    for (let i = 0; i < results.length; i += BATCH_SIZE) {
+      const insertPromises = results.slice(i, i + BATCH_SIZE).map((result: AnalysisResult) => {
+        return sql`
+          INSERT INTO analysis_results (upload_id, block_id, anomaly_score, anomaly_reason, processed_at)
+          VALUES (
+            ${upload_id},
+            ${result.block_id},
+            ${result.anomaly_score},
+            ${result.reason || 'No reason provided'},
+            ${processedAt}
+          )
+          ON CONFLICT (upload_id, block_id) DO UPDATE SET
+            anomaly_score = EXCLUDED.anomaly_score,
+            anomaly_reason = EXCLUDED.anomaly_reason,
+            processed_at = EXCLUDED.processed_at
+        `
+      })
+      await Promise.all(insertPromises)
+    }
+
+    console.log(`✓ Stored result batch ${batch_seq} for upload ${upload_id} (${results.length} results)`)
+
+    notifyAnalysisProgress(upload_id, {
+      batch_seq,
+      batch_results: results.length,
+      analyzed_blocks: blocks_sent,
+    })
+
+    return NextResponse.json({ success: true, batch_seq, results_saved: results.length })
+  } catch (error) {
+    console.error("Analysis batch callback error:", error)
+    return NextResponse.json({ error: "Failed to process result batch" }, { status: 500 })
+  }
+}
@@ -1,6 +1,7 @@
 import { type NextRequest, NextResponse } from "next/server"
 import { sql } from "@/lib/db"
 import { notifyAnalysisComplete } from "@/lib/notifications"
+import { type AnalysisResult, readResultPayload } from "@/lib/result-format"
 import fs from "fs/promises"
 
 export async function POST(request: NextRequest) {
@@ -11,8 +12,10 @@ export async function POST(request: NextRequest) {
       analysis_filename, 
       analysis_filepath, 
       total_blocks_processed,
-      results 
-    } = await request.json()
+      results,
+      streamed,
+      total_batches
+    } = await readResultPayload(request)
 
     if (!upload_id || !analysis_complete) {
       return NextResponse.json({ error: "Missing required fields" }, { status: 400 })
@@ -23,6 +26,10 @@ export async function POST(request: NextRequest) {
     console.log(`- Filepath: ${analysis_filepath}`)
     console.log(`- Blocks processed: ${total_blocks_processed}`)
     console.log(`- Results count: ${results?.length || 0}`)
+    if (streamed) {
+      // Results were delivered to analysis-callback-batch; this is the final marker
+      console.log(`- Streamed in ${total_batches} batches`)
+    }
 
     // Get file path for cleanup
     let filePath = null
@@ -81,7 +88,7 @@ export async function POST(request: NextRequest) {
         const batch = batches[batchIndex]
         
         // Use concurrent inserts for this batch
-        const insertPromises = batch.map(result => {
+        const insertPromises = batch.map((result: AnalysisResult) => {
           return sql`
             INSERT INTO analysis_results (upload_id, block_id, anomaly_score, anomaly_reason, processed_at)
             VALUES (
@@ -112,7 +119,7 @@ export async function POST(request: NextRequest) {
       analysis_filename,
       analysis_filepath,
       total_blocks_processed,
-      results_count: results?.length || 0,
+      results_count: streamed ? total_blocks_processed : results?.length || 0,
       completed_at: new Date().toISOString()
     }
     
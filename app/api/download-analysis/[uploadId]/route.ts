@@ -25,19 +25,25 @@ export async function GET(request: NextRequest, { params }: { params: Promise<{
 
     // Try to fetch the analysis file from Flask service
     try {
-      const flaskResponse = await fetch(`${process.env.FLASK_SERVICE_URL}/results/${analysisResults.analysis_filename}`)
+      // Stream the export through and forward Range, so large results are never buffered here
+      const range = request.headers.get("range")
+      const flaskResponse = await fetch(`${process.env.FLASK_SERVICE_URL}/results/${analysisResults.analysis_filename}`, {
+        headers: range ? { Range: range } : {},
+      })
 
       if (flaskResponse.ok) {
-        const csvContent = await flaskResponse.text()
+        const headers: Record<string, string> = {
+          "Content-Type": "text/csv",
+          "Content-Disposition": `attachment; filename="analysis_${originalFilename}_${analysisResults.analysis_filename}"`,
+          "Accept-Ranges": "bytes",
+        }
+        for (const name of ["content-length", "content-range", "etag", "last-modified"]) {
+          const value = flaskResponse.headers.get(name)
+          if (value) headers[name] = value
+        }
 
         // Return CSV file as download
-        return new NextResponse(csvContent, {
-          status: 200,
-          headers: {
-            "Content-Type": "text/csv",
-            "Content-Disposition": `attachment; filename="analysis_${originalFilename}_${analysisResults.analysis_filename}"`,
-          },
-        })
+        return new NextResponse(flaskResponse.body, { status: flaskResponse.status, headers })
       } else {
         return NextResponse.json({ error: "Analysis file not available from Flask service" }, { status: 404 })
       }
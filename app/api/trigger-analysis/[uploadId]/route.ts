@@ -1,5 +1,6 @@
 import { type NextRequest, NextResponse } from "next/server"
 import { sql } from "@/lib/db"
+import { RESULT_FORMAT } from "@/lib/result-format"
 
 export async function POST(request: NextRequest, { params }: { params: Promise<{ uploadId: string }> }) {
   try {
@@ -37,6 +38,7 @@ export async function POST(request: NextRequest, { params }: { params: Promise<{
 
     const flaskPayload = {
       upload_id: uploadId,
+      user_id: uploadInfo[0].user_id,
       filename: uploadInfo[0].filename,
       total_entries: hdfsEntries.length,
       block_ids: blockIds,
@@ -49,6 +51,7 @@ export async function POST(request: NextRequest, { params }: { params: Promise<{
       method: "POST",
       headers: {
         "Content-Type": "application/json",
+        "X-Result-Format": RESULT_FORMAT, // Encoding of the result callbacks
       },
       body: JSON.stringify(flaskPayload),
       signal: AbortSignal.timeout(10000),
@@ -2,6 +2,7 @@ import { type NextRequest, NextResponse } from "next/server"
 import { cookies } from "next/headers"
 import { sql } from "@/lib/db"
 import { parseHDFSLog, extractBlockIds } from "@/lib/hdfs-parser"
+import { RESULT_FORMAT } from "@/lib/result-format"
 import fs from "fs/promises"
 import { writeFile, mkdir } from "fs/promises"
 import { join } from "path"
@@ -222,6 +223,7 @@ export async function POST(request: NextRequest) {
 
       const flaskPayload = {
         upload_id: uploadId,
+        user_id: userId, // Used by the Flask scheduler for per-user fair share
         filename: file.name,
         file_path: filePath, // Path to the saved raw file
         total_entries: hdfsEntries.length,
@@ -235,6 +237,7 @@ export async function POST(request: NextRequest) {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          "X-Result-Format": RESULT_FORMAT, // Encoding of the result callbacks
         },
         body: JSON.stringify(flaskPayload),
         signal: AbortSignal.timeout(15000), // 15 second timeout
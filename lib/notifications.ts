@@ -60,4 +60,26 @@ export function notifyAnalysisProgress(uploadId: string, progress: Record<string
       connections.delete(controller)
     }
   })
-} 
\ No newline at end of file
+} 
+// Function to notify about anomalous blocks found by live detection on a growing log
+export function notifyLiveAlerts(source: string, alerts: Record<string, unknown>[]) {
+  console.log(`SSE: Notifying ${connections.size} clients about ${alerts.length} live alerts from ${source}`)
+
+  const message = JSON.stringify({
+    type: 'live_alert',
+    source,
+    data: { alerts },
+    timestamp: new Date().toISOString()
+  })
+
+  let clientIndex = 0
+  connections.forEach((controller) => {
+    try {
+      controller.enqueue(`data: ${message}\n\n`)
+      clientIndex++
+    } catch (error) {
+      console.error(`SSE: Error sending live alerts to client ${clientIndex + 1}:`, error)
+      connections.delete(controller)
+    }
+  })
+}
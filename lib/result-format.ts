@@ -0,0 +1,118 @@
+import { gunzipSync } from "zlib"
+
+// Result encoding the Flask service is asked to use for its callbacks (X-Result-Format)
+export const RESULT_FORMAT = process.env.ANALYSIS_RESULT_FORMAT || "msgpack"
+
+export type AnalysisResult = {
+  block_id: string
+  anomaly_score: number
+  anomaly_probability?: number
+  reason?: string
+}
+
+type ResultColumns = {
+  block_id: string
+  anomaly_score: Uint8Array
+  anomaly_probability?: Uint8Array
+  reason_table: string[]
+  reason_code: Uint8Array
+}
+
+// Decoder for the msgpack types the Flask service emits: maps, arrays, strings, binary,
+// integers, floats, booleans and nil
+function decodeMsgpack(buffer: Buffer): unknown {
+  let offset = 0
+
+  const bytes = (length: number) => {
+    const value = buffer.subarray(offset, offset + length)
+    offset += length
+    return value
+  }
+  const array = (length: number): unknown[] => Array.from({ length }, () => next())
+  const map = (length: number) => {
+    const value: Record<string, unknown> = {}
+    for (let i = 0; i < length; i++) {
+      const key = String(next())
+      value[key] = next()
+    }
+    return value
+  }
+  const str = (length: number) => bytes(length).toString("utf-8")
+
+  function next(): unknown {
+    const type = buffer[offset++]
+    if (type <= 0x7f) return type
+    if (type <= 0x8f) return map(type & 0x0f)
+    if (type <= 0x9f) return array(type & 0x0f)
+    if (type <= 0xbf) return str(type & 0x1f)
+    if (type >= 0xe0) return type - 0x100
+    switch (type) {
+      case 0xc0: return null
+      case 0xc2: return false
+      case 0xc3: return true
+      case 0xc4: return new Uint8Array(bytes(buffer.readUInt8((offset += 1) - 1)))
+      case 0xc5: return new Uint8Array(bytes(buffer.readUInt16BE((offset += 2) - 2)))
+      case 0xc6: return new Uint8Array(bytes(buffer.readUInt32BE((offset += 4) - 4)))
+      case 0xca: return buffer.readFloatBE((offset += 4) - 4)
+      case 0xcb: return buffer.readDoubleBE((offset += 8) - 8)
+      case 0xcc: return buffer.readUInt8((offset += 1) - 1)
+      case 0xcd: return buffer.readUInt16BE((offset += 2) - 2)
+      case 0xce: return buffer.readUInt32BE((offset += 4) - 4)
+      case 0xcf: return Number(buffer.readBigUInt64BE((offset += 8) - 8))
+      case 0xd0: return buffer.readInt8((offset += 1) - 1)
+      case 0xd1: return buffer.readInt16BE((offset += 2) - 2)
+      case 0xd2: return buffer.readInt32BE((offset += 4) - 4)
+      case 0xd3: return Number(buffer.readBigInt64BE((offset += 8) - 8))
+      case 0xd9: return str(buffer.readUInt8((offset += 1) - 1))
+      case 0xda: return str(buffer.readUInt16BE((offset += 2) - 2))
+      case 0xdb: return str(buffer.readUInt32BE((offset += 4) - 4))
+      case 0xdc: return array(buffer.readUInt16BE((offset += 2) - 2))
+      case 0xdd: return array(buffer.readUInt32BE((offset += 4) - 4))
+      case 0xde: return map(buffer.readUInt16BE((offset += 2) - 2))
+      case 0xdf: return map(buffer.readUInt32BE((offset += 4) - 4))
+      default: throw new Error(`Unsupported msgpack type 0x${type.toString(16)}`)
+    }
+  }
+
+  return next()
+}
+
+// Copies the bytes first: typed arrays need an aligned offset into the buffer
+function float64Column(bytes: Uint8Array) {
+  return new Float64Array(bytes.slice().buffer)
+}
+
+function resultsFromColumns(columns: ResultColumns): AnalysisResult[] {
+  const blockIds = columns.block_id ? columns.block_id.split("\n") : []
+  const scores = float64Column(columns.anomaly_score)
+  const probabilities = columns.anomaly_probability ? float64Column(columns.anomaly_probability) : null
+  const codes = new Uint32Array(columns.reason_code.slice().buffer)
+  return blockIds.map((blockId, i) => ({
+    block_id: blockId,
+    anomaly_score: scores[i],
+    ...(probabilities ? { anomaly_probability: probabilities[i] } : {}),
+    reason: columns.reason_table[codes[i]],
+  }))
+}
+
+// Callback bodies are JSON, NDJSON (first line the payload fields, then one result per
+// line) or msgpack with the results packed in columns, optionally gzip-compressed
+export async function readResultPayload(request: Request) {
+  let body = Buffer.from(await request.arrayBuffer())
+  if (request.headers.get("content-encoding") === "gzip") {
+    body = gunzipSync(body)
+  }
+  const contentType = request.headers.get("content-type") || ""
+
+  if (contentType.includes("application/x-msgpack")) {
+    const { columns, ...payload } = decodeMsgpack(body) as Record<string, unknown> & { columns: ResultColumns }
+    return { ...payload, results: resultsFromColumns(columns) }
+  }
+  const text = body.toString("utf-8")
+  if (contentType.includes("application/x-ndjson")) {
+    const lines = text.split("\n").filter((line) => line.trim().length > 0)
+    const header = lines.length > 0 ? JSON.parse(lines[0]) : {}
+    return { ...header, results: lines.slice(1).map((line) => JSON.parse(line)) }
+  }
+  return JSON.parse(text)
+}
@@ -0,0 +1,131 @@
+"""
+Micro-batching of concurrent scoring requests
+Buffers the count matrices that concurrent jobs are about to score for up to a few
+milliseconds or a number of rows, scores them with one vectorized call and hands each
+job its own rows back
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from loglizer import instrumentation
+
+
+class _Request(object):
+    __slots__ = ('X', 'score_func', 'key', 'span', 'enqueued_at', 'result', 'error', 'done')
+
+    def __init__(self, X, score_func, key):
+        self.X = X
+        self.score_func = score_func
+        self.key = key
+        self.span = instrumentation.current_span()
+        self.enqueued_at = time.time()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BatchCoalescer(object):
+    """Coalesce small scoring requests from many threads into shared model calls
+
+    A batch is flushed when it holds max_batch_rows rows or its oldest request has waited
+    max_wait_ms. Only requests with the same key are batched together, so the key must
+    identify the score function, e.g. the model and extractor in use. Requests with
+    max_batch_rows rows or more are scored directly in the calling thread.
+    """
+
+    def __init__(self, max_batch_rows=4096, max_wait_ms=2.0):
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+        self.direct = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = threading.Thread(target=self._work, name='scoring_batcher', daemon=True)
+        self._thread.start()
+
+    def score(self, X, score_func, key=None):
+        """Return score_func(X), computed together with concurrent requests of the same key
+
+        score_func maps a matrix to results with one row per input row.
+        """
+        if X.shape[0] == 0 or X.shape[0] >= self.max_batch_rows:
+            with self._lock:
+                self.direct += 1
+            return score_func(X)
+        request = _Request(X, score_func, key)
+        with self._lock:
+            self._pending.append(request)
+            self._pending_rows += X.shape[0]
+            self._wakeup.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_batch_rows': self.max_batch_rows,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': self.batches,
+                'requests': self.requests,
+                'rows': self.rows,
+                'direct_requests': self.direct,
+                'mean_requests_per_batch': self.requests / float(self.batches) if self.batches else 0.0,
+                'mean_rows_per_batch': self.rows / float(self.batches) if self.batches else 0.0,
+            }
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._wakeup.wait()
+                deadline = self._pending[0].enqueued_at + self.max_wait
+                while self._pending_rows < self.max_batch_rows:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.wait(remaining)
+                batch = self._take_batch()
+            self._run(batch)
+
+    def _take_batch(self):
+        # The oldest request picks the key; same-key requests join it in arrival order
+        key = self._pending[0].key
+        batch, rest, num_rows = [], [], 0
+        for request in self._pending:
+            if request.key == key and num_rows + request.X.shape[0] <= self.max_batch_rows:
+                batch.append(request)
+                num_rows += request.X.shape[0]
+            else:
+                rest.append(request)
+        self._pending = rest
+        self._pending_rows -= num_rows
+        self.batches += 1
+        self.requests += len(batch)
+        self.rows += num_rows
+        return batch
+
+    def _run(self, batch):
+        try:
+            # The batch's spans join the trace of its oldest request
+            with instrumentation.attach(batch[0].span):
+                with instrumentation.timed('coalesced_batch', sum(request.X.shape[0] for request in batch),
+                                           requests=len(batch),
+                                           wait_seconds=time.time() - batch[0].enqueued_at):
+                    results = np.asarray(batch[0].score_func(np.vstack([request.X for request in batch])))
+            bounds = np.cumsum([request.X.shape[0] for request in batch])[:-1]
+            for request, result in zip(batch, np.split(results, bounds)):
+                request.result = result
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        for request in batch:
+            request.done.set()
@@ -0,0 +1,164 @@
+"""
+Job checkpoints of the HDFS analysis service
+Every /analyze job is recorded in a local SQLite database with its request when it is
+queued, and its progress is saved there while it runs: the blocks processed, the result
+batches sent and the size of the CSV export, at a point where all of them agree. A job
+that is still recorded when the process that owned it is gone was interrupted, and the
+next service process resumes it from its last checkpoint.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CHECKPOINT_QUEUED = 'queued'
+CHECKPOINT_RUNNING = 'running'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    job_id TEXT PRIMARY KEY,
+    request TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    job_id TEXT PRIMARY KEY,
+    upload_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    status TEXT NOT NULL,
+    model_version TEXT,
+    processed_blocks INTEGER NOT NULL DEFAULT 0,
+    batches_sent INTEGER NOT NULL DEFAULT 0,
+    export_bytes INTEGER,
+    resumes INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def process_owner(pid=None):
+    """Identify a running process by its pid and start time, so a reused pid does not match"""
+    pid = os.getpid() if pid is None else pid
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name may contain spaces, so the fields are counted after its ')'
+            return f"{pid}:{f.read().rsplit(')', 1)[1].split()[19]}"
+    except (OSError, IndexError):
+        return None
+
+
+def owner_alive(owner):
+    pid = int(owner.split(':', 1)[0])
+    if ':' not in owner:
+        try:
+            os.kill(pid, 0)
+            return True
+        except OSError:
+            return False
+    return process_owner(pid) == owner
+
+
+class CheckpointStore(object):
+    """SQLite table of the queued and running jobs of this host and their last checkpoint
+
+    A job is owned by the process that queued or resumed it, identified by process_owner.
+    Rows are deleted when their job finishes or fails, so only jobs interrupted by the
+    end of their process are left for claim_orphans. Requests, whose block ids may take
+    megabytes, are kept in a table of their own so that saving progress stays one small
+    row update.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.owner = process_owner() or str(os.getpid())
+        self.saved = 0
+        self.resumed = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+
+    def create(self, job_id, upload_id, request):
+        """Record a queued job with the request needed to run it again"""
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.execute('INSERT OR REPLACE INTO requests (job_id, request) VALUES (?, ?)',
+                             (job_id, json.dumps(request)))
+            self._db.execute('INSERT OR REPLACE INTO checkpoints (job_id, upload_id, owner, status, created_at, '
+                             'updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                             (job_id, upload_id, self.owner, CHECKPOINT_QUEUED, now, now))
+            self._db.execute('COMMIT')
+
+    def get(self, job_id):
+        """Return the recorded job as a dict, or None"""
+        with self._lock:
+            cursor = self._db.execute('SELECT c.*, r.request FROM checkpoints c JOIN requests r ON r.job_id = c.job_id '
+                                      'WHERE c.job_id = ?', (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            checkpoint = dict(zip([column[0] for column in cursor.description], row))
+        checkpoint['request'] = json.loads(checkpoint['request'])
+        return checkpoint
+
+    def start(self, job_id, model_version):
+        """Mark a job as running with the model version it scores with"""
+        with self._lock:
+            self._db.execute('UPDATE checkpoints SET status = ?, model_version = ?, updated_at = ? WHERE job_id = ?',
+                             (CHECKPOINT_RUNNING, model_version, time.time(), job_id))
+
+    def save(self, job_id, processed_blocks, batches_sent=0, export_bytes=None):
+        """Save the progress of a running job; one small update"""
+        with self._lock:
+            self._db.execute('UPDATE checkpoints SET processed_blocks = ?, batches_sent = ?, export_bytes = ?, '
+                             'updated_at = ? WHERE job_id = ?',
+                             (processed_blocks, batches_sent, export_bytes, time.time(), job_id))
+            self.saved += 1
+
+    def finish(self, job_id):
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.execute('DELETE FROM checkpoints WHERE job_id = ?', (job_id,))
+            self._db.execute('DELETE FROM requests WHERE job_id = ?', (job_id,))
+            self._db.execute('COMMIT')
+
+    def claim_orphans(self, max_resumes=3):
+        """Take over the jobs whose owner process has ended, oldest first
+
+        Returns their checkpoints. A job that was already resumed max_resumes times is
+        dropped instead, so a job that kills its process cannot do so forever.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT job_id, owner, resumes FROM checkpoints WHERE owner != ? '
+                                    'ORDER BY created_at', (self.owner,)).fetchall()
+        claimed = []
+        for job_id, owner, resumes in rows:
+            if owner_alive(owner):
+                continue
+            with self._lock:
+                if resumes >= max_resumes:
+                    dropped = self._db.execute('DELETE FROM checkpoints WHERE job_id = ? AND owner = ?',
+                                               (job_id, owner)).rowcount
+                    if dropped:
+                        self._db.execute('DELETE FROM requests WHERE job_id = ?', (job_id,))
+                        print(f"✗ Dropping job {job_id}: interrupted {resumes + 1} times")
+                    continue
+                # Another process starting at the same time may claim it first
+                taken = self._db.execute('UPDATE checkpoints SET owner = ?, resumes = resumes + 1 '
+                                         'WHERE job_id = ? AND owner = ?', (self.owner, job_id, owner)).rowcount
+            if taken:
+                claimed.append(self.get(job_id))
+        self.resumed += len(claimed)
+        return claimed
+
+    def stats(self):
+        with self._lock:
+            jobs = self._db.execute('SELECT COUNT(*) FROM checkpoints WHERE owner = ?', (self.owner,)).fetchone()[0]
+        return {'jobs': jobs, 'saved': self.saved, 'resumed': self.resumed}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
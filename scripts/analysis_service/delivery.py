@@ -0,0 +1,231 @@
+"""
+Streamed delivery of analysis results to the Next.js callbacks
+Results are posted in fixed-size numbered batches to analysis-callback-batch while a job
+runs, followed by a completion marker to analysis-callback-complete
+"""
+
+import gzip
+import json
+import time
+
+import numpy as np
+
+from loglizer import instrumentation
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORMAT_JSON = 'json'
+FORMAT_NDJSON = 'ndjson'
+FORMAT_MSGPACK = 'msgpack'
+FORMATS = (FORMAT_JSON, FORMAT_NDJSON, FORMAT_MSGPACK)
+
+# Names a callback request uniquely across retries and resumed jobs; the outbox sends each once
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+CONTENT_TYPES = {
+    FORMAT_JSON: 'application/json',
+    FORMAT_NDJSON: 'application/x-ndjson',
+    FORMAT_MSGPACK: 'application/x-msgpack',
+}
+
+
+def negotiate_format(requested, default=FORMAT_JSON):
+    """Return the result format to use for a requested one, e.g. an X-Result-Format header
+
+    Unknown formats fall back to the default, and msgpack falls back to JSON when the
+    msgpack package is not installed.
+    """
+    fmt = (requested or default).strip().lower()
+    if fmt not in FORMATS:
+        fmt = default
+    if fmt == FORMAT_MSGPACK and msgpack is None:
+        fmt = FORMAT_JSON
+    return fmt
+
+
+def columnar_results(results):
+    """Pack result rows into columns
+
+    block_id is one newline-separated string, the scores are little-endian float64
+    arrays, and the reasons are a table of distinct strings plus a little-endian uint32
+    index into it per row.
+    """
+    reasons = {}
+    codes = np.fromiter((reasons.setdefault(result.get('reason', ''), len(reasons)) for result in results),
+                        dtype='<u4', count=len(results))
+    columns = {
+        'block_id': '\n'.join(result['block_id'] for result in results),
+        'anomaly_score': np.fromiter((result['anomaly_score'] for result in results), dtype='<f8',
+                                     count=len(results)).tobytes(),
+        'reason_table': list(reasons),
+        'reason_code': codes.tobytes(),
+    }
+    if results and 'anomaly_probability' in results[0]:
+        columns['anomaly_probability'] = np.fromiter((result['anomaly_probability'] for result in results),
+                                                     dtype='<f8', count=len(results)).tobytes()
+    return columns
+
+
+def rows_from_columns(columns):
+    """Inverse of columnar_results"""
+    block_ids = columns['block_id'].split('\n') if columns['block_id'] else []
+    scores = np.frombuffer(columns['anomaly_score'], dtype='<f8').tolist()
+    table = columns['reason_table']
+    reasons = [table[code] for code in np.frombuffer(columns['reason_code'], dtype='<u4').tolist()]
+    if 'anomaly_probability' in columns:
+        probs = np.frombuffer(columns['anomaly_probability'], dtype='<f8').tolist()
+        return [{'block_id': block_id, 'anomaly_score': score, 'anomaly_probability': prob, 'reason': reason}
+                for block_id, score, prob, reason in zip(block_ids, scores, probs, reasons)]
+    return [{'block_id': block_id, 'anomaly_score': score, 'reason': reason}
+            for block_id, score, reason in zip(block_ids, scores, reasons)]
+
+
+def encode_results(payload, fmt=FORMAT_JSON, compress=False):
+    """Encode a callback payload whose 'results' is a list of result rows
+
+    JSON bodies are the payload itself; NDJSON bodies carry the other fields on the first
+    line and one result per following line; msgpack bodies carry the other fields and the
+    results as 'columns' (see columnar_results). Returns the body and its headers.
+    """
+    with instrumentation.timed('encode_results', len(payload['results']), format=fmt) as span:
+        if fmt == FORMAT_NDJSON:
+            header = {key: value for key, value in payload.items() if key != 'results'}
+            lines = [json.dumps(header)] + [json.dumps(result) for result in payload['results']]
+            body = ('\n'.join(lines) + '\n').encode('utf-8')
+        elif fmt == FORMAT_MSGPACK:
+            packed = {key: value for key, value in payload.items() if key != 'results'}
+            packed['columns'] = columnar_results(payload['results'])
+            body = msgpack.packb(packed, use_bin_type=True)
+        else:
+            fmt = FORMAT_JSON
+            body = json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': CONTENT_TYPES[fmt]}
+        if compress:
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        span.attributes['bytes'] = len(body)
+    return body, headers
+
+
+def decode_results(body, headers):
+    """Decode a body built by encode_results back into the payload"""
+    if headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    content_type = headers.get('Content-Type', CONTENT_TYPES[FORMAT_JSON])
+    if content_type == CONTENT_TYPES[FORMAT_MSGPACK]:
+        payload = msgpack.unpackb(body, raw=False)
+        payload['results'] = rows_from_columns(payload.pop('columns'))
+        return payload
+    if content_type == CONTENT_TYPES[FORMAT_NDJSON]:
+        lines = body.decode('utf-8').splitlines()
+        payload = json.loads(lines[0])
+        payload['results'] = [json.loads(line) for line in lines[1:] if line]
+        return payload
+    return json.loads(body)
+
+
+def encode_batch(upload_id, batch_seq, blocks_sent, results, fmt=FORMAT_JSON, compress=False, model_version=None):
+    """Encode one result batch as a request body and its headers
+
+    The payload is {upload_id, batch_seq, blocks_sent, results}, plus the model_version
+    that scored the results when given, encoded as described in encode_results.
+    """
+    payload = {'upload_id': upload_id, 'batch_seq': batch_seq, 'blocks_sent': blocks_sent, 'results': results}
+    if model_version is not None:
+        payload['model_version'] = model_version
+    body, headers = encode_results(payload, fmt, compress)
+    headers['X-Batch-Seq'] = str(batch_seq)
+    return body, headers
+
+
+def post_with_retries(session, url, body, headers, retries=3, backoff_seconds=0.5, timeout=10):
+    """POST a body with requests, retrying failed attempts with exponential backoff
+
+    Re-sending is safe because the callbacks upsert results by (upload_id, block_id).
+    """
+    for attempt in range(retries + 1):
+        try:
+            with instrumentation.timed('callback_delivery', len(body), url=url, attempt=attempt + 1) as span:
+                response = session.post(url, data=body, headers=headers, timeout=timeout)
+                span.attributes['status_code'] = response.status_code
+                response.raise_for_status()
+            return response
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff_seconds * 2 ** attempt)
+
+
+class ResultStream(object):
+    """Buffer the results of one job and deliver them in numbered batches
+
+    post(url, body, headers) sends one request; it is called in batch order. At most
+    batch_size results are buffered, so memory does not grow with the number of blocks.
+    Batches and the completion marker name the model_version of the job, when given.
+
+    With an idempotency_key, each request carries an Idempotency-Key header made of it and
+    the batch number (or 'complete'), so a batch sent again by a resumed job is recognized.
+    A resumed job restores batches_sent and blocks_sent from its checkpoint.
+    """
+
+    def __init__(self, upload_id, callback_url, post, batch_size=1000, fmt=FORMAT_JSON, compress=False,
+                 model_version=None, idempotency_key=None):
+        self.upload_id = upload_id
+        self.model_version = model_version
+        self.idempotency_key = idempotency_key
+        self.batch_url = callback_url + '-batch'
+        self.complete_url = callback_url + '-complete'
+        self.post = post
+        self.batch_size = batch_size
+        self.fmt = fmt
+        self.compress = compress
+        self.batches_sent = 0
+        self.blocks_sent = 0
+        self._buffer = []
+
+    def add(self, results):
+        for result in results:
+            self._buffer.append(result)
+            if len(self._buffer) >= self.batch_size:
+                self.flush()
+
+    @property
+    def buffered(self):
+        """Number of results added but not sent yet"""
+        return len(self._buffer)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self.blocks_sent += len(self._buffer)
+        body, headers = encode_batch(self.upload_id, self.batches_sent, self.blocks_sent, self._buffer,
+                                     self.fmt, self.compress, self.model_version)
+        self._buffer = []
+        if self.idempotency_key is not None:
+            headers[IDEMPOTENCY_HEADER] = f'{self.idempotency_key}:{self.batches_sent}'
+        self.post(self.batch_url, body, headers)
+        self.batches_sent += 1
+
+    def finish(self, analysis_filename):
+        """Flush the remaining results and send the completion marker"""
+        self.flush()
+        payload = {
+            'upload_id': self.upload_id,
+            'analysis_complete': True,
+            'analysis_filename': analysis_filename,
+            'analysis_filepath': None,
+            'total_blocks_processed': self.blocks_sent,
+            'results': [],
+            'streamed': True,
+            'total_batches': self.batches_sent,
+        }
+        if self.model_version is not None:
+            payload['model_version'] = self.model_version
+        body = json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.idempotency_key is not None:
+            headers[IDEMPOTENCY_HEADER] = f'{self.idempotency_key}:complete'
+        self.post(self.complete_url, body, headers)
@@ -0,0 +1,74 @@
+"""
+Streamed log uploads for the /ingest endpoint
+Request body chunks are decompressed, size-checked and fed to a session builder as they
+arrive, so an upload is never staged in memory or on disk.
+"""
+
+import zlib
+
+from loglizer.sessions import SessionBuilder
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+
+
+class IngestStream(object):
+    """Feed a possibly gzip-compressed request body to a SessionBuilder chunk by chunk
+
+    max_bytes limits the decompressed size, so a small compressed body cannot expand
+    without bound.
+    """
+
+    def __init__(self, max_bytes, content_encoding=None, builder=None):
+        encoding = (content_encoding or '').strip().lower()
+        if encoding not in ('', 'identity', 'gzip', 'x-gzip'):
+            raise ValueError(f'Unsupported Content-Encoding: {content_encoding}')
+        self.max_bytes = max_bytes
+        self.builder = builder or SessionBuilder()
+        self.received_bytes = 0
+        self.log_bytes = 0
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if 'gzip' in encoding else None
+
+    def write(self, chunk):
+        self.received_bytes += len(chunk)
+        if self._decompressor is None:
+            self._feed(chunk)
+            return
+        data = chunk
+        if data and self._decompressor.eof:
+            # The last chunk ended with a gzip member; what follows has to be the next one
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while data:
+            # Bounded output per call keeps a decompression bomb from filling memory
+            self._feed(self._decompress(data, self.max_bytes - self.log_bytes + 1))
+            data = self._decompressor.unconsumed_tail
+            if self._decompressor.eof and self._decompressor.unused_data:
+                # A gzip body may hold several members, e.g. files joined with cat
+                data = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def close(self):
+        """Finish the upload and return the SessionBuilder with all sessions
+
+        Raises ValueError when a gzip body is truncated or has trailing data that is not
+        a gzip member.
+        """
+        if self._decompressor is not None:
+            self._feed(self._decompressor.flush())
+            if not self._decompressor.eof:
+                raise ValueError('Truncated gzip body')
+        return self.builder.close()
+
+    def _decompress(self, data, max_length):
+        try:
+            return self._decompressor.decompress(data, max_length)
+        except zlib.error as e:
+            raise ValueError(f'Invalid gzip body: {e}')
+
+    def _feed(self, data):
+        self.log_bytes += len(data)
+        if self.log_bytes > self.max_bytes:
+            raise UploadTooLargeError(f'Upload exceeds the limit of {self.max_bytes} bytes')
+        if data:
+            self.builder.feed(data)
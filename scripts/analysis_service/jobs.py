@@ -0,0 +1,302 @@
+"""
+Job management for the HDFS analysis service
+Runs analysis jobs on a bounded worker pool and keeps the job table read by /status.
+Waiting jobs are scheduled shortest-job-first with per-user fair share and aging. Each job
+runs in an analysis_job span continuing the trace of the request that submitted it.
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+from loglizer import instrumentation
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Upper cost bound of each size class, in log lines plus blocks; the last class is unbounded
+SIZE_CLASSES = (('small', 10000), ('medium', 1000000), ('large', None))
+
+# Number of recent queue-wait samples kept per size class for the percentiles
+WAIT_SAMPLES = 1000
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit"""
+
+
+class ShuttingDownError(Exception):
+    """Raised when a job is submitted after the manager was shut down"""
+
+
+class DuplicateJobError(Exception):
+    """Raised when a job is submitted with the job_id of a job still in the job table"""
+
+
+def estimate_cost(total_entries, num_blocks):
+    """Estimate the work of a job from its upload: every line is parsed, every block scored"""
+    return max(int(total_entries or 0), 0) + max(int(num_blocks or 0), 0)
+
+
+def size_class(cost):
+    for name, bound in SIZE_CLASSES:
+        if bound is None or cost < bound:
+            return name
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending non-empty list"""
+    rank = max(int(round(q / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Job(object):
+    """State of one analysis job, updated by the worker running it"""
+
+    def __init__(self, job_id, upload_id=None, total_blocks=0, user_id=None, cost=0):
+        self.job_id = job_id
+        self.upload_id = upload_id
+        self.user_id = user_id
+        self.cost = cost
+        self.size_class = size_class(cost)
+        self.status = JOB_QUEUED
+        self.total_blocks = total_blocks
+        self.processed_blocks = 0
+        self.message = 'Queued for analysis'
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Profiling mode asked for the job, the profiler while it runs, and the report after
+        self.profile = None
+        self.profile_memory = True
+        self.profiler = None
+        self.profile_report = None
+        self.thread_id = None
+        # Span current when the job was submitted, the parent of the job's span
+        self.span = None
+        # Model version the job scores with, taken when it starts
+        self.model = None
+        self.model_version = None
+        # Checkpoint of an interrupted run the job resumes from, see analysis_service.checkpoints
+        self.checkpoint = None
+        self._lock = threading.Lock()
+
+    def set_progress(self, processed_blocks, total_blocks=None, message=None):
+        with self._lock:
+            self.processed_blocks = processed_blocks
+            if total_blocks is not None:
+                self.total_blocks = total_blocks
+            if message is not None:
+                self.message = message
+
+    @property
+    def progress(self):
+        if self.status == JOB_DONE:
+            return 1.0
+        if not self.total_blocks:
+            return 0.0
+        return min(1.0, self.processed_blocks / float(self.total_blocks))
+
+    def to_dict(self):
+        with self._lock:
+            now = time.time()
+            started = self.started_at or now
+            return {
+                'job_id': self.job_id,
+                'upload_id': self.upload_id,
+                'user_id': self.user_id,
+                'cost': self.cost,
+                'size_class': self.size_class,
+                'status': self.status,
+                'progress': round(self.progress, 4),
+                'processed_blocks': self.processed_blocks,
+                'total_blocks': self.total_blocks,
+                'message': self.message,
+                'error': self.error,
+                'submitted_at': self.submitted_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'queue_wait_seconds': round(started - self.submitted_at, 3),
+                'run_seconds': round((self.finished_at or now) - started, 3) if self.started_at else None,
+                'model_version': self.model_version,
+                'resumed_from_block': self.checkpoint['processed_blocks'] if self.checkpoint else None,
+                'profile': self.profile,
+                'profile_report': self.profile_report,
+            }
+
+
+class JobManager(object):
+    """Bounded worker pool with a queue-depth limit, a scheduler and a job table
+
+    max_workers jobs run concurrently; at most max_queue more wait for a worker, and
+    further submissions raise QueueFullError so the caller can answer 429. Finished
+    jobs stay in the table (up to max_history) so /status can report them.
+
+    A free worker takes the waiting job with the lowest priority value
+
+        cost * (1 + running jobs of its user) / (1 + waited seconds / aging_seconds)
+
+    so small jobs go first, users with jobs already running yield to the others, and
+    waiting steadily raises a large job's priority. A job that has waited max_wait_seconds
+    overtakes every younger job, which bounds starvation.
+
+    on_finished(job) is called on the worker after every job, whether it failed or not.
+    """
+
+    def __init__(self, max_workers=2, max_queue=32, max_history=1000, aging_seconds=30.0,
+                 max_wait_seconds=300.0, on_finished=None):
+        self.max_workers = max_workers
+        self.on_finished = on_finished
+        self.max_queue = max_queue
+        self.max_history = max_history
+        self.aging_seconds = aging_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self._jobs = OrderedDict()
+        self._pending = []
+        self._running = 0
+        self._running_by_user = Counter()
+        self._finished = {JOB_DONE: 0, JOB_FAILED: 0}
+        self._waits = {name: deque(maxlen=WAIT_SAMPLES) for name, _ in SIZE_CLASSES}
+        self._shutdown = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = [threading.Thread(target=self._work, name='analysis_{}'.format(idx), daemon=True)
+                         for idx in range(max_workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job_id, func, *args, upload_id=None, total_blocks=0, user_id=None, cost=None, profile=None,
+               profile_memory=True):
+        """Queue func(job, *args) and return its Job
+
+        cost defaults to total_blocks; see estimate_cost. profile and profile_memory are
+        the profiling options recorded on the job for func to act on. job_id must not be
+        used by another job in the table, queued, running or finished.
+        """
+        if cost is None:
+            cost = estimate_cost(0, total_blocks)
+        job = Job(job_id, upload_id=upload_id, total_blocks=total_blocks, user_id=user_id, cost=cost)
+        job.profile = profile
+        job.profile_memory = profile_memory
+        job.span = instrumentation.current_span()
+        with self._lock:
+            if self._shutdown:
+                raise ShuttingDownError('Job manager is shutting down')
+            if job_id in self._jobs:
+                raise DuplicateJobError(f'Job {job_id} already exists')
+            if len(self._pending) >= self.max_queue:
+                raise QueueFullError(f'Analysis queue is full ({len(self._pending)} jobs waiting)')
+            self._pending.append((job, func, args))
+            self._jobs[job_id] = job
+            self._trim_history()
+            self._wakeup.notify()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            queue_wait = dict()
+            for name, waits in self._waits.items():
+                waits = sorted(waits)
+                queue_wait[name] = {
+                    'samples': len(waits),
+                    'p50_seconds': round(percentile(waits, 50), 3) if waits else None,
+                    'p99_seconds': round(percentile(waits, 99), 3) if waits else None,
+                }
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'queue_depth': len(self._pending),
+                'active_jobs': self._running,
+                'active_users': sum(1 for count in self._running_by_user.values() if count > 0),
+                'jobs': counts,
+                'finished_total': dict(self._finished),
+                'queue_wait': queue_wait,
+            }
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; workers exit once the waiting jobs are done"""
+        with self._lock:
+            self._shutdown = True
+            self._wakeup.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._shutdown:
+                    self._wakeup.wait()
+                if not self._pending:
+                    return
+                job, func, args = self._pending.pop(self._next_index())
+                self._running += 1
+                self._running_by_user[job.user_id] += 1
+                job.status = JOB_RUNNING
+                job.thread_id = threading.get_ident()
+                job.started_at = time.time()
+                job.message = 'Analysis in progress'
+                self._waits[job.size_class].append(job.started_at - job.submitted_at)
+            self._run(job, func, args)
+
+    def _next_index(self):
+        now = time.time()
+
+        def priority(idx):
+            job = self._pending[idx][0]
+            waited = now - job.submitted_at
+            if waited >= self.max_wait_seconds:
+                # Starving jobs go first, oldest first
+                return (0, job.submitted_at)
+            share = 1 + self._running_by_user[job.user_id]
+            return (1, max(job.cost, 1) * share / (1 + waited / self.aging_seconds))
+
+        # min() keeps the earliest of equal priorities, so ties are served in arrival order
+        return min(range(len(self._pending)), key=priority)
+
+    def _run(self, job, func, args):
+        try:
+            with instrumentation.attach(job.span):
+                with instrumentation.timed('analysis_job', job.total_blocks,
+                                           context={'upload_id': job.upload_id, 'job_id': job.job_id},
+                                           size_class=job.size_class,
+                                           queue_wait_seconds=round(job.started_at - job.submitted_at, 6)):
+                    func(job, *args)
+            job.status = JOB_DONE
+            job.message = 'Analysis complete'
+        except Exception as e:
+            job.status = JOB_FAILED
+            job.error = str(e)
+            job.message = 'Analysis failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._running -= 1
+                self._finished[job.status] = self._finished.get(job.status, 0) + 1
+                self._running_by_user[job.user_id] -= 1
+                if not self._running_by_user[job.user_id]:
+                    del self._running_by_user[job.user_id]
+            if self.on_finished is not None:
+                self.on_finished(job)
+
+    def _trim_history(self):
+        # Drop the oldest finished jobs; queued and running jobs are always kept
+        excess = len(self._jobs) - self.max_history
+        if excess <= 0:
+            return
+        for job_id in list(self._jobs.keys()):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].status in (JOB_DONE, JOB_FAILED):
+                del self._jobs[job_id]
+                excess -= 1
@@ -0,0 +1,256 @@
+"""
+Live anomaly detection on a growing HDFS log
+Raw log lines are read as they are written, from a followed file or a local TCP socket,
+into a bounded set of open block sessions (loglizer.sessions.LiveSessions). Each session
+is scored with the active model version as soon as it closes, and the sessions scoring
+at or above the alert threshold are reported as alerts.
+"""
+
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+from loglizer import instrumentation
+from loglizer.scoring import render_reasons, score_sessions
+from analysis_service.jobs import percentile
+
+
+class LiveDetector(object):
+    """Score the sessions of a LiveSessions as they close and emit the alerts
+
+    feed(lines) may be called from any number of source threads; a ticker thread closes
+    the idle and terminated sessions every tick_seconds. get_model() returns the
+    DeployedModel to score with, so a swapped-in version is used from the next batch on.
+    on_alert(alerts) is called with lists of alert dicts on a thread of its own, so a
+    slow receiver delays neither reading nor scoring; alerts are dropped while
+    max_pending lists are waiting for it.
+    """
+
+    def __init__(self, sessions, get_model, on_alert, threshold=0.5, top_k=3, tick_seconds=0.1, max_pending=1000):
+        self.sessions = sessions
+        self.threshold = threshold
+        self.top_k = top_k
+        self.tick_seconds = tick_seconds
+        self.templates = sessions.matcher.templates
+        self._get_model = get_model
+        self._on_alert = on_alert
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._pending = queue.Queue(maxsize=max_pending)
+        self.closed = Counter()
+        self.alerts = 0
+        self.dropped = 0
+        self.max_open = 0
+        # Seconds from the time a session was due to close until its score was known
+        self._latencies = deque(maxlen=10000)
+        self.recent_alerts = deque(maxlen=100)
+
+    def start(self):
+        threading.Thread(target=self._tick, name='live_ticker', daemon=True).start()
+        threading.Thread(target=self._deliver, name='live_alerts', daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop ticking and score the sessions still open"""
+        self._stopped.set()
+        with self._lock:
+            self._score(self.sessions.close_all(time.monotonic()))
+
+    def feed(self, lines):
+        """Add complete raw log lines and score the sessions they closed"""
+        with self._lock:
+            closed = self.sessions.add_lines(lines, time.monotonic())
+            self.max_open = max(self.max_open, len(self.sessions))
+            self._score(closed)
+
+    def expire(self):
+        """Close and score the sessions due now; the ticker thread calls it every tick"""
+        with self._lock:
+            self._score(self.sessions.expire(time.monotonic()))
+
+    def _tick(self):
+        while not self._stopped.wait(self.tick_seconds):
+            try:
+                self.expire()
+            except Exception as e:
+                print(f"⚠️  Live detection: {e}")
+
+    def _score(self, closed):
+        if not closed:
+            return
+        deployed = self._get_model()
+        x_seq = np.empty(len(closed), dtype=object)
+        for i, session in enumerate(closed):
+            x_seq[i] = session[1]
+        with instrumentation.timed('live_score', len(closed), model_version=deployed.version):
+            scores, top_idx, top_values = score_sessions(deployed.model, deployed.extractor, x_seq,
+                                                         top_k=max(self.top_k, 1))
+            reasons = render_reasons(top_idx, top_values, deployed.extractor.events, self.templates,
+                                     num_instances=len(closed))
+        now = time.monotonic()
+        detected_at = time.time()
+        alerts = []
+        for (block_id, events, reason, due), score, explanation in zip(closed, scores, reasons):
+            self.closed[reason] += 1
+            self._latencies.append(max(now - due, 0.0))
+            if score >= self.threshold:
+                alerts.append({
+                    'block_id': block_id,
+                    'anomaly_score': round(float(score) * 100, 2),
+                    'anomaly_probability': float(score),
+                    'reason': explanation,
+                    'events': len(events),
+                    'closed_by': reason,
+                    'latency_seconds': round(now - due, 6),
+                    'detected_at': detected_at,
+                    'model_version': deployed.version,
+                })
+        if not alerts:
+            return
+        self.alerts += len(alerts)
+        self.recent_alerts.extend(alerts)
+        try:
+            self._pending.put_nowait(alerts)
+        except queue.Full:
+            self.dropped += len(alerts)
+
+    def _deliver(self):
+        while True:
+            alerts = self._pending.get()
+            try:
+                self._on_alert(alerts)
+            except Exception as e:
+                print(f"⚠️  Error sending {len(alerts)} live alerts: {e}")
+
+    def recent(self):
+        """The last alerts, oldest first"""
+        with self._lock:
+            return list(self.recent_alerts)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                'open_sessions': len(self.sessions),
+                'max_open_sessions': self.max_open,
+                'lines': self.sessions.num_lines,
+                'unmatched_lines': self.sessions.num_unmatched,
+                'closed_sessions': dict(self.closed),
+                'alerts': self.alerts,
+                'alerts_dropped': self.dropped,
+                'alerts_pending': self._pending.qsize(),
+                'score_latency_p50_seconds': round(percentile(latencies, 50), 6) if latencies else None,
+                'score_latency_p99_seconds': round(percentile(latencies, 99), 6) if latencies else None,
+            }
+
+
+class FileTail(object):
+    """Follow a growing log file like tail -F, passing its complete lines to feed(lines)
+
+    Reading starts at the end of the file unless from_start. A file that is replaced or
+    truncated, e.g. by log rotation, is reopened and read from its start; until it exists
+    the path is polled every poll_seconds.
+    """
+
+    def __init__(self, path, feed, poll_seconds=0.1, from_start=False, read_bytes=1 << 20):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.from_start = from_start
+        self.read_bytes = read_bytes
+        self.reopened = 0
+        self._feed = feed
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name='live_file_tail', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        f, inode, partial = None, None, b''
+        from_start = self.from_start
+        while not self._stopped.is_set():
+            if f is None:
+                try:
+                    f = open(self.path, 'rb')
+                except OSError:
+                    self._stopped.wait(self.poll_seconds)
+                    continue
+                if not from_start:
+                    f.seek(0, os.SEEK_END)
+                inode, partial = os.fstat(f.fileno()).st_ino, b''
+                # A file that appears later, or replaces this one, is new and read whole
+                from_start = True
+            data = f.read(self.read_bytes)
+            if data:
+                lines = (partial + data).split(b'\n')
+                partial = lines.pop()
+                if lines:
+                    self._feed(lines)
+                continue
+            try:
+                status = os.stat(self.path)
+            except OSError:
+                status = None
+            if status is None or status.st_ino != inode or status.st_size < f.tell():
+                f.close()
+                f = None
+                self.reopened += 1
+                continue
+            self._stopped.wait(self.poll_seconds)
+        if f is not None:
+            f.close()
+
+
+class SocketSource(object):
+    """Accept connections on a local TCP port and pass their complete lines to feed(lines)
+
+    e.g. `tail -F HDFS.log | nc localhost 5560`; every connection is read on a thread of
+    its own. port 0 picks a free port, see address.
+    """
+
+    def __init__(self, feed, host='127.0.0.1', port=0, read_bytes=1 << 16):
+        self.connections = 0
+        feed_lines, read_size, source = feed, read_bytes, self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                source.connections += 1
+                partial = b''
+                while True:
+                    try:
+                        data = self.request.recv(read_size)
+                    except OSError:
+                        break
+                    if not data:
+                        break
+                    lines = (partial + data).split(b'\n')
+                    partial = lines.pop()
+                    if lines:
+                        feed_lines(lines)
+                if partial:
+                    feed_lines([partial])
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler, bind_and_activate=False)
+        self._server.daemon_threads = True
+        self._server.allow_reuse_address = True
+        self._server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.server_bind()
+        self._server.server_activate()
+        self.address = self._server.server_address
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='live_socket', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,221 @@
+"""
+Prometheus metrics for the HDFS analysis service
+Counters and histograms updated as the service runs, plus values read from the job
+manager, caches and outbox when /metrics is scraped, rendered in the Prometheus text format.
+"""
+
+import bisect
+import os
+import resource
+import threading
+import time
+from collections import deque
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the latency histograms in seconds, from a single scoring batch to a large upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   120.0, 300.0)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """Monotonic counter, optionally split by labels"""
+
+    kind = COUNTER
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, list(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values, optionally split by labels"""
+
+    kind = HISTOGRAM
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, the +Inf bucket, and the sum of the observed values
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        samples = []
+        for key, counts in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels + [('le', _format_value(float(bound)))], cumulative))
+            samples.append((self.name + '_sum', labels, counts[-1]))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+class Collected(object):
+    """Metric whose value is read when the metrics are rendered
+
+    func returns a number, or a list of (labels dict, value) pairs; None leaves it out.
+    """
+
+    def __init__(self, name, documentation, kind, func):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.func = func
+
+    def samples(self):
+        value = self.func()
+        if value is None:
+            return []
+        if isinstance(value, list):
+            return [(self.name, sorted(labels.items()), sample) for labels, sample in value if sample is not None]
+        return [(self.name, [], value)]
+
+
+class MetricsRegistry(object):
+    """The metrics of one process, rendered together for /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def collect(self, name, documentation, kind, func):
+        """Register a counter or gauge read from func() on every render"""
+        return self._add(Collected(name, documentation, kind, func))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # A broken collector must not take the other metrics down with it
+                print(f"⚠️  Metrics: could not collect {metric.name}: {e}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+
+class StageMetrics(object):
+    """loglizer instrumentation listener recording every stage in a registry"""
+
+    def __init__(self, registry):
+        self.duration = registry.histogram('loglizer_stage_duration_seconds',
+                                           'Duration of one call of a pipeline stage', ['stage'])
+        self.items = registry.counter('loglizer_stage_items_total',
+                                      'Items handled by a pipeline stage (sessions, log lines or bytes)', ['stage'])
+        self.failures = registry.counter('loglizer_stage_failures_total',
+                                         'Calls of a pipeline stage that raised', ['stage'])
+
+    def __call__(self, span):
+        self.duration.observe(span.seconds, stage=span.name)
+        if span.items:
+            self.items.inc(span.items, stage=span.name)
+        if span.failed:
+            self.failures.inc(stage=span.name)
+
+
+class ThroughputMeter(object):
+    """Rate of items over a sliding time window, e.g. scored blocks per second
+
+    Counts are kept in one-second buckets, pruned on every call, so the memory stays
+    bounded by the window whether or not the rate is ever read.
+    """
+
+    def __init__(self, window_seconds=60.0):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._buckets = deque()
+
+    def add(self, count):
+        second = int(time.monotonic())
+        with self._lock:
+            if self._buckets and self._buckets[-1][0] == second:
+                self._buckets[-1][1] += count
+            else:
+                self._buckets.append([second, count])
+            self._prune(second)
+
+    def rate(self):
+        with self._lock:
+            self._prune(int(time.monotonic()))
+            return sum(count for _, count in self._buckets) / self.window_seconds
+
+    def _prune(self, second):
+        cutoff = second - self.window_seconds
+        while self._buckets and self._buckets[0][0] <= cutoff:
+            self._buckets.popleft()
+
+
+def process_rss_bytes():
+    """Resident set size of this process; the peak RSS where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
@@ -0,0 +1,270 @@
+"""
+Durable outbox for the Next.js callbacks
+Callback requests are written to a local SQLite database before they are sent. Delivery
+threads post them with a pooled HTTP session, retry failures with exponential backoff and
+jitter, and pick up whatever is left in the database after a restart. Several processes,
+e.g. gunicorn workers, may share the database. A request with an Idempotency-Key header is
+only added once for each key.
+"""
+
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import requests
+
+from loglizer import instrumentation
+from analysis_service.jobs import percentile
+from analysis_service.delivery import IDEMPOTENCY_HEADER
+
+STATUS_PENDING = 'pending'
+STATUS_DEAD = 'dead'
+STATUS_DELIVERED = 'delivered'
+
+# Number of recent delivery latencies kept for the percentiles
+LATENCY_SAMPLES = 1000
+
+# Idle delivery threads look for requests added or released by other processes this often
+POLL_SECONDS = 5.0
+
+# Delivered requests with an idempotency key are kept, without their body, this long
+KEY_RETENTION_SECONDS = 7 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stream TEXT NOT NULL,
+    url TEXT NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    idempotency_key TEXT,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_stream ON outbox(stream, id);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, next_attempt_at);
+"""
+
+# Columns added to the schema since the first release, created in older outboxes on open
+_MIGRATIONS = (('claimed_until', 'REAL NOT NULL DEFAULT 0'), ('idempotency_key', 'TEXT'))
+
+# Indexes on migrated columns, created once the columns exist
+_INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_key ON outbox(idempotency_key) WHERE idempotency_key IS NOT NULL;
+"""
+
+
+def backoff_delay(attempts, base_seconds, max_seconds):
+    """Exponential backoff with full jitter after the given number of failed attempts"""
+    return random.uniform(0, min(max_seconds, base_seconds * 2 ** attempts))
+
+
+class CallbackOutbox(object):
+    """Disk-backed queue of callback requests with background delivery
+
+    Requests of one stream (e.g. one job) are delivered in the order they were added; a
+    request waits until all earlier requests of its stream are delivered or dead, so the
+    completion marker never overtakes its result batches. A request that failed
+    max_attempts times is kept as dead instead of being retried forever.
+
+    A request is leased by the process sending it, so processes sharing the database
+    never send it at the same time; the lease of a process that died expires after twice
+    the request timeout.
+
+    A delivered request with an idempotency key is kept as delivered, without its body,
+    for KEY_RETENTION_SECONDS; adding a request with a key already in the outbox is a
+    no-op, so a job resumed after a restart does not send its batches twice.
+    """
+
+    def __init__(self, path, workers=2, max_attempts=20, base_delay_seconds=0.5, max_delay_seconds=300.0,
+                 timeout=10, session=None):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.timeout = timeout
+        self.lease_seconds = 2 * timeout + 5
+        self.session = session or requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dead = 0
+        self.duplicates = 0
+        self._pruned_at = 0.0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._sending = set()
+        # Span current when each request was added, the parent of its delivery spans
+        self._spans = dict()
+        self._closed = False
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(outbox)')]
+        for column, column_type in _MIGRATIONS:
+            if column not in columns:
+                self._db.execute(f'ALTER TABLE outbox ADD COLUMN {column} {column_type}')
+        self._db.executescript(_INDEXES)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self.replayed = self._db.execute('SELECT COUNT(*) FROM outbox WHERE status = ?',
+                                         (STATUS_PENDING,)).fetchone()[0]
+        self._threads = [threading.Thread(target=self._work, name='outbox_{}'.format(idx), daemon=True)
+                         for idx in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def enqueue(self, stream, url, body, headers):
+        """Persist a request; it is delivered in the background
+
+        Returns its id, or None when a request with the same idempotency key was added before.
+        """
+        now = time.time()
+        key = headers.get(IDEMPOTENCY_HEADER)
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO outbox (stream, url, headers, body, created_at, next_attempt_at, '
+                'idempotency_key) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (stream, url, json.dumps(headers), sqlite3.Binary(body), now, now, key))
+            if not cursor.rowcount:
+                self.duplicates += 1
+                return None
+            span = instrumentation.current_span()
+            if span is not None:
+                self._spans[cursor.lastrowid] = span
+            self._wakeup.notify()
+            return cursor.lastrowid
+
+    def poster(self, stream):
+        """Return a post(url, body, headers) function that enqueues into the given stream"""
+        return lambda url, body, headers: self.enqueue(stream, url, body, headers)
+
+    def stats(self):
+        with self._lock:
+            pending, oldest = self._db.execute(
+                'SELECT COUNT(*), MIN(created_at) FROM outbox WHERE status = ?', (STATUS_PENDING,)).fetchone()
+            dead = self._db.execute('SELECT COUNT(*) FROM outbox WHERE status = ?', (STATUS_DEAD,)).fetchone()[0]
+            latencies = sorted(self._latencies)
+            return {
+                'backlog': pending,
+                'oldest_pending_seconds': round(time.time() - oldest, 3) if oldest else None,
+                'dead': dead,
+                'delivered': self.delivered,
+                'failed_attempts': self.failed_attempts,
+                'duplicates_ignored': self.duplicates,
+                'replayed_on_start': self.replayed,
+                'delivery_latency_p50_seconds': round(percentile(latencies, 50), 4) if latencies else None,
+                'delivery_latency_p99_seconds': round(percentile(latencies, 99), 4) if latencies else None,
+            }
+
+    def wait_idle(self, timeout=None):
+        """Block until no request is pending; returns whether that happened within timeout"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                pending = self._db.execute('SELECT COUNT(*) FROM outbox WHERE status = ?',
+                                           (STATUS_PENDING,)).fetchone()[0]
+            if pending == 0:
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._db.close()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while True:
+                    if self._closed:
+                        return
+                    message, wait = self._claim()
+                    if message is not None:
+                        break
+                    self._wakeup.wait(POLL_SECONDS if wait is None else min(wait, POLL_SECONDS))
+            self._deliver(*message)
+
+    def _claim(self):
+        # The head of every stream is the oldest request of that stream still pending
+        now = time.time()
+        heads = self._db.execute(
+            'SELECT id, stream, next_attempt_at, claimed_until FROM outbox o WHERE status = ? AND NOT EXISTS '
+            '(SELECT 1 FROM outbox p WHERE p.stream = o.stream AND p.status = ? AND p.id < o.id) '
+            'ORDER BY next_attempt_at, id', (STATUS_PENDING, STATUS_PENDING)).fetchall()
+        for message_id, stream, next_attempt_at, claimed_until in heads:
+            if stream in self._sending or claimed_until > now:
+                continue
+            if next_attempt_at > now:
+                return None, next_attempt_at - now
+            # Another process may have claimed it since the select
+            claimed = self._db.execute('UPDATE outbox SET claimed_until = ? WHERE id = ? AND claimed_until <= ?',
+                                       (now + self.lease_seconds, message_id, now)).rowcount
+            if not claimed:
+                continue
+            self._sending.add(stream)
+            return self._db.execute('SELECT id, stream, url, headers, body, created_at, attempts FROM outbox '
+                                    'WHERE id = ?', (message_id,)).fetchone(), None
+        return None, None
+
+    def _deliver(self, message_id, stream, url, headers, body, created_at, attempts):
+        error = None
+        with self._lock:
+            parent = self._spans.get(message_id)
+        try:
+            with instrumentation.attach(parent):
+                with instrumentation.timed('callback_delivery', len(body), url=url, attempt=attempts + 1) as span:
+                    response = self.session.post(url, data=body, headers=json.loads(headers), timeout=self.timeout)
+                    span.attributes['status_code'] = response.status_code
+                    response.raise_for_status()
+        except Exception as e:
+            error = str(e)
+        with self._lock:
+            self._sending.discard(stream)
+            if error is None:
+                self._spans.pop(message_id, None)
+                # Requests without a key have nothing to be recognized by later
+                self._db.execute("UPDATE outbox SET status = ?, body = X'', attempts = ? WHERE id = ? "
+                                 "AND idempotency_key IS NOT NULL", (STATUS_DELIVERED, attempts + 1, message_id))
+                self._db.execute('DELETE FROM outbox WHERE id = ? AND idempotency_key IS NULL', (message_id,))
+                self.delivered += 1
+                self._latencies.append(time.time() - created_at)
+                self._prune()
+            else:
+                attempts += 1
+                self.failed_attempts += 1
+                if self.max_attempts and attempts >= self.max_attempts:
+                    self._db.execute('UPDATE outbox SET status = ?, attempts = ?, last_error = ? WHERE id = ?',
+                                     (STATUS_DEAD, attempts, error, message_id))
+                    self.dead += 1
+                    self._spans.pop(message_id, None)
+                    print(f"✗ Outbox: giving up on {url} after {attempts} attempts: {error}")
+                else:
+                    next_attempt_at = time.time() + backoff_delay(attempts, self.base_delay_seconds,
+                                                                  self.max_delay_seconds)
+                    self._db.execute('UPDATE outbox SET attempts = ?, next_attempt_at = ?, claimed_until = 0, '
+                                     'last_error = ? WHERE id = ?', (attempts, next_attempt_at, error, message_id))
+            self._wakeup.notify_all()
+
+    def _prune(self):
+        # At most once a minute, forget the delivered keys older than the retention
+        now = time.time()
+        if now - self._pruned_at < 60:
+            return
+        self._pruned_at = now
+        self._db.execute('DELETE FROM outbox WHERE status = ? AND created_at < ?',
+                         (STATUS_DELIVERED, now - KEY_RETENTION_SECONDS))
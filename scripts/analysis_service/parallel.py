@@ -0,0 +1,160 @@
+"""
+Intra-job data parallelism for large uploads
+Shards one structured log across a process pool: workers parse byte ranges of the log
+into per-block event counts, then score row shards with the models the workers loaded.
+Each task carries the coordinator's current span; the workers' stage spans continue its
+trace and are sent back with their results to be reported in the coordinator, so they
+show up in its metrics and traces.
+"""
+
+import multiprocessing
+import os
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from loglizer import dataloader, preprocessing, instrumentation
+from loglizer.scoring import model_version, score_counts
+
+# Per-process state of pool workers, set by _init_worker
+_worker = {}
+
+# Model versions kept loaded per worker, so jobs on the previous version finish without reloads
+WORKER_MODELS = 2
+
+
+def _init_worker(model_path, events, top_k):
+    extractor = preprocessing.FeatureExtractor()
+    extractor.inference_mode(events)
+    models = OrderedDict([(model_version(model_path), joblib.load(model_path))])
+    _worker.update(extractor=extractor, top_k=top_k, models=models, stages=[])
+    instrumentation.add_listener(_log_stage)
+
+
+def _log_stage(span):
+    _worker['stages'].append(span)
+
+
+def _take_stages():
+    stages = _worker['stages']
+    _worker['stages'] = []
+    return stages
+
+
+def _report_stages(stages):
+    for span in stages:
+        instrumentation.record(span)
+
+
+def _worker_model(version, model_path):
+    # Load the version the coordinator scores with on first use, dropping the least recently used
+    models = _worker['models']
+    if version not in models:
+        models[version] = joblib.load(model_path)
+        while len(models) > WORKER_MODELS:
+            models.popitem(last=False)
+    models.move_to_end(version)
+    return models[version]
+
+
+def _count_range(task):
+    log_file, start, end, parent = task
+    with instrumentation.attach(parent):
+        pairs, templates = dataloader.load_HDFS_pairs(log_file, start, end)
+        block_codes, blocks = pd.factorize(pairs['BlockId'])
+        X_counts = _worker['extractor'].count_pairs(block_codes, pairs['EventId'].values, len(blocks))
+    return np.asarray(blocks, dtype=object), X_counts, templates, _take_stages()
+
+
+def _score_shard(task):
+    version, model_path, X_counts, parent = task
+    with instrumentation.attach(parent):
+        result = score_counts(_worker_model(version, model_path), _worker['extractor'], X_counts, _worker['top_k'])
+    return result, _take_stages()
+
+
+class ShardedScorer(object):
+    """Process pool that parses and scores one structured HDFS log in shards
+
+    Parsing is split into line-aligned byte ranges of the log. Event counts of a block
+    add up across ranges, so each worker returns the counts of the blocks it saw and
+    the coordinator sums them; no event sequences cross process boundaries. The count
+    matrix is then scored in row shards. Shards are returned in block order, so results
+    are identical to single-process scoring whatever the number of workers.
+    """
+
+    def __init__(self, model_path, num_workers, shard_size=20000, top_k=3, events=None):
+        self.model_path = model_path
+        self.num_workers = num_workers
+        self.shard_size = shard_size
+        self.top_k = top_k
+        self.extractor = preprocessing.FeatureExtractor()
+        self.extractor.inference_mode(events)
+        assert not self.extractor.oov, 'OOV counts are not additive across shards.'
+        # Workers are forked while the coordinator has no other threads yet, so they
+        # share the imported modules; spawn would re-run the calling script instead
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self._pool = context.Pool(num_workers, initializer=_init_worker,
+                                  initargs=(model_path, self.extractor.events, top_k))
+
+    def count_blocks(self, log_file, block_ids=None):
+        """Parse a structured log into the raw event count matrix of its blocks
+
+        Returns the block ids, their count matrix and the event templates. When block_ids
+        is given the rows follow its order, and blocks absent from the log get zero rows.
+        """
+        ranges = dataloader.split_log_file(log_file, self.num_workers * 4)
+        parent = instrumentation.current_span()
+        parts = self._pool.map(_count_range, [(log_file, start, end, parent) for start, end in ranges])
+        for part in parts:
+            _report_stages(part[3])
+        parts = [part[:3] for part in parts]
+        num_events = len(self.extractor.events)
+        if parts:
+            blocks = np.concatenate([part_blocks for part_blocks, _, _ in parts])
+        else:
+            blocks = np.zeros(0, dtype=object)
+        # Ranges are in file order, so factorizing keeps the order of first appearance
+        block_codes, unique_blocks = pd.factorize(blocks)
+        X_counts = np.zeros((len(unique_blocks) + 1, num_events))
+        templates = dict()
+        offset = 0
+        for part_blocks, part_counts, part_templates in parts:
+            # Blocks are unique within a part, so fancy-index accumulation is safe
+            X_counts[block_codes[offset:offset + len(part_blocks)]] += part_counts
+            offset += len(part_blocks)
+            for event, template in part_templates.items():
+                templates.setdefault(event, template)
+        if block_ids is None:
+            block_ids = list(unique_blocks)
+            return block_ids, X_counts[:-1], templates
+        # Unknown blocks map to -1, i.e. the trailing all-zero row
+        rows = pd.Index(unique_blocks).get_indexer(block_ids)
+        return list(block_ids), X_counts[rows], templates
+
+    def score_shards(self, X_counts, version=None, model_path=None):
+        """Score a count matrix in row shards across the pool
+
+        Yields (start, scores, top_idx, top_values) per shard in row order as soon as the
+        shard and all shards before it are scored; top_idx and top_values are None when
+        top_k is 0 or the model has no feature contributions. The workers score with the
+        model version stored at model_path, the pool's artifact by default; it must use the
+        pool's event vocabulary.
+        """
+        model_path = model_path or self.model_path
+        if version is None:
+            version = model_version(model_path)
+        starts = range(0, X_counts.shape[0], self.shard_size)
+        # Tasks are generated by the pool's thread, so the span is taken here
+        parent = instrumentation.current_span()
+        tasks = ((version, model_path, X_counts[start:start + self.shard_size], parent) for start in starts)
+        for start, (result, stages) in zip(starts, self._pool.imap(_score_shard, tasks)):
+            _report_stages(stages)
+            yield (start,) + result
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
@@ -0,0 +1,120 @@
+"""
+Pre-fork serving support for gunicorn (see gunicorn.conf.py)
+The master imports the scoring stack and loads the model once before it forks the workers,
+so they share those pages copy-on-write; everything with threads, database connections or
+processes is started in each worker. Workers are recycled after a number of jobs, and
+finish their jobs and callbacks before they exit.
+"""
+
+import gc
+import os
+import random
+import signal
+import threading
+import time
+
+import numpy as np
+
+from analysis_service.registry import DEFAULT_REGISTRY_DIR, BUNDLED_MODEL_PATH, ModelRegistry, preload
+from loglizer.scoring import score_counts
+
+# State of this process once it is a gunicorn worker; see worker_started
+_worker = {'heartbeat': None, 'max_jobs': 0, 'jobs': 0, 'recycling': False}
+_lock = threading.Lock()
+_drain_callbacks = []
+
+
+def preload_model(registry_dir=None):
+    """Load and warm up the current model version in the gunicorn master
+
+    Workers forked afterwards find it in the registry instead of loading their own copy.
+    The objects allocated so far are frozen out of the garbage collector, whose passes
+    would otherwise write to every page of them and undo the sharing.
+    """
+    start = time.time()
+    registry = ModelRegistry(registry_dir or os.getenv('MODEL_REGISTRY_DIR', DEFAULT_REGISTRY_DIR),
+                             default_path=BUNDLED_MODEL_PATH)
+    deployed = registry.load(registry.current_version())
+    # Pays for the lazy imports of the scoring path once, before the fork
+    score_counts(deployed.model, deployed.extractor, np.ones((1, len(deployed.events))), top_k=1)
+    preload(deployed)
+    gc.collect()
+    gc.freeze()
+    print(f"✅ Preloaded model version {deployed.version} for the workers in {time.time() - start:.2f}s")
+    return deployed
+
+
+def worker_started(heartbeat_fd, max_jobs=0, max_jobs_jitter=0):
+    """Mark this process as a worker that is recycled after max_jobs finished jobs
+
+    heartbeat_fd is a duplicate of the worker's gunicorn heartbeat file, kept alive while
+    the worker drains. A random jitter of up to max_jobs_jitter spreads the recycling of
+    workers that started together.
+    """
+    _worker['heartbeat'] = heartbeat_fd
+    if max_jobs > 0:
+        _worker['max_jobs'] = max_jobs + random.randint(0, max(max_jobs_jitter, 0))
+
+
+def in_worker():
+    return _worker['heartbeat'] is not None
+
+
+def on_drain(func):
+    """Register func() to run when the worker exits, e.g. to finish queued jobs"""
+    _drain_callbacks.append(func)
+
+
+def job_finished(job):
+    """Count a finished job; the worker asks gunicorn to replace it once it ran max_jobs
+
+    gunicorn stops sending it requests right away; queued and running jobs finish in drain().
+    """
+    if not _worker['max_jobs']:
+        return
+    with _lock:
+        _worker['jobs'] += 1
+        if _worker['recycling'] or _worker['jobs'] < _worker['max_jobs']:
+            return
+        _worker['recycling'] = True
+    print(f"♻️  Worker {os.getpid()} ran {_worker['jobs']} jobs, recycling it")
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def drain(timeout=None):
+    """Run the drain callbacks, keeping the gunicorn heartbeat alive meanwhile
+
+    Returns whether they finished within timeout seconds.
+    """
+    thread = threading.Thread(target=_run_drain_callbacks, name='drain', daemon=True)
+    thread.start()
+    deadline = None if timeout is None else time.time() + timeout
+    while thread.is_alive():
+        _notify()
+        if deadline is not None and time.time() >= deadline:
+            print(f"⚠️  Worker {os.getpid()} exits with unfinished jobs after {timeout}s")
+            return False
+        thread.join(1.0)
+    return True
+
+
+def stats():
+    return {'pid': os.getpid(), 'jobs': _worker['jobs'], 'max_jobs': _worker['max_jobs'],
+            'recycling': _worker['recycling']} if in_worker() else None
+
+
+def _run_drain_callbacks():
+    for func in _drain_callbacks:
+        try:
+            func()
+        except Exception as e:
+            print(f"⚠️  Drain callback failed: {e}")
+
+
+def _notify():
+    # The arbiter kills workers whose heartbeat file is older than its timeout
+    now = time.monotonic()
+    try:
+        os.utime(_worker['heartbeat'], (now, now))
+    except (OSError, TypeError):
+        pass
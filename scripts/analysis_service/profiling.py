@@ -0,0 +1,196 @@
+"""
+On-demand profiling of single analysis jobs
+A profiled job runs under cProfile, or is sampled from a separate thread, and tracemalloc
+can record its memory; the reports are written to a directory of the job for download.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+MODE_CPROFILE = 'cprofile'
+MODE_SAMPLING = 'sampling'
+PROFILE_MODES = (MODE_CPROFILE, MODE_SAMPLING)
+
+# Rows of the text reports
+REPORT_LINES = 40
+
+# tracemalloc is process-wide, so only one profiled job at a time records memory
+_memory_lock = threading.Lock()
+
+
+def parse_mode(value):
+    """Return the profiling mode asked for by a request field, or None
+
+    true, 1 and yes select cProfile; raises ValueError for an unknown mode.
+    """
+    if value is None or value is False:
+        return None
+    mode = str(value).strip().lower()
+    if mode in ('', '0', 'false', 'no', 'none'):
+        return None
+    if mode in ('1', 'true', 'yes'):
+        return MODE_CPROFILE
+    if mode not in PROFILE_MODES:
+        raise ValueError(f'Unknown profile mode: {value} (use one of {", ".join(PROFILE_MODES)})')
+    return mode
+
+
+def parse_flag(value, default=False):
+    """Return a boolean request field or query parameter"""
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes')
+
+
+class StackSampler(object):
+    """Sample the Python stack of one thread at a fixed interval
+
+    Stacks are counted in the collapsed format of flame graph tools, root first, so
+    the job thread itself runs without any tracing overhead.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile_sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def summary(self, limit=REPORT_LINES):
+        """Functions by the share of samples they were on the stack (total) or on top (self)"""
+        total = Counter()
+        own = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        lines = [f'{self.samples} samples every {self.interval * 1000:.1f} ms',
+                 f'{"total %":>8} {"self %":>8}  function']
+        for name, count in total.most_common(limit):
+            lines.append(f'{100.0 * count / max(self.samples, 1):8.1f} '
+                         f'{100.0 * own[name] / max(self.samples, 1):8.1f}  {name}')
+        return '\n'.join(lines) + '\n'
+
+
+class JobProfiler(object):
+    """Profile one job and write its reports into out_dir
+
+    cProfile traces the thread that calls start(), so it has to be started by the job
+    itself. The sampler can be attached to a running job's thread from any thread.
+    With memory, tracemalloc records the peak memory; it slows allocation-heavy code such
+    as parsing down about twofold, which the time profile then includes.
+    """
+
+    def __init__(self, mode, out_dir, thread_id=None, sample_interval=0.005, memory=True):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f'Unknown profile mode: {mode}')
+        self.mode = mode
+        self.out_dir = out_dir
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.sample_interval = sample_interval
+        self.memory = memory
+        self.started_at = None
+        self._profile = None
+        self._sampler = None
+        self._memory = False
+
+    def start(self):
+        self.started_at = time.time()
+        if self.memory and _memory_lock.acquire(blocking=False):
+            self._memory = True
+            tracemalloc.start()
+        if self.mode == MODE_CPROFILE:
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:
+                # Python 3.12+ allows one active cProfile per process; sample this job instead
+                self._profile = None
+                self.mode = MODE_SAMPLING
+        if self.mode == MODE_SAMPLING:
+            self._sampler = StackSampler(self.thread_id, self.sample_interval)
+            self._sampler.start()
+        return self
+
+    def stop(self):
+        """Stop profiling, write the report files and return a summary of them"""
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        report = {
+            'mode': self.mode,
+            'started_at': self.started_at,
+            'seconds': round(time.time() - self.started_at, 3),
+            'files': [],
+            'peak_memory_bytes': None,
+        }
+        os.makedirs(self.out_dir, exist_ok=True)
+        if self._memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _memory_lock.release()
+            report['peak_memory_bytes'] = peak
+            self._write(report, 'memory.txt', self._memory_report(snapshot, current, peak))
+        elif self.memory:
+            report['memory_note'] = 'Another profiled job was recording memory'
+        if self._profile is not None:
+            self._profile.dump_stats(os.path.join(self.out_dir, 'cprofile.pstats'))
+            report['files'].append('cprofile.pstats')
+            text = io.StringIO()
+            pstats.Stats(self._profile, stream=text).sort_stats('cumulative').print_stats(REPORT_LINES)
+            self._write(report, 'cprofile.txt', text.getvalue())
+        if self._sampler is not None:
+            report['samples'] = self._sampler.samples
+            self._write(report, 'sampling.collapsed', self._sampler.collapsed())
+            self._write(report, 'sampling.txt', self._sampler.summary())
+        return report
+
+    def _write(self, report, name, text):
+        with open(os.path.join(self.out_dir, name), 'w', encoding='utf-8') as f:
+            f.write(text)
+        report['files'].append(name)
+
+    @staticmethod
+    def _memory_report(snapshot, current, peak):
+        lines = [f'Peak traced memory: {peak / 1024 / 1024:.1f} MB',
+                 f'Still allocated at the end: {current / 1024 / 1024:.1f} MB', '',
+                 'Largest allocation sites still alive at the end:']
+        for stat in snapshot.statistics('lineno')[:REPORT_LINES]:
+            lines.append(str(stat))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,128 @@
+"""
+Background model loading and readiness of the HDFS analysis service
+The model is loaded and warmed up on a synthetic batch in a background thread while the
+server already accepts connections; /ready fails until that is done.
+"""
+
+import os
+import socket
+import threading
+import time
+import traceback
+
+STATE_LOADING = 'loading'
+STATE_WARMING_UP = 'warming_up'
+STATE_READY = 'ready'
+STATE_FAILED = 'failed'
+
+
+class ModelNotReadyError(Exception):
+    """Raised when the model is needed before it was loaded, or after loading failed"""
+
+
+def process_start_time():
+    """Wall-clock start time of this process, from /proc where available"""
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name may contain spaces, so the fields are counted after its ')'
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+def sd_notify(message):
+    """Send a state such as READY=1 to systemd when it started the service with Type=notify"""
+    address = os.getenv('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(message.encode('utf-8'))
+        return True
+    except OSError as e:
+        print(f"⚠️  Could not notify systemd: {e}")
+        return False
+
+
+class ModelLoader(object):
+    """Load a model and warm it up in a background thread
+
+    load() returns the model; warm_up(model) runs a first inference so that lazy imports,
+    allocations and caches are paid for before real traffic arrives. Callers needing the
+    model block in wait() until it is ready.
+    """
+
+    def __init__(self, load, warm_up=None, started_at=None):
+        self._load = load
+        self._warm_up = warm_up
+        self.started_at = started_at if started_at is not None else time.time()
+        self.state = STATE_LOADING
+        self.model = None
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.ready_at = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='model_loader', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            start = time.time()
+            model = self._load()
+            self.load_seconds = time.time() - start
+            self.state = STATE_WARMING_UP
+            if self._warm_up is not None:
+                start = time.time()
+                self._warm_up(model)
+                self.warmup_seconds = time.time() - start
+            self.model = model
+            self.ready_at = time.time()
+            self.state = STATE_READY
+            print(f"✅ Ready {self.ready_at - self.started_at:.2f}s after start "
+                  f"(model load {self.load_seconds:.2f}s, warm-up {self.warmup_seconds or 0:.2f}s)")
+            sd_notify('READY=1')
+        except Exception as e:
+            self.error = f'{type(e).__name__}: {e}'
+            self.state = STATE_FAILED
+            print(f"✗ Model loading failed: {self.error}")
+            traceback.print_exc()
+            sd_notify(f'STATUS=Model loading failed: {self.error}')
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self.state == STATE_READY
+
+    def wait(self, timeout=None):
+        """Return the model once it is ready; raises ModelNotReadyError on failure or timeout"""
+        if not self._ready.wait(timeout):
+            raise ModelNotReadyError(f'Model is still {self.state}')
+        if self.state != STATE_READY:
+            raise ModelNotReadyError(f'Model loading failed: {self.error}')
+        return self.model
+
+    def time_to_ready(self):
+        return self.ready_at - self.started_at if self.ready_at is not None else None
+
+    def status(self):
+        time_to_ready = self.time_to_ready()
+        return {
+            'ready': self.ready,
+            'state': self.state,
+            'error': self.error,
+            'uptime_seconds': round(time.time() - self.started_at, 3),
+            'load_seconds': round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            'warmup_seconds': round(self.warmup_seconds, 3) if self.warmup_seconds is not None else None,
+            'time_to_ready_seconds': round(time_to_ready, 3) if time_to_ready is not None else None,
+        }
@@ -0,0 +1,332 @@
+"""
+Versioned model registry of the HDFS analysis service
+Each version is a directory holding a pipeline artifact, model.joblib plus an optional
+pipeline.json with its event vocabulary; CURRENT names the active version. A new version is
+loaded and warmed up in the background and swapped in for new jobs, while running jobs
+finish on the version they started with. A shadow version can score sampled batches next
+to the active one to compare their latency and scores.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+import joblib
+import numpy as np
+
+from loglizer import preprocessing
+from loglizer.scoring import model_version, score_counts
+
+ARTIFACT_FILE = 'model.joblib'
+PIPELINE_FILE = 'pipeline.json'
+CURRENT_FILE = 'CURRENT'
+
+DEFAULT_REGISTRY_DIR = 'model_registry'
+
+# The model shipped in the scripts directory, the only version of an empty registry
+BUNDLED_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'loglizer_LR_model_benchmark.joblib')
+
+# Versions loaded before the process forked, e.g. by the gunicorn master; see preload
+_preloaded = {}
+
+
+class UnknownVersionError(Exception):
+    """Raised when a version is not in the registry"""
+
+
+class DeployedModel(object):
+    """A loaded model version with the event vocabulary its features were built from"""
+
+    def __init__(self, version, path, model, events=None):
+        self.version = version
+        self.path = path
+        self.model = model
+        self.extractor = preprocessing.FeatureExtractor()
+        self.extractor.inference_mode(events)
+        self.events = self.extractor.events
+        self.loaded_at = time.time()
+
+    def to_dict(self):
+        return {'version': self.version, 'path': self.path, 'events': len(self.events),
+                'loaded_at': self.loaded_at}
+
+
+class ModelRegistry(object):
+    """Model versions under a directory, with an active and an optional shadow version
+
+    Without any version directory the bundled artifact default_path is the only version,
+    named by its content hash. warm_up(deployed) runs on a version before it is swapped
+    in, and on_activate(deployed) right after.
+    """
+
+    def __init__(self, path, default_path=None, warm_up=None, on_activate=None):
+        self.path = path
+        self.default_path = default_path
+        self._warm_up = warm_up
+        self._on_activate = on_activate
+        self._active = None
+        self._shadow = None
+        # Version being loaded in the background, and the last failed load
+        self.pending = None
+        self.error = None
+        self.swaps = 0
+        self._lock = threading.Lock()
+        self._default_version = model_version(default_path) if default_path else None
+
+    def versions(self):
+        """Return version -> artifact path of every version in the registry"""
+        versions = dict()
+        if self.path and os.path.isdir(self.path):
+            for name in sorted(os.listdir(self.path)):
+                artifact = os.path.join(self.path, name, ARTIFACT_FILE)
+                if os.path.isfile(artifact):
+                    versions[name] = artifact
+        if not versions and self._default_version:
+            versions[self._default_version] = self.default_path
+        return versions
+
+    def current_version(self):
+        """The version named in CURRENT, else the only or newest version by name"""
+        try:
+            with open(os.path.join(self.path, CURRENT_FILE), encoding='utf-8') as f:
+                name = f.read().strip()
+            if name:
+                return name
+        except (OSError, TypeError):
+            pass
+        versions = self.versions()
+        return max(versions) if versions else None
+
+    def load(self, version):
+        """Load a version from disk, without activating it"""
+        path = self.versions().get(version)
+        if path is None:
+            raise UnknownVersionError(f'Unknown model version: {version}')
+        deployed = _preloaded.get(version)
+        if deployed is not None and deployed.path == path:
+            return deployed
+        events = None
+        pipeline_path = os.path.join(os.path.dirname(path), PIPELINE_FILE)
+        if os.path.isfile(pipeline_path):
+            with open(pipeline_path, encoding='utf-8') as f:
+                events = json.load(f).get('events')
+        return DeployedModel(version, path, joblib.load(path), events)
+
+    def load_current(self):
+        """Load the current version and make it active; for the startup ModelLoader"""
+        deployed = self.load(self.current_version())
+        self._swap(deployed)
+        return deployed
+
+    def active(self):
+        return self._active
+
+    def shadow(self):
+        return self._shadow
+
+    def activate(self, version):
+        """Load, warm up and swap in a version on a background thread
+
+        Returns False when the version is already active or being loaded.
+        """
+        if version not in self.versions():
+            raise UnknownVersionError(f'Unknown model version: {version}')
+        with self._lock:
+            if version == self.pending or (self._active is not None and self._active.version == version):
+                return False
+            self.pending = version
+        threading.Thread(target=self._load_and_swap, args=(version,), name='model_activate', daemon=True).start()
+        return True
+
+    def set_shadow(self, version):
+        """Load a version to shadow the active one on a background thread; None stops shadowing"""
+        if version is None:
+            self._shadow = None
+            return False
+        if version not in self.versions():
+            raise UnknownVersionError(f'Unknown model version: {version}')
+        threading.Thread(target=self._load_shadow, args=(version,), name='model_shadow', daemon=True).start()
+        return True
+
+    def check_current(self):
+        """Activate the version named in CURRENT when it changed; for the file watcher"""
+        version = self.current_version()
+        active = self._active
+        if version is None or active is None or version in (active.version, self.pending, self.error and self.error[0]):
+            return False
+        return self.activate(version)
+
+    def watch(self, interval):
+        """Poll CURRENT every interval seconds on a background thread"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check_current()
+                except Exception as e:
+                    print(f"⚠️  Model registry: {e}")
+        threading.Thread(target=run, name='model_watcher', daemon=True).start()
+
+    def status(self):
+        active, shadow = self._active, self._shadow
+        return {
+            'path': self.path,
+            'active': active.to_dict() if active else None,
+            'shadow': shadow.to_dict() if shadow else None,
+            'pending': self.pending,
+            'error': {'version': self.error[0], 'error': self.error[1]} if self.error else None,
+            'swaps': self.swaps,
+            'versions': sorted(self.versions()),
+        }
+
+    def _load_and_swap(self, version):
+        try:
+            start = time.time()
+            deployed = self.load(version)
+            if self._warm_up is not None:
+                self._warm_up(deployed)
+            self._swap(deployed)
+            self._write_current(version)
+            print(f"🔄 Activated model version {version} ({time.time() - start:.2f}s to load and warm up)")
+        except Exception as e:
+            self.error = (version, f'{type(e).__name__}: {e}')
+            print(f"✗ Could not activate model version {version}: {self.error[1]}")
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                if self.pending == version:
+                    self.pending = None
+
+    def _load_shadow(self, version):
+        try:
+            deployed = self.load(version)
+            if self._warm_up is not None:
+                self._warm_up(deployed)
+            self._shadow = deployed
+            print(f"👥 Shadowing the active model with version {version}")
+        except Exception as e:
+            self.error = (version, f'{type(e).__name__}: {e}')
+            print(f"✗ Could not load shadow model version {version}: {self.error[1]}")
+
+    def _swap(self, deployed):
+        # Jobs take the active version once when they start, so the swap is one reference
+        with self._lock:
+            previous, self._active = self._active, deployed
+            if previous is not None:
+                self.swaps += 1
+            if self.error and self.error[0] == deployed.version:
+                self.error = None
+        if self._on_activate is not None:
+            self._on_activate(deployed)
+
+    def _write_current(self, version):
+        # Written to a temporary file and renamed, so the watcher never reads half a name
+        if not self.path or not os.path.isdir(self.path) or version == self._default_version:
+            return
+        tmp_path = os.path.join(self.path, CURRENT_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(version + '\n')
+        os.replace(tmp_path, os.path.join(self.path, CURRENT_FILE))
+
+
+def preload(deployed):
+    """Serve a loaded version from memory to every registry of this process and its forks"""
+    _preloaded[deployed.version] = deployed
+
+
+def align_counts(X_counts, events, target_events):
+    """Reorder the columns of a count matrix from one event vocabulary to another
+
+    Events missing from the source vocabulary get zero counts.
+    """
+    if list(events) == list(target_events):
+        return X_counts
+    columns = {event: idx for idx, event in enumerate(events)}
+    X_target = np.zeros((X_counts.shape[0], len(target_events)))
+    for idx, event in enumerate(target_events):
+        if event in columns:
+            X_target[:, idx] = X_counts[:, columns[event]]
+    return X_target
+
+
+class ShadowScorer(object):
+    """Score sampled batches with the shadow version off the job threads
+
+    Every sample_every-th submitted batch is queued and scored, uncached, by both the
+    version the job used and the shadow version, so their latencies are measured on the
+    same rows; batches submitted while max_queue are waiting are dropped rather than slow
+    the job. on_result(primary, shadow, rows, primary_seconds, shadow_seconds, flips) is
+    called per batch; flips counts the rows whose anomaly decision differs at threshold.
+    """
+
+    def __init__(self, registry, sample_every=1, max_queue=4, threshold=0.5, on_result=None):
+        self.registry = registry
+        self.sample_every = max(int(sample_every), 1)
+        self.threshold = threshold
+        self._on_result = on_result
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._submitted = 0
+        self.batches = 0
+        self.dropped = 0
+        self.rows = 0
+        self.flips = 0
+        self.seconds = {'primary': 0.0, 'shadow': 0.0}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._work, name='shadow_scorer', daemon=True)
+        self._thread.start()
+
+    def submit(self, deployed, X_counts):
+        """Offer the count matrix of a batch scored with deployed; returns whether it was queued"""
+        shadow = self.registry.shadow()
+        if shadow is None or shadow.version == deployed.version or X_counts.shape[0] == 0:
+            return False
+        with self._lock:
+            self._submitted += 1
+            if self._submitted % self.sample_every:
+                return False
+        try:
+            self._queue.put_nowait((deployed, shadow, X_counts))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _work(self):
+        while True:
+            deployed, shadow, X_counts = self._queue.get()
+            try:
+                start = time.perf_counter()
+                primary_scores = score_counts(deployed.model, deployed.extractor, X_counts)[0]
+                primary_seconds = time.perf_counter() - start
+                X_shadow = align_counts(X_counts, deployed.events, shadow.events)
+                start = time.perf_counter()
+                shadow_scores = score_counts(shadow.model, shadow.extractor, X_shadow)[0]
+                shadow_seconds = time.perf_counter() - start
+                flips = int(np.sum((primary_scores >= self.threshold) != (shadow_scores >= self.threshold)))
+                with self._lock:
+                    self.batches += 1
+                    self.rows += X_counts.shape[0]
+                    self.flips += flips
+                    self.seconds['primary'] += primary_seconds
+                    self.seconds['shadow'] += shadow_seconds
+                if self._on_result is not None:
+                    self._on_result(deployed, shadow, X_counts.shape[0], primary_seconds, shadow_seconds, flips)
+            except Exception as e:
+                print(f"⚠️  Shadow scoring failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'dropped': self.dropped,
+                'rows': self.rows,
+                'decision_flips': self.flips,
+                'primary_seconds': round(self.seconds['primary'], 6),
+                'shadow_seconds': round(self.seconds['shadow'], 6),
+                'queued': self._queue.qsize(),
+            }
@@ -0,0 +1,1136 @@
+"""
+Shared core of the HDFS log analysis service
+Configuration, model, scoring and job submission used by both the Flask service
+(flask-simulator.py) and its asyncio variant (asgi-simulator.py)
+"""
+
+import random
+import time
+import os
+import uuid
+from datetime import datetime
+import threading
+from dotenv import load_dotenv
+
+from loglizer import dataloader, instrumentation
+from loglizer.sessions import LiveSessions
+from loglizer.scoring import ScoringCache, score_sessions, render_reasons
+from analysis_service.jobs import (JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, DuplicateJobError, JobManager,
+                                  QueueFullError, ShuttingDownError, estimate_cost)
+from analysis_service.parallel import ShardedScorer
+from analysis_service.batching import BatchCoalescer
+from analysis_service.delivery import IDEMPOTENCY_HEADER, ResultStream, encode_results, negotiate_format
+from analysis_service.outbox import CallbackOutbox
+from analysis_service.ingest import IngestStream, UploadTooLargeError
+from analysis_service.store import UPLOAD_DONE, UPLOAD_RUNNING, ResultStore
+from analysis_service.checkpoints import CheckpointStore
+from analysis_service.live import FileTail, LiveDetector, SocketSource
+from analysis_service.profiling import JobProfiler, MODE_SAMPLING, parse_flag, parse_mode
+from analysis_service.tracing import JsonLinesExporter
+from analysis_service.readiness import ModelLoader, process_start_time
+from analysis_service.registry import (BUNDLED_MODEL_PATH, DEFAULT_REGISTRY_DIR, ModelRegistry, ShadowScorer,
+                                       UnknownVersionError)
+from analysis_service import prefork
+from analysis_service.metrics import (COUNTER, GAUGE, MetricsRegistry, StageMetrics, ThroughputMeter,
+                                      process_rss_bytes)
+import numpy as np
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configuration from environment variables
+FLASK_HOST = os.getenv('FLASK_HOST', '0.0.0.0')
+FLASK_PORT = int(os.getenv('FLASK_PORT', 5555))
+ANALYSIS_RESULTS_DIR = os.getenv('ANALYSIS_RESULTS_DIR', 'analysis_results')
+CALLBACK_DELAY_SECONDS = float(os.getenv('CALLBACK_DELAY_SECONDS', 0.01))
+NEXT_PUBLIC_URL = os.getenv('NEXT_PUBLIC_URL', 'http://localhost:3000')
+NEXT_CALLBACK_BASE_URL = os.getenv('NEXT_CALLBACK_BASE_URL', 'http://localhost:3000/api/analysis-callback')
+SCORING_CACHE_MAX_MB = float(os.getenv('SCORING_CACHE_MAX_MB', 64))
+SCORING_BATCH_SIZE = int(os.getenv('SCORING_BATCH_SIZE', 10000))
+EXPLANATION_TOP_K = int(os.getenv('EXPLANATION_TOP_K', 3))
+SCORING_BATCH_MAX_WAIT_MS = float(os.getenv('SCORING_BATCH_MAX_WAIT_MS', 2))
+SCORING_BATCH_MAX_ROWS = int(os.getenv('SCORING_BATCH_MAX_ROWS', 4096))
+ANALYSIS_MAX_WORKERS = int(os.getenv('ANALYSIS_MAX_WORKERS', 2))
+ANALYSIS_MAX_QUEUE = int(os.getenv('ANALYSIS_MAX_QUEUE', 32))
+ANALYSIS_AGING_SECONDS = float(os.getenv('ANALYSIS_AGING_SECONDS', 30))
+ANALYSIS_MAX_WAIT_SECONDS = float(os.getenv('ANALYSIS_MAX_WAIT_SECONDS', 300))
+PARALLEL_WORKERS = int(os.getenv('PARALLEL_WORKERS', 0))
+PARALLEL_MIN_BLOCKS = int(os.getenv('PARALLEL_MIN_BLOCKS', 50000))
+PARALLEL_SHARD_SIZE = int(os.getenv('PARALLEL_SHARD_SIZE', 20000))
+RESULT_DELIVERY = os.getenv('RESULT_DELIVERY', 'stream')
+RESULT_BATCH_SIZE = int(os.getenv('RESULT_BATCH_SIZE', 1000))
+RESULT_FORMAT = negotiate_format(os.getenv('RESULT_FORMAT', 'json'))
+RESULT_GZIP = os.getenv('RESULT_GZIP', 'false').lower() == 'true'
+CALLBACK_RETRIES = int(os.getenv('CALLBACK_RETRIES', 3))
+CALLBACK_OUTBOX_PATH = os.getenv('CALLBACK_OUTBOX_PATH', os.path.join(ANALYSIS_RESULTS_DIR, 'callback_outbox.sqlite3'))
+CALLBACK_OUTBOX_WORKERS = int(os.getenv('CALLBACK_OUTBOX_WORKERS', 2))
+CALLBACK_MAX_ATTEMPTS = int(os.getenv('CALLBACK_MAX_ATTEMPTS', 20))
+INGEST_MAX_MB = float(os.getenv('INGEST_MAX_MB', 1024))
+RESULT_STORE_PATH = os.getenv('RESULT_STORE_PATH', os.path.join(ANALYSIS_RESULTS_DIR, 'results.sqlite3'))
+RESULT_EXPORT_CSV = os.getenv('RESULT_EXPORT_CSV', 'true').lower() == 'true'
+RESULT_PAGE_MAX = int(os.getenv('RESULT_PAGE_MAX', 1000))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(ANALYSIS_RESULTS_DIR, 'profiles'))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 5))
+TRACE_PATH = os.getenv('TRACE_PATH', os.path.join(ANALYSIS_RESULTS_DIR, 'traces.jsonl'))
+TRACE_MAX_MB = float(os.getenv('TRACE_MAX_MB', 64))
+MODEL_WARMUP_BLOCKS = int(os.getenv('MODEL_WARMUP_BLOCKS', 1000))
+MODEL_WAIT_SECONDS = float(os.getenv('MODEL_WAIT_SECONDS', 300))
+MODEL_REGISTRY_DIR = os.getenv('MODEL_REGISTRY_DIR', DEFAULT_REGISTRY_DIR)
+MODEL_WATCH_SECONDS = float(os.getenv('MODEL_WATCH_SECONDS', 5))
+MODEL_SHADOW_VERSION = os.getenv('MODEL_SHADOW_VERSION', '')
+MODEL_SHADOW_SAMPLE_EVERY = int(os.getenv('MODEL_SHADOW_SAMPLE_EVERY', 1))
+CHECKPOINT_PATH = os.getenv('CHECKPOINT_PATH', os.path.join(ANALYSIS_RESULTS_DIR, 'checkpoints.sqlite3'))
+CHECKPOINT_SECONDS = float(os.getenv('CHECKPOINT_SECONDS', 10))
+CHECKPOINT_MAX_RESUMES = int(os.getenv('CHECKPOINT_MAX_RESUMES', 3))
+LIVE_LOG_PATH = os.getenv('LIVE_LOG_PATH', '')
+LIVE_SOCKET_PORT = int(os.getenv('LIVE_SOCKET_PORT', 0))
+LIVE_MAX_SESSIONS = int(os.getenv('LIVE_MAX_SESSIONS', 100000))
+LIVE_MAX_SESSION_EVENTS = int(os.getenv('LIVE_MAX_SESSION_EVENTS', 1000))
+LIVE_IDLE_SECONDS = float(os.getenv('LIVE_IDLE_SECONDS', 30))
+LIVE_TERMINAL_EVENTS = [event.strip() for event in os.getenv('LIVE_TERMINAL_EVENTS', 'E21').split(',') if event.strip()]
+LIVE_TERMINAL_GRACE_SECONDS = float(os.getenv('LIVE_TERMINAL_GRACE_SECONDS', 0.5))
+LIVE_ALERT_THRESHOLD = float(os.getenv('LIVE_ALERT_THRESHOLD', 0.5))
+
+print(f"🔧 Service Configuration:")
+print(f"   Host: {FLASK_HOST}")
+print(f"   Port: {FLASK_PORT}")
+print(f"   Next.js URL: {NEXT_PUBLIC_URL}")
+print(f"   Callback Base URL: {NEXT_CALLBACK_BASE_URL}")
+print(f"   Analysis Results Dir: {ANALYSIS_RESULTS_DIR}")
+print(f"   Callback Delay: {CALLBACK_DELAY_SECONDS}s")
+print(f"   Scoring Cache: {SCORING_CACHE_MAX_MB} MB")
+print(f"   Scoring Batch Size: {SCORING_BATCH_SIZE}")
+print(f"   Explanation Top-K: {EXPLANATION_TOP_K}")
+print(f"   Micro-batching: up to {SCORING_BATCH_MAX_WAIT_MS} ms / {SCORING_BATCH_MAX_ROWS} rows")
+print(f"   Analysis Workers: {ANALYSIS_MAX_WORKERS} (queue limit {ANALYSIS_MAX_QUEUE})")
+print(f"   Scheduler Aging: {ANALYSIS_AGING_SECONDS}s (max wait {ANALYSIS_MAX_WAIT_SECONDS}s)")
+print(f"   Parallel Workers: {PARALLEL_WORKERS} (uploads from {PARALLEL_MIN_BLOCKS} blocks, shards of {PARALLEL_SHARD_SIZE})")
+print(f"   Result Delivery: {RESULT_DELIVERY} (batches of {RESULT_BATCH_SIZE}, {RESULT_FORMAT}{', gzip' if RESULT_GZIP else ''})")
+print(f"   Callback Outbox: {CALLBACK_OUTBOX_PATH or 'disabled'} ({CALLBACK_OUTBOX_WORKERS} workers, {CALLBACK_MAX_ATTEMPTS} attempts)")
+print(f"   Ingest Limit: {INGEST_MAX_MB} MB")
+print(f"   Result Store: {RESULT_STORE_PATH or 'disabled'}{' (with CSV export)' if RESULT_STORE_PATH and RESULT_EXPORT_CSV else ''}")
+print(f"   Job Profiles: {PROFILE_DIR} (sampling every {PROFILE_SAMPLE_INTERVAL_MS} ms)")
+print(f"   Model Warm-up: {MODEL_WARMUP_BLOCKS} synthetic blocks (jobs wait up to {MODEL_WAIT_SECONDS}s for the model)")
+print(f"   Traces: {TRACE_PATH or 'disabled'}{f' (rotated at {TRACE_MAX_MB} MB)' if TRACE_PATH else ''}")
+print(f"   Model Registry: {MODEL_REGISTRY_DIR} (watched every {MODEL_WATCH_SECONDS}s)")
+print(f"   Shadow Model: {MODEL_SHADOW_VERSION or 'none'} (every {MODEL_SHADOW_SAMPLE_EVERY} job)")
+print(f"   Job Checkpoints: {CHECKPOINT_PATH or 'disabled'} (every {CHECKPOINT_SECONDS}s, {CHECKPOINT_MAX_RESUMES} resumes)")
+print(f"   Live Detection: {LIVE_LOG_PATH or (f'port {LIVE_SOCKET_PORT}' if LIVE_SOCKET_PORT else 'disabled')} "
+      f"({LIVE_MAX_SESSIONS} open sessions, idle {LIVE_IDLE_SECONDS}s, {','.join(LIVE_TERMINAL_EVENTS) or 'no'} "
+      f"terminal events + {LIVE_TERMINAL_GRACE_SECONDS}s, alerts from {LIVE_ALERT_THRESHOLD})")
+
+# Ensure results directory exists
+os.makedirs(ANALYSIS_RESULTS_DIR, exist_ok=True)
+
+# The bundled model artifact lives in the scripts directory; it is the only version while the
+# registry directory holds none
+model_path = BUNDLED_MODEL_PATH
+
+# Scores of identical event-count vectors are reused across blocks and uploads
+scoring_cache = ScoringCache(max_bytes=int(SCORING_CACHE_MAX_MB * 1024 * 1024))
+
+def load_model():
+    """Load the current registry version; runs on the model loader thread"""
+    deployed = model_registry.load_current()
+    print(f'Model version {deployed.version} loaded successfully. ✅')
+    return deployed
+
+def warm_up_model(deployed, num_blocks=None):
+    """Score a batch of synthetic sessions end to end, bypassing the cache and batcher
+
+    The first call pays for lazy imports in scikit-learn and numpy and for allocating
+    the scoring buffers; doing it here keeps that out of the first upload. Every version
+    is warmed up before it is swapped in.
+    """
+    num_blocks = MODEL_WARMUP_BLOCKS if num_blocks is None else num_blocks
+    if num_blocks <= 0:
+        return
+    extractor = deployed.extractor
+    rng = np.random.default_rng(0)
+    x_seq = np.empty(num_blocks, dtype=object)
+    for i in range(num_blocks):
+        x_seq[i] = list(rng.choice(extractor.events, size=rng.integers(1, 30)))
+    with instrumentation.timed('model_warmup', num_blocks, model_version=deployed.version):
+        _, top_idx, top_values = score_sessions(deployed.model, extractor, x_seq, batch_size=SCORING_BATCH_SIZE,
+                                                top_k=max(EXPLANATION_TOP_K, 1))
+        render_reasons(top_idx, top_values, extractor.events, num_instances=num_blocks)
+
+def model_activated(deployed):
+    """Drop the cached scores of the previous version; running jobs key theirs by their own"""
+    scoring_cache.set_model_version(deployed.version)
+
+# Versions under MODEL_REGISTRY_DIR are loaded and warmed up in the background and swapped in for
+# new jobs, from POST /models/activate or when the CURRENT file names another version
+model_registry = ModelRegistry(MODEL_REGISTRY_DIR, default_path=model_path, warm_up=warm_up_model,
+                               on_activate=model_activated)
+
+# The first version is loaded and warmed up in the background while the server starts; /ready
+# answers 503 and jobs wait in get_model() until then. Started below, after the fork.
+model_loader = ModelLoader(load_model, warm_up_model, started_at=process_start_time())
+
+# Large uploads are parsed and scored in shards on a process pool; it is forked
+# here, before the job and batching threads below are started
+sharded_scorer = None
+if PARALLEL_WORKERS > 0:
+    sharded_scorer = ShardedScorer(model_registry.versions().get(model_registry.current_version(), model_path),
+                                   PARALLEL_WORKERS, shard_size=PARALLEL_SHARD_SIZE, top_k=EXPLANATION_TOP_K)
+    print(f'Started {PARALLEL_WORKERS} scoring processes. ✅')
+
+model_loader.start()
+if MODEL_WATCH_SECONDS > 0:
+    model_registry.watch(MODEL_WATCH_SECONDS)
+if MODEL_SHADOW_VERSION:
+    model_registry.set_shadow(MODEL_SHADOW_VERSION)
+
+# Cache misses of concurrent jobs are scored together; a max wait of 0 disables it
+scoring_batcher = None
+if SCORING_BATCH_MAX_WAIT_MS > 0:
+    scoring_batcher = BatchCoalescer(max_batch_rows=SCORING_BATCH_MAX_ROWS,
+                                     max_wait_ms=SCORING_BATCH_MAX_WAIT_MS)
+
+# Callbacks are persisted before delivery and replayed after a restart; an empty path disables it
+callback_outbox = None
+if CALLBACK_OUTBOX_PATH:
+    callback_outbox = CallbackOutbox(CALLBACK_OUTBOX_PATH, workers=CALLBACK_OUTBOX_WORKERS,
+                                     max_attempts=CALLBACK_MAX_ATTEMPTS)
+    if callback_outbox.replayed:
+        print(f'📮 Replaying {callback_outbox.replayed} undelivered callbacks from {CALLBACK_OUTBOX_PATH}')
+
+# Scored blocks are kept for /uploads/<upload_id>/results and the /results CSV download; an empty path disables it
+result_store = None
+if RESULT_STORE_PATH:
+    result_store = ResultStore(RESULT_STORE_PATH, export_dir=ANALYSIS_RESULTS_DIR if RESULT_EXPORT_CSV else None)
+
+# Queued and running /analyze jobs and their progress; the jobs of a process that ended are resumed
+# from their last checkpoint by resume_jobs. An empty path disables it
+checkpoint_store = None
+if CHECKPOINT_PATH:
+    checkpoint_store = CheckpointStore(CHECKPOINT_PATH)
+
+# Analysis jobs run on a bounded pool, small jobs and least busy users first; /status reads the job table.
+# Under gunicorn, finished jobs count towards recycling the worker process (see gunicorn.conf.py)
+job_manager = JobManager(max_workers=ANALYSIS_MAX_WORKERS, max_queue=ANALYSIS_MAX_QUEUE,
+                         aging_seconds=ANALYSIS_AGING_SECONDS, max_wait_seconds=ANALYSIS_MAX_WAIT_SECONDS,
+                         on_finished=prefork.job_finished)
+
+# Every pipeline span, from the request through its job, the worker processes and the callbacks, is
+# appended to the trace file with the upload_id and job_id; an empty path disables it
+trace_exporter = None
+if TRACE_PATH:
+    trace_exporter = JsonLinesExporter(TRACE_PATH, max_bytes=int(TRACE_MAX_MB * 1024 * 1024))
+    instrumentation.add_listener(trace_exporter)
+
+# Sessions of a growing log are scored as they close, see start_live_detection; started by the front ends
+live_detector = None
+live_sources = []
+
+def drain_worker():
+    """Finish the jobs of an exiting gunicorn worker; its undelivered callbacks stay in the outbox"""
+    job_manager.shutdown(wait=True)
+    if checkpoint_store is not None:
+        checkpoint_store.close()
+    if live_detector is not None:
+        live_detector.stop()
+    if callback_outbox is not None:
+        callback_outbox.close()
+    if trace_exporter is not None:
+        trace_exporter.close()
+
+prefork.on_drain(drain_worker)
+
+# Pipeline stage timings reported by loglizer.instrumentation, service counters and the state of
+# the components above, served by /metrics
+metrics = MetricsRegistry()
+instrumentation.add_listener(StageMetrics(metrics))
+blocks_scored = metrics.counter('analysis_blocks_scored_total', 'Blocks scored by analysis jobs', ['model_version'])
+job_duration = metrics.histogram('analysis_job_duration_seconds', 'Time to score all blocks of a job',
+                                 ['model_version'])
+shadow_duration = metrics.histogram('model_shadow_duration_seconds',
+                                    'Time to score a sampled batch with the job and the shadow version',
+                                    ['model_version', 'role'])
+shadow_flips = metrics.counter('model_shadow_decision_flips_total',
+                               'Sampled blocks the shadow version decides differently', ['model_version'])
+block_rate = ThroughputMeter(window_seconds=60)
+metrics.collect('analysis_blocks_per_second', 'Blocks scored per second over the last minute', GAUGE,
+                block_rate.rate)
+metrics.collect('analysis_queue_depth', 'Jobs waiting for a worker', GAUGE,
+                lambda: job_manager.stats()['queue_depth'])
+metrics.collect('analysis_active_jobs', 'Jobs running on a worker', GAUGE,
+                lambda: job_manager.stats()['active_jobs'])
+metrics.collect('analysis_jobs_finished_total', 'Finished jobs by status', COUNTER,
+                lambda: [({'status': status}, count) for status, count in job_manager.stats()['finished_total'].items()])
+metrics.collect('analysis_jobs_resumed_total', 'Interrupted jobs resumed from a checkpoint', COUNTER,
+                lambda: checkpoint_store.resumed if checkpoint_store else None)
+metrics.collect('live_open_sessions', 'Block sessions of the live log still open', GAUGE,
+                lambda: len(live_detector.sessions) if live_detector else None)
+metrics.collect('live_sessions_closed_total', 'Live block sessions scored, by what closed them', COUNTER,
+                lambda: [({'reason': reason}, count) for reason, count in live_detector.closed.items()]
+                if live_detector else None)
+metrics.collect('live_alerts_total', 'Live block sessions scoring at or above the alert threshold', COUNTER,
+                lambda: live_detector.alerts if live_detector else None)
+live_alert_latency = metrics.histogram('live_alert_latency_seconds',
+                                       'Time from a live session being due to close until its alert was sent')
+metrics.collect('analysis_queue_wait_p50_seconds', 'p50 of recent queue waits by job size class', GAUGE,
+                lambda: [({'size_class': name}, waits['p50_seconds'])
+                         for name, waits in job_manager.stats()['queue_wait'].items()])
+metrics.collect('analysis_queue_wait_p99_seconds', 'p99 of recent queue waits by job size class', GAUGE,
+                lambda: [({'size_class': name}, waits['p99_seconds'])
+                         for name, waits in job_manager.stats()['queue_wait'].items()])
+metrics.collect('scoring_cache_hits_total', 'Sessions whose score came from the cache', COUNTER,
+                lambda: scoring_cache.stats()['hits'])
+metrics.collect('scoring_cache_misses_total', 'Sessions scored by the model', COUNTER,
+                lambda: scoring_cache.stats()['misses'])
+metrics.collect('scoring_cache_duplicates_total', 'Sessions sharing the score of an identical session in their batch',
+                COUNTER, lambda: scoring_cache.stats()['duplicates'])
+metrics.collect('scoring_cache_hit_ratio', 'Share of sessions served from the cache since start', GAUGE,
+                lambda: scoring_cache.stats()['hit_rate'])
+metrics.collect('scoring_cache_bytes', 'Approximate size of the scoring cache', GAUGE,
+                lambda: scoring_cache.stats()['bytes'])
+metrics.collect('scoring_batcher_batches_total', 'Coalesced scoring batches', COUNTER,
+                lambda: scoring_batcher.stats()['batches'] if scoring_batcher else None)
+metrics.collect('scoring_batcher_requests_total', 'Scoring requests served by coalesced batches', COUNTER,
+                lambda: scoring_batcher.stats()['requests'] if scoring_batcher else None)
+metrics.collect('callback_outbox_backlog', 'Callbacks waiting for delivery', GAUGE,
+                lambda: callback_outbox.stats()['backlog'] if callback_outbox else None)
+metrics.collect('callback_outbox_dead', 'Callbacks given up after the maximum attempts', GAUGE,
+                lambda: callback_outbox.stats()['dead'] if callback_outbox else None)
+metrics.collect('process_resident_memory_bytes', 'Resident memory size of the service process', GAUGE,
+                process_rss_bytes)
+metrics.collect('trace_spans_exported_total', 'Spans written to the trace file', COUNTER,
+                lambda: trace_exporter.stats()['exported'] if trace_exporter else None)
+metrics.collect('service_ready', 'Whether the model is loaded and warmed up', GAUGE,
+                lambda: int(model_loader.ready))
+metrics.collect('service_time_to_ready_seconds', 'Seconds from process start until the service was ready', GAUGE,
+                model_loader.time_to_ready)
+metrics.collect('process_start_time_seconds', 'Start time of the service process since the epoch', GAUGE,
+                lambda: model_loader.started_at)
+metrics.collect('process_cpu_seconds_total', 'User and system CPU time of the service process', COUNTER,
+                time.process_time)
+metrics.collect('model_active_info', 'The model version new jobs score with', GAUGE,
+                lambda: [({'model_version': model_registry.active().version}, 1)] if model_registry.active() else None)
+metrics.collect('model_swaps_total', 'Model versions swapped in since start', COUNTER,
+                lambda: model_registry.swaps)
+metrics.collect('model_shadow_dropped_total', 'Sampled batches dropped while the shadow scorer was busy', COUNTER,
+                lambda: shadow_scorer.stats()['dropped'])
+
+def record_shadow(primary, shadow, rows, primary_seconds, shadow_seconds, flips):
+    shadow_duration.observe(primary_seconds, model_version=primary.version, role='primary')
+    shadow_duration.observe(shadow_seconds, model_version=shadow.version, role='shadow')
+    shadow_flips.inc(flips, model_version=shadow.version)
+    print(f"👥 Shadow {shadow.version}: {rows} blocks in {shadow_seconds * 1000:.1f} ms "
+          f"vs {primary_seconds * 1000:.1f} ms on {primary.version}, {flips} decisions differ")
+
+# Sampled batches are scored again with the shadow version, if any, on a separate thread
+shadow_scorer = ShadowScorer(model_registry, sample_every=MODEL_SHADOW_SAMPLE_EVERY, on_result=record_shadow)
+
+def get_model():
+    """Return the active DeployedModel of the registry
+
+    Waits up to MODEL_WAIT_SECONDS while the first version is still being loaded and raises
+    ModelNotReadyError when it cannot be loaded. Jobs take it once when they start, so a
+    swap only changes the version of jobs started after it.
+    """
+    model_loader.wait(MODEL_WAIT_SECONDS)
+    return model_registry.active()
+
+# Sample anomaly reasons for different risk levels
+ANOMALY_REASONS = {
+    "high": [
+        "Block corruption detected - checksum mismatch",
+        "Unusual replication pattern from multiple sources",
+        "Failed block allocation - potential storage issue",
+        "Suspicious access pattern detected",
+        "Block size anomaly - significantly larger than expected",
+        "Multiple failed read attempts on block",
+        "Unauthorized access attempt detected",
+        "Block metadata inconsistency found"
+    ],
+    "medium": [
+        "Higher than normal replication requests",
+        "Block corruption detected - checksum mismatch",
+        "Unusual replication pattern from multiple sources",
+        "Failed block allocation - potential storage issue",
+        "Suspicious access pattern detected",
+        "Block size anomaly - significantly larger than expected",
+        "Multiple failed read attempts on block",
+        "Unauthorized access attempt detected",
+        "Block metadata inconsistency found"
+    ],
+    "low": [
+        "Higher than normal replication requests",
+        "Block access from unusual IP range",
+        "Delayed block allocation response",
+        "Non-standard block naming pattern",
+        "Elevated error rate for this block",
+        "Unusual timestamp pattern in block operations",
+        "Block size slightly above normal threshold",
+        "Minor metadata validation warnings"
+    ],
+    "normal": [
+        "Normal block operation",
+        "Standard replication pattern",
+        "Regular block allocation",
+        "Typical access pattern",
+        "Normal block size and metadata",
+        "Standard HDFS operation",
+        "Regular data node communication",
+        "Normal file system activity"
+    ]
+}
+
+def generate_anomaly_score_and_reason(block_id, component, content):
+    """Generate realistic anomaly scores and reasons based on log content"""
+    
+    # Analyze content for suspicious patterns
+    content_lower = content.lower()
+    
+    # High risk indicators
+    if any(keyword in content_lower for keyword in ['failed', 'error', 'corruption', 'suspicious']):
+        score = random.uniform(75, 95)
+        reason_category = "high"
+    # Medium risk indicators  
+    elif any(keyword in content_lower for keyword in ['warn', 'unusual', 'multiple', 'delayed']):
+        score = random.uniform(45, 75)
+        reason_category = "medium"
+    # Component-based risk assessment
+    elif 'datanode' in component.lower() and 'receiving' in content_lower:
+        # DataNode operations - generally lower risk but some variation
+        score = random.uniform(10, 40)
+        reason_category = "low" if score < 30 else "medium"
+    elif 'fsnamesystem' in component.lower():
+        # NameSystem operations - slightly higher baseline risk
+        score = random.uniform(15, 45)
+        reason_category = "low" if score < 35 else "medium"
+    else:
+        # Default case
+        score = random.uniform(5, 30)
+        reason_category = "low"
+    
+    # Add some randomness for realistic variation
+    score += random.uniform(-5, 5)
+    score = max(0, min(100, score))  # Clamp between 0-100
+    
+    # Select appropriate reason
+    reason = random.choice(ANOMALY_REASONS[reason_category])
+    
+    # Add specific details based on content
+    if 'blk_' in content:
+        if score > 70:
+            reason += f" - Block {block_id} requires immediate attention"
+        elif score > 50:
+            reason += f" - Block {block_id} shows concerning patterns"
+    
+    return round(score, 2), reason
+
+
+def simulate_block_data(block_ids):
+    """Create mock component and content info for uploads without a structured log"""
+    block_data = []
+    for block_id in block_ids:
+        # Simulate different components and content types
+        components = ['dfs.DataNode$DataXceiver', 'dfs.FSNamesystem', 'dfs.BlockManager']
+        component = random.choice(components)
+        
+        # Generate realistic content based on component
+        if 'DataNode' in component:
+            content = f"Receiving block {block_id} src: /10.250.{random.randint(1,50)}.{random.randint(1,255)}"
+        elif 'FSNamesystem' in component:
+            content = f"BLOCK* NameSystem.allocateBlock: /mnt/hadoop/data/file_{random.randint(1,1000)}.dat. {block_id}"
+        else:
+            content = f"Block operation for {block_id}"
+        
+        # Add some error conditions for testing
+        if random.random() < 0.1:  # 10% chance of error
+            content = f"Failed to process block {block_id} - " + random.choice(['checksum error', 'timeout', 'corruption detected'])
+        elif random.random() < 0.05:  # 5% chance of warning
+            content = f"Warning: Unusual pattern detected for block {block_id}"
+        
+        block_data.append({
+            'block_id': block_id,
+            'component': component,
+            'content': content
+        })
+    return block_data
+
+
+def inference(file_path, block_ids=None, progress=None, deployed=None):
+    """Score every block session of a structured HDFS log with a model version
+
+    Returns the block ids, their anomaly probabilities and the reasons built from the
+    top contributing events. When block_ids is given the results follow its order, and
+    blocks absent from the log are scored as empty sessions. progress(done, total) is
+    called after every scored batch. deployed defaults to the active version.
+    """
+    print(file_path)
+    data_df, templates = dataloader.load_HDFS_sessions(file_path)
+    return score_block_sessions(dict(zip(data_df['BlockId'], data_df['EventSequence'])), templates,
+                                block_ids, progress, deployed)
+
+def inference_shards(file_path, block_ids=None, progress=None, deployed=None):
+    """Score a structured HDFS log like inference(), yielding the results shard by shard
+
+    Yields (block_ids, anomaly probabilities, reasons) for SCORING_BATCH_SIZE blocks at a
+    time, so their results can be sent and checkpointed before the next shard is scored.
+    Only the first shard is offered to the shadow scorer.
+    """
+    print(file_path)
+    data_df, templates = dataloader.load_HDFS_sessions(file_path)
+    sessions = dict(zip(data_df['BlockId'], data_df['EventSequence']))
+    if block_ids is None:
+        block_ids = list(sessions.keys())
+    for start in range(0, len(block_ids), SCORING_BATCH_SIZE):
+        shard_progress = None
+        if progress is not None:
+            shard_progress = lambda done, total, start=start: progress(start + done, len(block_ids))
+        yield score_block_sessions(sessions, templates, block_ids[start:start + SCORING_BATCH_SIZE], shard_progress,
+                                   deployed, shadow=start == 0)
+
+def score_block_sessions(sessions, templates, block_ids=None, progress=None, deployed=None, shadow=True):
+    """Score block sessions (block id -> event ids) like inference()"""
+    if block_ids is None:
+        block_ids = list(sessions.keys())
+    x_test = np.empty(len(block_ids), dtype=object)
+    for i, block_id in enumerate(block_ids):
+        x_test[i] = sessions.get(block_id, [])
+
+    deployed = deployed or get_model()
+    feature_extractor = deployed.extractor
+    if shadow and model_registry.shadow() is not None:
+        shadow_scorer.submit(deployed, feature_extractor.count_events(x_test[:SCORING_BATCH_SIZE]))
+
+    # Sessions are transformed and scored in bounded batches; only the unique
+    # event-count vectors missing from the cache reach the model
+    with instrumentation.timed('score_sessions', len(block_ids), model_version=deployed.version):
+        pred_probs, top_idx, top_values = score_sessions(deployed.model, feature_extractor, x_test,
+                                                         batch_size=SCORING_BATCH_SIZE, cache=scoring_cache,
+                                                         top_k=EXPLANATION_TOP_K, progress=progress,
+                                                         batcher=scoring_batcher, model_version=deployed.version)
+        reasons = render_reasons(top_idx, top_values, feature_extractor.events, templates,
+                                 num_instances=len(block_ids))
+    return block_ids, pred_probs, reasons
+
+def parallel_inference(file_path, block_ids=None, deployed=None):
+    """Score a structured HDFS log on the process pool, yielding results shard by shard
+
+    Yields (block_ids, anomaly probabilities, reasons) per shard, in the same order and
+    with the same values as inference(). Shards bypass the scoring cache.
+    """
+    print(file_path)
+    deployed = deployed or get_model()
+    with instrumentation.timed('count_blocks', workers=sharded_scorer.num_workers) as span:
+        block_ids, X_counts, templates = sharded_scorer.count_blocks(file_path, block_ids)
+        span.items = len(block_ids)
+    if model_registry.shadow() is not None:
+        shadow_scorer.submit(deployed, X_counts[:PARALLEL_SHARD_SIZE])
+    shards = sharded_scorer.score_shards(X_counts, deployed.version, deployed.path)
+    for start, pred_probs, top_idx, top_values in shards:
+        reasons = render_reasons(top_idx, top_values, sharded_scorer.extractor.events, templates,
+                                 num_instances=len(pred_probs))
+        yield block_ids[start:start + len(pred_probs)], pred_probs, reasons
+
+def _parallel_model(deployed):
+    # Workers count events with the pool's vocabulary, so other versions are scored in the job thread
+    return sharded_scorer is not None and deployed.events == sharded_scorer.extractor.events
+
+def iter_results(job, upload_id, block_ids, file_path, sessions=None, analysis_filename=None, stream=None):
+    """Score all blocks of an upload, yielding their result rows in chunks
+
+    See _score_chunks. With an analysis_filename the rows are also written to the result
+    store, which replaces earlier results of the upload once the last chunk was consumed.
+
+    A job resumed from a checkpoint (job.checkpoint) starts after the blocks it covers.
+    The progress is saved every CHECKPOINT_SECONDS, after a chunk was consumed and only
+    when it left no results buffered in the job's ResultStream, if any; the results before
+    it are then in the result store or in the callback outbox.
+    """
+    offset = job.checkpoint['processed_blocks'] if job.checkpoint else 0
+    chunks = _score_chunks(job, upload_id, block_ids[offset:], file_path, sessions, offset)
+    writer = None
+    if result_store is not None and analysis_filename:
+        writer = result_store.writer(upload_id, analysis_filename, job.job_id, job.model_version,
+                                     job.checkpoint['export_bytes'] if job.checkpoint else None)
+    checkpointed = checkpoint_store is not None and sessions is None and (stream is not None or writer is not None)
+    processed, saved_at = offset, time.time()
+    try:
+        for chunk in chunks:
+            if writer is not None:
+                writer.add(chunk)
+            yield chunk
+            processed += len(chunk)
+            if checkpointed and time.time() - saved_at >= CHECKPOINT_SECONDS and not (stream and stream.buffered):
+                _save_checkpoint(job, processed, stream, writer)
+                saved_at = time.time()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+
+def _save_checkpoint(job, processed_blocks, stream=None, writer=None):
+    with instrumentation.timed('job_checkpoint', processed_blocks):
+        checkpoint_store.save(job.job_id, processed_blocks, stream.batches_sent if stream is not None else 0,
+                              writer.export_bytes() if writer is not None else None)
+
+def _score_chunks(job, upload_id, block_ids, file_path, sessions=None, offset=0):
+    """Score all blocks of an upload, yielding their result rows in chunks
+
+    Runs on a job manager worker and reports its progress on job. The sessions come from
+    the structured log at file_path, or from a SessionBuilder filled by /ingest. Rows are
+    built RESULT_BATCH_SIZE at a time from the score arrays, so callers that deliver each
+    chunk before asking for the next never hold all rows at once. All blocks are scored
+    with the model version taken by start_job, job.model. The progress of a resumed job
+    counts the offset blocks scored before it was interrupted.
+    """
+    
+    print(f"Starting batch processing for upload {upload_id}")
+    print(f"Processing {len(block_ids)} blocks...")
+    job.set_progress(offset, offset + len(block_ids), 'Loading structured log')
+    
+    num_results = 0
+    
+    try:
+        start_time = time.time()
+        progress = lambda done, total: job.set_progress(offset + done, offset + total, 'Scoring blocks')
+        if sessions is not None or (file_path and os.path.exists(file_path)):
+            if sessions is not None:
+                shards = [score_block_sessions(sessions.sessions, sessions.templates, block_ids, progress,
+                                               job.model)]
+            elif _parallel_model(job.model) and len(block_ids) >= PARALLEL_MIN_BLOCKS:
+                shards = parallel_inference(file_path, block_ids, job.model)
+            else:
+                shards = inference_shards(file_path, block_ids, progress, job.model)
+            for shard_block_ids, pred_probs, reasons in shards:
+                for start in range(0, len(shard_block_ids), RESULT_BATCH_SIZE):
+                    end = start + RESULT_BATCH_SIZE
+                    chunk = [{
+                        'block_id': block_id,
+                        'anomaly_score': round(float(prob) * 100, 2),
+                        'anomaly_probability': float(prob),
+                        'reason': reason
+                    } for block_id, prob, reason in zip(shard_block_ids[start:end], pred_probs[start:end],
+                                                        reasons[start:end])]
+                    num_results += len(chunk)
+                    job.set_progress(offset + num_results, offset + len(block_ids), 'Scoring and sending blocks')
+                    _count_scored(len(chunk), job.model_version)
+                    yield chunk
+        else:
+            # Without the structured log there are no sessions to score
+            print(f"⚠️  No structured log available for upload {upload_id}, simulating scores")
+            chunk = []
+            for block_info in simulate_block_data(block_ids):
+                anomaly_score, reason = generate_anomaly_score_and_reason(
+                    block_info['block_id'], block_info['component'], block_info['content'])
+                chunk.append({
+                    'block_id': block_info['block_id'],
+                    'anomaly_score': anomaly_score,
+                    'reason': reason
+                })
+                if len(chunk) == RESULT_BATCH_SIZE:
+                    num_results += len(chunk)
+                    _count_scored(len(chunk), 'simulated')
+                    yield chunk
+                    chunk = []
+            num_results += len(chunk)
+            _count_scored(len(chunk), 'simulated')
+            yield chunk
+        elapsed = time.time() - start_time
+        job_duration.observe(elapsed, model_version=job.model_version)
+        
+        print(f"✓ Analysis completed: {num_results} blocks processed in {elapsed:.2f}s "
+              f"({num_results / max(elapsed, 1e-9):.0f} blocks/s)")
+        
+    except Exception as e:
+        print(f"✗ Error processing blocks: {e}")
+        raise
+    
+    job.set_progress(offset + num_results, offset + num_results, 'Sending results')
+
+def _count_scored(num_blocks, version):
+    blocks_scored.inc(num_blocks, model_version=version)
+    block_rate.add(num_blocks)
+
+def score_upload(job, upload_id, block_ids, file_path, sessions=None, analysis_filename=None):
+    """Score all blocks of an upload and return all their result rows
+
+    A resumed job reads the rows of the blocks its checkpoint covers back from the result store.
+    """
+    analysis_results = _checkpoint_results(job, upload_id, block_ids)
+    for chunk in iter_results(job, upload_id, block_ids, file_path, sessions, analysis_filename):
+        analysis_results.extend(chunk)
+    return analysis_results
+
+def _checkpoint_results(job, upload_id, block_ids):
+    if not job.checkpoint:
+        return []
+    if result_store is None:
+        # Nothing to resume from; the job starts over
+        job.checkpoint = None
+        return []
+    stored = {row['block_id']: row for row in result_store.rows(upload_id)}
+    return [stored[block_id] for block_id in block_ids[:job.checkpoint['processed_blocks']] if block_id in stored]
+
+def result_stream(upload_id, callback_url, post, result_format=RESULT_FORMAT, job=None):
+    """Return a ResultStream delivering results with the configured batch size and compression
+
+    Its requests carry the model version of the job and idempotency keys made of its job_id;
+    a resumed job continues the batch numbers of its checkpoint.
+    """
+    stream = ResultStream(upload_id, callback_base(callback_url), post, batch_size=RESULT_BATCH_SIZE,
+                          fmt=result_format, compress=RESULT_GZIP, model_version=job.model_version if job else None,
+                          idempotency_key=job.job_id if job else None)
+    if job is not None and job.checkpoint:
+        stream.batches_sent = job.checkpoint['batches_sent']
+        stream.blocks_sent = job.checkpoint['processed_blocks']
+    return stream
+
+def completion_payload(upload_id, analysis_filename, analysis_results, model_version=None):
+    """Build the body posted to the Next.js analysis-callback-complete route"""
+    return {
+        'upload_id': upload_id,
+        'analysis_complete': True,
+        'analysis_filename': analysis_filename,
+        'analysis_filepath': None,  # No file saved
+        'total_blocks_processed': len(analysis_results),
+        'model_version': model_version,
+        'results': analysis_results  # Use results from memory
+    }
+
+def completion_body(upload_id, analysis_filename, analysis_results, result_format=RESULT_FORMAT, model_version=None,
+                    idempotency_key=None):
+    """Encode the completion payload; returns the request body and headers"""
+    body, headers = encode_results(completion_payload(upload_id, analysis_filename, analysis_results, model_version),
+                                   result_format, RESULT_GZIP)
+    if idempotency_key is not None:
+        headers[IDEMPOTENCY_HEADER] = f'{idempotency_key}:complete'
+    return body, headers
+
+def callback_base(callback_url):
+    """Return the callback base URL, e.g. .../api/analysis-callback"""
+    # Use environment variable for callback URL, fallback to parameter if not set
+    return callback_url if callback_url else NEXT_CALLBACK_BASE_URL
+
+def completion_url(callback_url):
+    """Return the completion endpoint for a callback base URL"""
+    return callback_base(callback_url) + '-complete'
+
+# Serializes attaching a profiler to a running job with the job finishing
+_profile_lock = threading.Lock()
+
+def start_job(job, run_job, *args):
+    """Run run_job(job, *args) with the active model version, profiled when the job asked for it
+
+    The version is taken once here, so the job scores all its blocks with it even when
+    another version is swapped in meanwhile. A job resumed from a checkpoint takes the
+    version it started with instead. Jobs without a profile only pay for the attribute
+    checks. The job's checkpoint is removed once it finished or failed.
+    """
+    checkpoint = checkpoint_store.get(job.job_id) if checkpoint_store is not None else None
+    try:
+        if checkpoint is not None and checkpoint['processed_blocks'] > 0:
+            job.checkpoint = checkpoint
+            job.model = _checkpoint_model(checkpoint['model_version'])
+        else:
+            job.model = get_model()
+        job.model_version = job.model.version
+        if checkpoint is not None:
+            checkpoint_store.start(job.job_id, job.model_version)
+        _run_profiled(job, run_job, *args)
+    finally:
+        if checkpoint is not None:
+            checkpoint_store.finish(job.job_id)
+
+def _checkpoint_model(version):
+    active = get_model()
+    if active.version == version:
+        return active
+    # Mixing versions within a job would make its results inconsistent, so it fails without it
+    return model_registry.load(version)
+
+def _run_profiled(job, run_job, *args):
+    if job.profile:
+        with _profile_lock:
+            if job.profiler is None:
+                job.profiler = _job_profiler(job).start()
+    try:
+        run_job(job, *args)
+    finally:
+        if job.profiler is not None:
+            with _profile_lock:
+                profiler, job.profiler = job.profiler, None
+            job.profile_report = profiler.stop()
+            print(f"🔬 Profile of {job.job_id} written to {profiler.out_dir}")
+
+def _job_profiler(job):
+    return JobProfiler(job.profile, os.path.join(PROFILE_DIR, os.path.basename(job.job_id)), thread_id=job.thread_id,
+                       sample_interval=PROFILE_SAMPLE_INTERVAL_MS / 1000.0, memory=job.profile_memory)
+
+def profile_job(job_id, data):
+    """Switch on profiling for a job from the admin endpoint
+
+    A queued job is profiled from its start in the requested mode. A running job can
+    only be sampled, from now on, since cProfile has to be enabled in the job's thread.
+    Returns the response body and status code.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return {'error': 'Job not found', 'job_id': job_id}, 404
+    data = data or {}
+    try:
+        mode = parse_mode(data.get('mode', True))
+        memory = parse_flag(data.get('memory'), True)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    if mode is None:
+        return {'error': 'Missing profile mode'}, 400
+    with _profile_lock:
+        if job.status == JOB_QUEUED:
+            job.profile = mode
+            job.profile_memory = memory
+            return {'job_id': job_id, 'profile': mode, 'message': 'Job will be profiled when it starts'}, 202
+        if job.status != JOB_RUNNING:
+            return {'error': f'Job is already {job.status}', 'job_id': job_id}, 409
+        if job.profiler is not None:
+            return {'error': 'Job is already being profiled', 'job_id': job_id}, 409
+        if mode != MODE_SAMPLING:
+            return {'error': 'A running job can only be profiled with mode=sampling', 'job_id': job_id}, 409
+        job.profile = mode
+        job.profile_memory = memory
+        job.profiler = _job_profiler(job).start()
+    return {'job_id': job_id, 'profile': mode, 'message': 'Sampling the running job'}, 200
+
+def profile_report(job_id):
+    """Return the profile report of a job for /status/<job_id>/profile, and the status code"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return {'error': 'Job not found', 'job_id': job_id}, 404
+    if job.profile_report is None:
+        message = 'Job is being profiled' if job.profile else 'Job was not profiled'
+        return {'error': message, 'job_id': job_id, 'status': job.status}, 404
+    return dict(job.profile_report, job_id=job_id), 200
+
+def profile_file_path(job_id, filename):
+    """Return the path of a profile report file, or None when it does not exist"""
+    filepath = os.path.join(PROFILE_DIR, os.path.basename(job_id), os.path.basename(filename))
+    return filepath if os.path.isfile(filepath) else None
+
+def submit_analysis(data, run_job, result_format=None, sessions=None):
+    """Validate an /analyze request body and queue run_job for it
+
+    run_job(job, upload_id, block_ids, file_path, callback_url, analysis_filename, result_format,
+    sessions) runs on a job manager worker. result_format is the format asked for in the
+    X-Result-Format request header, if any. sessions is the SessionBuilder of an /ingest
+    upload; its blocks are scored unless block_ids are given. A 'profile' field (true,
+    cprofile or sampling) profiles the job, with tracemalloc unless 'profile_memory' is false.
+    Returns the response body, status code and headers.
+    """
+    # Extract request data
+    upload_id = data.get('upload_id')
+    filename = data.get('filename', 'unknown.log')
+    total_entries = data.get('total_entries', 0)
+    block_ids = data.get('block_ids', [])
+    file_path = data.get('file_path')
+    callback_url = data.get('callback_url')
+    user_id = data.get('user_id')
+    result_format = negotiate_format(result_format, RESULT_FORMAT)
+    try:
+        profile = parse_mode(data.get('profile'))
+        profile_memory = parse_flag(data.get('profile_memory'), True)
+    except ValueError as e:
+        return {'error': str(e)}, 400, {}
+    if sessions is not None:
+        block_ids = block_ids or list(sessions.sessions)
+        total_entries = sessions.num_lines
+    
+    # Use environment variable as fallback for callback URL
+    if not callback_url:
+        callback_url = NEXT_CALLBACK_BASE_URL
+        print(f"ℹ️  Using default callback URL from environment: {callback_url}")
+    
+    print(f"\n🔍 Received analysis request:")
+    print(f"   Upload ID: {upload_id}")
+    print(f"   User ID: {user_id}")
+    print(f"   Filename: {filename}")
+    print(f"   Total entries: {total_entries}")
+    print(f"   Unique blocks: {len(block_ids)}")
+    print(f"   File path: {file_path}")
+    print(f"   Callback URL: {callback_url}")
+    print(f"   Result format: {result_format}")
+    if profile:
+        print(f"   Profiling: {profile}")
+    
+    if model_loader.error is not None:
+        # Queued jobs could never run; the service has to be restarted with a working model
+        return {'error': f'Model is not available: {model_loader.error}'}, 503, {'Retry-After': '30'}
+
+    if not upload_id or not callback_url or not block_ids:
+        if sessions is not None and upload_id:
+            return {'error': 'No block sessions found in the upload'}, 400, {}
+        return {'error': 'Missing required fields'}, 400, {}
+    
+    # Generate a job id unique even for requests within the same second; it keys the
+    # checkpoint, the callback idempotency keys and the analysis filename
+    run_id = f"{upload_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    job_id = f"job_{run_id}"
+    analysis_filename = f"analysis_{run_id}.csv"
+    
+    # Queue the job; reject instead of piling up threads when the queue is full
+    cost = estimate_cost(total_entries, len(block_ids))
+    if checkpoint_store is not None and sessions is None:
+        # Recorded before it can start, so it can be resumed if this process ends; /ingest
+        # sessions only exist in memory
+        checkpoint_store.create(job_id, upload_id, {
+            'block_ids': block_ids, 'file_path': file_path, 'callback_url': callback_url,
+            'analysis_filename': analysis_filename, 'result_format': result_format, 'user_id': user_id, 'cost': cost})
+    try:
+        job = job_manager.submit(job_id, start_job, run_job,
+                                 upload_id, block_ids, file_path, callback_url, analysis_filename, result_format,
+                                 sessions,
+                                 upload_id=upload_id, total_blocks=len(block_ids), user_id=user_id,
+                                 cost=cost, profile=profile, profile_memory=profile_memory)
+    except DuplicateJobError as e:
+        # The checkpoint belongs to the job already running under this id
+        print(f"✗ Rejected analysis request for upload {upload_id}: {e}")
+        return {'error': str(e)}, 409, {}
+    except (QueueFullError, ShuttingDownError) as e:
+        if checkpoint_store is not None:
+            checkpoint_store.finish(job_id)
+        if isinstance(e, ShuttingDownError):
+            return {'error': str(e)}, 503, {}
+        print(f"✗ Rejected analysis request for upload {upload_id}: {e}")
+        return {'error': str(e)}, 429, {'Retry-After': '30'}
+    
+    # Return immediate response
+    response = {
+        'job_id': job_id,
+        'status': job.status,
+        'size_class': job.size_class,
+        'message': f'Analysis started for {len(block_ids)} blocks',
+        'estimated_completion_time': len(block_ids) * CALLBACK_DELAY_SECONDS,
+        'analysis_filename': analysis_filename,
+        'result_format': result_format
+    }
+    
+    print(f"✓ Analysis job started: {response['job_id']}")
+    return response, 200, {}
+
+def resume_jobs(run_job):
+    """Queue the jobs interrupted by the end of an earlier service process again
+
+    Called once by the front ends at startup with the run_job of submit_analysis. Each
+    job keeps its job_id and continues from its last checkpoint with the model version
+    it started with; batches it sends again carry the same idempotency keys. Returns the
+    resumed jobs.
+    """
+    if checkpoint_store is None:
+        return []
+    jobs = []
+    for checkpoint in checkpoint_store.claim_orphans(CHECKPOINT_MAX_RESUMES):
+        job_id, upload_id, request = checkpoint['job_id'], checkpoint['upload_id'], checkpoint['request']
+        try:
+            job = job_manager.submit(job_id, start_job, run_job,
+                                     upload_id, request['block_ids'], request['file_path'], request['callback_url'],
+                                     request['analysis_filename'], request['result_format'], None,
+                                     upload_id=upload_id, total_blocks=len(request['block_ids']),
+                                     user_id=request['user_id'], cost=request['cost'])
+        except DuplicateJobError as e:
+            print(f"✗ Could not resume job {job_id}: {e}")
+            continue
+        except (QueueFullError, ShuttingDownError) as e:
+            # Kept in the store and resumed by the next process
+            print(f"✗ Could not resume job {job_id}: {e}")
+            continue
+        print(f"⏯️  Resuming job {job_id} of upload {upload_id} from block {checkpoint['processed_blocks']} "
+              f"of {len(request['block_ids'])}")
+        jobs.append(job)
+    return jobs
+
+def start_live_detection(post):
+    """Start scoring the sessions of the live log as they close, when LIVE_LOG_PATH or LIVE_SOCKET_PORT is set
+
+    Called once by the front ends at startup with the post(url, body, headers) of their
+    callbacks; alerts go to the -alert callback URL. Every process that calls it reads
+    the log, so the service should run as a single process in this mode.
+    """
+    global live_detector
+    if live_detector is not None or not (LIVE_LOG_PATH or LIVE_SOCKET_PORT):
+        return live_detector
+    sessions = LiveSessions(max_sessions=LIVE_MAX_SESSIONS, idle_timeout=LIVE_IDLE_SECONDS,
+                            terminal_events=LIVE_TERMINAL_EVENTS, terminal_grace=LIVE_TERMINAL_GRACE_SECONDS,
+                            max_events=LIVE_MAX_SESSION_EVENTS)
+    alert_url = callback_base(None) + '-alert'
+
+    def send_alerts(alerts):
+        source = LIVE_LOG_PATH or f'port {LIVE_SOCKET_PORT}'
+        body, headers = encode_results({'source': source, 'results': alerts})
+        post(alert_url, body, headers)
+        sent_at = time.time()
+        for alert in alerts:
+            live_alert_latency.observe(alert['latency_seconds'] + sent_at - alert['detected_at'])
+        print(f"🚨 {len(alerts)} live alerts sent, e.g. {alerts[0]['block_id']} "
+              f"({alerts[0]['anomaly_score']}, closed by {alerts[0]['closed_by']})")
+
+    live_detector = LiveDetector(sessions, get_model, send_alerts, threshold=LIVE_ALERT_THRESHOLD,
+                                 top_k=EXPLANATION_TOP_K).start()
+    if LIVE_LOG_PATH:
+        live_sources.append(FileTail(LIVE_LOG_PATH, live_detector.feed).start())
+        print(f"👀 Following {LIVE_LOG_PATH} for live detection")
+    if LIVE_SOCKET_PORT:
+        source = SocketSource(live_detector.feed, port=LIVE_SOCKET_PORT).start()
+        live_sources.append(source)
+        print(f"👂 Reading live log lines on {source.address[0]}:{source.address[1]}")
+    return live_detector
+
+def live_payload():
+    """Build the /live response body and status code: the open sessions, counters and recent alerts"""
+    if live_detector is None:
+        return {'enabled': False}, 404
+    return dict(live_detector.stats(), enabled=True, recent_alerts=live_detector.recent()), 200
+
+def ingest_stream(params, content_encoding=None, content_length=None):
+    """Start an /ingest upload; params are its query parameters
+
+    Raises ValueError for a request that cannot be accepted and UploadTooLargeError when the
+    declared length is over the limit, both before any of the body is read.
+    """
+    if not params.get('upload_id'):
+        raise ValueError('Missing required fields')
+    max_bytes = int(INGEST_MAX_MB * 1024 * 1024)
+    if content_length is not None and int(content_length) > max_bytes:
+        raise UploadTooLargeError(f'Upload exceeds the limit of {max_bytes} bytes')
+    return IngestStream(max_bytes, content_encoding)
+
+def submit_ingest(params, ingest, run_job, result_format=None):
+    """Finish an /ingest upload and queue run_job for its sessions, like submit_analysis"""
+    builder = ingest.close()
+    print(f"📥 Ingested {ingest.received_bytes} bytes ({ingest.log_bytes} uncompressed): "
+          f"{builder.num_lines} lines, {len(builder.sessions)} blocks, {builder.num_unmatched} unmatched lines")
+    data = {
+        'upload_id': params.get('upload_id'),
+        'user_id': params.get('user_id'),
+        'filename': params.get('filename', 'unknown.log'),
+        'callback_url': params.get('callback_url'),
+        'profile': params.get('profile'),
+        'profile_memory': params.get('profile_memory'),
+    }
+    return submit_analysis(data, run_job, result_format, sessions=builder)
+
+def results_file_path(filename):
+    """Return the path of a results file, or None when it does not exist"""
+    if result_store is not None:
+        return result_store.export_path(filename)
+    filepath = os.path.join(ANALYSIS_RESULTS_DIR, os.path.basename(filename))
+    return filepath if os.path.exists(filepath) else None
+
+def job_status(job_id):
+    """Build the /status/<job_id> response body and status code
+
+    Under gunicorn the job may run in another worker process. Its status is then read
+    from the result store once it has started, without the progress of a running job.
+    """
+    job = job_manager.get(job_id)
+    if job is not None:
+        return job.to_dict(), 200
+    upload = result_store.upload_for_job(job_id) if result_store is not None else None
+    if upload is None:
+        return {'error': 'Job not found', 'job_id': job_id}, 404
+    return {
+        'job_id': job_id,
+        'upload_id': upload['upload_id'],
+        'status': {UPLOAD_RUNNING: JOB_RUNNING, UPLOAD_DONE: JOB_DONE}.get(upload['status'], JOB_FAILED),
+        'total_blocks': upload['total_blocks'],
+        'model_version': upload['model_version'],
+        'started_at': upload['created_at'],
+        'finished_at': upload['completed_at'],
+        'message': 'Job runs in another worker process',
+    }, 200
+
+def query_results(upload_id, args):
+    """Run a paged /uploads/<upload_id>/results query given its query parameters
+
+    Returns the response body and status code.
+    """
+    if result_store is None:
+        return {'error': 'Result store is disabled'}, 404
+    if result_store.upload(upload_id) is None:
+        return {'error': 'Upload not found', 'upload_id': upload_id}, 404
+    try:
+        page = result_store.query(upload_id, min_score=args.get('min_score'), max_score=args.get('max_score'),
+                                  block_id=args.get('block_id'), order=args.get('order', 'score'),
+                                  limit=min(int(args.get('limit', 100)), RESULT_PAGE_MAX),
+                                  cursor=args.get('cursor'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    upload = result_store.upload(upload_id)
+    page['status'] = upload['status']
+    page['model_version'] = upload['model_version']
+    return page, 200
+
+def metrics_payload():
+    """Render the /metrics response body in the Prometheus text format"""
+    return metrics.render()
+
+def models_payload():
+    """Build the /models response body: the registry versions, the active and the shadow version"""
+    return dict(model_registry.status(), shadow_scoring=shadow_scorer.stats())
+
+def activate_model(data):
+    """Swap in a model version from the admin endpoint once it is loaded and warmed up
+
+    Jobs already running finish on the version they started with. Returns the response
+    body and status code: 202 while the version loads, 200 when it is already active.
+    """
+    version = (data or {}).get('version')
+    if not version:
+        return {'error': 'Missing model version'}, 400
+    try:
+        started = model_registry.activate(version)
+    except UnknownVersionError as e:
+        return {'error': str(e), 'versions': sorted(model_registry.versions())}, 404
+    if not started:
+        active = model_registry.active()
+        if active is not None and active.version == version:
+            return {'version': version, 'message': 'Model version is already active'}, 200
+        return {'version': version, 'message': 'Model version is already being loaded'}, 202
+    return {'version': version, 'message': 'Loading model version, new jobs use it once it is warmed up'}, 202
+
+def shadow_model(data):
+    """Start shadowing the active model with a version, or stop with a null version"""
+    version = (data or {}).get('version')
+    try:
+        started = model_registry.set_shadow(version)
+    except UnknownVersionError as e:
+        return {'error': str(e), 'versions': sorted(model_registry.versions())}, 404
+    if not started:
+        return {'version': None, 'message': 'Shadow scoring stopped'}, 200
+    return {'version': version, 'message': 'Loading shadow model version'}, 202
+
+def ready_payload():
+    """Build the /ready response body and status code: 200 once the model is warmed up, else 503"""
+    status = model_loader.status()
+    return status, 200 if status['ready'] else 503
+
+def health_payload(service_name):
+    """Build the /health response body and status code
+
+    The service is healthy while it is loading the model too, so a supervisor does not
+    restart it during warm-up; only a failed model load makes it unhealthy.
+    """
+    body = {
+        'status': 'unhealthy' if model_loader.error is not None else 'healthy',
+        'model': model_loader.status(),
+        'service': service_name,
+        'timestamp': datetime.now().isoformat(),
+        'results_directory': ANALYSIS_RESULTS_DIR,
+        'scoring_cache': scoring_cache.stats(),
+        'scoring_batcher': scoring_batcher.stats() if scoring_batcher else None,
+        'callback_outbox': callback_outbox.stats() if callback_outbox else None,
+        'result_store': result_store.stats() if result_store else None,
+        'tracing': trace_exporter.stats() if trace_exporter else None,
+        'models': models_payload(),
+        'worker': prefork.stats(),
+        'checkpoints': checkpoint_store.stats() if checkpoint_store else None,
+        'live': live_detector.stats() if live_detector else None,
+        'jobs': job_manager.stats()
+    }
+    return body, 503 if model_loader.error is not None else 200
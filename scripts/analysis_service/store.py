@@ -0,0 +1,304 @@
+"""
+Local result store for the HDFS analysis service
+Scored blocks of every job are kept in SQLite keyed by (upload_id, block_id) and indexed by
+score, so results can be paged and filtered without loading an upload, and a CSV export is
+written next to it for download.
+"""
+
+import base64
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    upload_id TEXT PRIMARY KEY,
+    analysis_filename TEXT,
+    job_id TEXT,
+    model_version TEXT,
+    status TEXT NOT NULL,
+    total_blocks INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    completed_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_filename ON uploads(analysis_filename);
+CREATE INDEX IF NOT EXISTS idx_uploads_job ON uploads(job_id);
+CREATE TABLE IF NOT EXISTS reasons (
+    reason_id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS results (
+    upload_id TEXT NOT NULL,
+    block_id TEXT NOT NULL,
+    anomaly_score REAL NOT NULL,
+    anomaly_probability REAL,
+    reason_id INTEGER,
+    PRIMARY KEY (upload_id, block_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_results_score ON results(upload_id, anomaly_score DESC, block_id);
+"""
+
+ORDER_SCORE = 'score'
+ORDER_BLOCK = 'block'
+
+# Columns added to the schema since the first release, created in older stores on open
+_MIGRATIONS = (('uploads', 'model_version', 'TEXT'),)
+
+CSV_COLUMNS = ['block_id', 'anomaly_score', 'anomaly_probability', 'reason']
+
+UPLOAD_RUNNING = 'running'
+UPLOAD_DONE = 'done'
+UPLOAD_FAILED = 'failed'
+
+# Page cache per connection, in KiB (negative cache_size); the default 2MB makes large jobs
+# re-read index pages for every chunk
+_CACHE_KIB = -65536
+_AUTOCHECKPOINT_PAGES = 1000
+
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row['anomaly_score'], row['block_id']]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        score, block_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(score), str(block_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+class ResultStore(object):
+    """SQLite store of the scored blocks of every upload
+
+    Every thread uses its own connection; with WAL, queries are not blocked by a job
+    writing results. Reasons are stored once in a table and referenced by id.
+    """
+
+    def __init__(self, path, export_dir=None):
+        self.path = path
+        self.export_dir = export_dir
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reason_ids = dict()
+        db = self._db()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(_SCHEMA)
+        for table, column, column_type in _MIGRATIONS:
+            if column not in [row['name'] for row in db.execute(f'PRAGMA table_info({table})')]:
+                db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None)
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(f'PRAGMA cache_size={_CACHE_KIB}')
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    def writer(self, upload_id, analysis_filename=None, job_id=None, model_version=None, export_bytes=None):
+        """Return a ResultWriter replacing the stored results of an upload
+
+        A job resumed from a checkpoint passes the export_bytes it saved to keep its results.
+        """
+        return ResultWriter(self, upload_id, analysis_filename, job_id, model_version, export_bytes)
+
+    def rows(self, upload_id):
+        """Yield every stored result of an upload as a dict, in no particular order"""
+        cursor = self._db().execute('SELECT r.block_id, r.anomaly_score, r.anomaly_probability, s.text AS reason '
+                                    'FROM results r LEFT JOIN reasons s ON s.reason_id = r.reason_id '
+                                    'WHERE r.upload_id = ?', (upload_id,))
+        for row in cursor:
+            yield dict(row)
+
+    def _reason_id(self, db, text):
+        reason_id = self._reason_ids.get(text)
+        if reason_id is None:
+            with self._lock:
+                db.execute('INSERT OR IGNORE INTO reasons (text) VALUES (?)', (text,))
+                reason_id = db.execute('SELECT reason_id FROM reasons WHERE text = ?', (text,)).fetchone()[0]
+                self._reason_ids[text] = reason_id
+        return reason_id
+
+    def upload(self, upload_id):
+        row = self._db().execute('SELECT * FROM uploads WHERE upload_id = ?', (upload_id,)).fetchone()
+        return dict(row) if row else None
+
+    def upload_for_filename(self, analysis_filename):
+        row = self._db().execute('SELECT * FROM uploads WHERE analysis_filename = ?', (analysis_filename,)).fetchone()
+        return dict(row) if row else None
+
+    def upload_for_job(self, job_id):
+        row = self._db().execute('SELECT * FROM uploads WHERE job_id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def export_path(self, analysis_filename):
+        """Return the path of the CSV export of a finished upload, or None"""
+        upload = self.upload_for_filename(analysis_filename)
+        if upload is None or upload['status'] != UPLOAD_DONE or not self.export_dir:
+            return None
+        path = os.path.join(self.export_dir, os.path.basename(analysis_filename))
+        return path if os.path.exists(path) else None
+
+    def query(self, upload_id, min_score=None, max_score=None, block_id=None, order=ORDER_SCORE, limit=100,
+              cursor=None):
+        """Return one page of results and the cursor of the next page
+
+        Results are ordered by descending score (ties by block id) or by block id; a page
+        starts after the row encoded in cursor, so paging costs the same on every page.
+        Scores are on the 0-100 scale of anomaly_score. Returns a dict with the rows,
+        next_cursor (None on the last page) and the number of matching rows.
+        """
+        if order not in (ORDER_SCORE, ORDER_BLOCK):
+            raise ValueError(f'Unknown order: {order}')
+        where = ['r.upload_id = ?']
+        params = [upload_id]
+        if min_score is not None:
+            where.append('r.anomaly_score >= ?')
+            params.append(float(min_score))
+        if max_score is not None:
+            where.append('r.anomaly_score <= ?')
+            params.append(float(max_score))
+        if block_id is not None:
+            where.append('r.block_id = ?')
+            params.append(block_id)
+        db = self._db()
+        upload = self.upload(upload_id)
+        if upload is not None and upload['status'] == UPLOAD_DONE and len(where) == 1:
+            total = upload['total_blocks']
+        else:
+            total = db.execute('SELECT COUNT(*) FROM results r WHERE ' + ' AND '.join(where), params).fetchone()[0]
+
+        limit = int(limit)
+        order_by = 'r.anomaly_score DESC, r.block_id' if order == ORDER_SCORE else 'r.block_id'
+        select = ('SELECT r.block_id, r.anomaly_score, r.anomaly_probability, s.text AS reason FROM results r '
+                  'LEFT JOIN reasons s ON s.reason_id = r.reason_id WHERE ')
+        if not cursor:
+            rows = db.execute(select + ' AND '.join(where) + ' ORDER BY ' + order_by + ' LIMIT ?',
+                              params + [limit + 1]).fetchall()
+        elif order == ORDER_BLOCK:
+            _, last_block = decode_cursor(cursor)
+            rows = db.execute(select + ' AND '.join(where + ['r.block_id > ?']) + ' ORDER BY ' + order_by +
+                              ' LIMIT ?', params + [last_block, limit + 1]).fetchall()
+        else:
+            # Two range scans of the score index instead of an OR, which SQLite cannot seek on:
+            # the rest of the tied score first, then the lower scores
+            last_score, last_block = decode_cursor(cursor)
+            rows = db.execute(select + ' AND '.join(where + ['r.anomaly_score = ?', 'r.block_id > ?']) +
+                              ' ORDER BY ' + order_by + ' LIMIT ?',
+                              params + [last_score, last_block, limit + 1]).fetchall()
+            if len(rows) <= limit:
+                rows += db.execute(select + ' AND '.join(where + ['r.anomaly_score < ?']) + ' ORDER BY ' +
+                                   order_by + ' LIMIT ?', params + [last_score, limit + 1 - len(rows)]).fetchall()
+        rows = [dict(row) for row in rows]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1])
+        return {'upload_id': upload_id, 'total': total, 'results': rows, 'next_cursor': next_cursor}
+
+    def stats(self):
+        db = self._db()
+        uploads = db.execute('SELECT COUNT(*) FROM uploads').fetchone()[0]
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {'uploads': uploads, 'reasons': len(self._reason_ids), 'size_mb': round(size / 1024 / 1024, 1)}
+
+
+class ResultWriter(object):
+    """Write the results of one job chunk by chunk to the store and the CSV export
+
+    The previous results of the upload are replaced. The CSV is written under a temporary
+    name and renamed by close(), so a download never sees a partial export.
+
+    A writer resuming a job keeps its stored results instead, and cuts its partial CSV
+    back to the export_bytes of the checkpoint; rows written after it are written again.
+    Without the partial CSV, the export is written from the store by close().
+    """
+
+    def __init__(self, store, upload_id, analysis_filename=None, job_id=None, model_version=None,
+                 export_bytes=None):
+        self.store = store
+        self.upload_id = upload_id
+        self.analysis_filename = analysis_filename
+        self.num_results = 0
+        self._resumed = export_bytes is not None
+        self._db = store._db()
+        self._db.execute('BEGIN IMMEDIATE')
+        if export_bytes is None:
+            self._db.execute('DELETE FROM results WHERE upload_id = ?', (upload_id,))
+        self._db.execute('INSERT OR REPLACE INTO uploads (upload_id, analysis_filename, job_id, model_version, status, '
+                         'created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                         (upload_id, analysis_filename, job_id, model_version, UPLOAD_RUNNING, time.time()))
+        self._db.execute('COMMIT')
+        # Checkpointing every 1000 pages while the index grows costs more than the inserts;
+        # the WAL is checkpointed once when the job ends
+        self._db.execute('PRAGMA wal_autocheckpoint=0')
+        self._csv_file = None
+        self._csv_path = None
+        if store.export_dir and analysis_filename:
+            self._csv_path = os.path.join(store.export_dir, os.path.basename(analysis_filename))
+            partial_path = self._csv_path + '.partial'
+            if self._resumed and os.path.exists(partial_path):
+                with open(partial_path, 'r+b') as f:
+                    f.truncate(export_bytes)
+                self._csv_file = open(partial_path, 'a', newline='', encoding='utf-8')
+                self._csv = csv.writer(self._csv_file)
+            elif not self._resumed:
+                self._csv_file = open(partial_path, 'w', newline='', encoding='utf-8')
+                self._csv = csv.writer(self._csv_file)
+                self._csv.writerow(CSV_COLUMNS)
+
+    def add(self, results):
+        rows = [(self.upload_id, result['block_id'], result['anomaly_score'], result.get('anomaly_probability'),
+                 self.store._reason_id(self._db, result.get('reason', ''))) for result in results]
+        self._db.execute('BEGIN')
+        self._db.executemany('INSERT OR REPLACE INTO results (upload_id, block_id, anomaly_score, anomaly_probability, '
+                             'reason_id) VALUES (?, ?, ?, ?, ?)', rows)
+        self._db.execute('COMMIT')
+        if self._csv_file is not None:
+            self._csv.writerows([result.get(column) for column in CSV_COLUMNS] for result in results)
+        self.num_results += len(results)
+
+    def export_bytes(self):
+        """Size of the partial CSV export, written out to the file; 0 without an export"""
+        if self._csv_file is None:
+            return 0
+        self._csv_file.flush()
+        return self._csv_file.tell()
+
+    def close(self):
+        if self._csv_path is not None and self._csv_file is None:
+            self._export_from_store()
+        if self._csv_file is not None:
+            self._csv_file.close()
+            os.replace(self._csv_path + '.partial', self._csv_path)
+        total_blocks = self.num_results
+        if self._resumed:
+            total_blocks = self._db.execute('SELECT COUNT(*) FROM results WHERE upload_id = ?',
+                                            (self.upload_id,)).fetchone()[0]
+        self._db.execute('UPDATE uploads SET status = ?, total_blocks = ?, completed_at = ? WHERE upload_id = ?',
+                         (UPLOAD_DONE, total_blocks, time.time(), self.upload_id))
+        self._checkpoint()
+
+    def _export_from_store(self):
+        self._csv_file = open(self._csv_path + '.partial', 'w', newline='', encoding='utf-8')
+        self._csv = csv.writer(self._csv_file)
+        self._csv.writerow(CSV_COLUMNS)
+        self._csv.writerows([row.get(column) for column in CSV_COLUMNS] for row in self.store.rows(self.upload_id))
+
+    def abort(self):
+        if self._csv_file is not None:
+            self._csv_file.close()
+            os.remove(self._csv_path + '.partial')
+        self._db.execute('UPDATE uploads SET status = ?, completed_at = ? WHERE upload_id = ?',
+                         (UPLOAD_FAILED, time.time(), self.upload_id))
+        self._checkpoint()
+
+    def _checkpoint(self):
+        self._db.execute(f'PRAGMA wal_autocheckpoint={_AUTOCHECKPOINT_PAGES}')
+        self._db.execute('PRAGMA wal_checkpoint(PASSIVE)')
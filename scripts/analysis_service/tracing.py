@@ -0,0 +1,151 @@
+"""
+Trace export for the HDFS analysis service
+Writes every finished loglizer span as one JSON line to a local file, and reads the file
+back into per-upload latency breakdowns.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class JsonLinesExporter(object):
+    """loglizer instrumentation listener appending every span to a JSON-lines file
+
+    The file is rotated to path + '.1' once it grows over max_bytes, so at most twice
+    that is kept on disk; 0 never rotates. The workers of a pre-fork server may share
+    the path: the size is taken from the file on disk, one process rotates it under a
+    file lock, and the others reopen the path once its inode changed.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.exported = 0
+        self.errors = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = None
+        self._inode = None
+        self._open()
+
+    def __call__(self, span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self._lock:
+            try:
+                if self._rotated():
+                    self._open()
+                self._file.write(line)
+                self._file.flush()
+                self.exported += 1
+                if self.max_bytes and os.fstat(self._file.fileno()).st_size > self.max_bytes:
+                    self._rotate()
+            except (OSError, ValueError):
+                # Tracing must never fail the stage it observes
+                self.errors += 1
+
+    def _open(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+    def _rotated(self):
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except OSError:
+            return True
+
+    def _rotate(self):
+        # Another process may have rotated the file since the size was read; only the
+        # first one holding the lock on the full file renames it
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            if not self._rotated():
+                os.replace(self.path, self.path + '.1')
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._open()
+
+    def stats(self):
+        with self._lock:
+            try:
+                size = os.fstat(self._file.fileno()).st_size
+            except (OSError, ValueError):
+                size = None
+            return {'path': self.path, 'exported': self.exported, 'errors': self.errors, 'bytes': size}
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_spans(path, upload_id=None):
+    """Read the spans of a trace file, or of the traces of one upload only
+
+    A trace belongs to an upload when any of its spans carries the upload_id in its
+    context, so spans started before the upload_id was known are included.
+    """
+    spans = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                spans.append(json.loads(line))
+    if upload_id is None:
+        return spans
+    trace_ids = {span['trace_id'] for span in spans if span['context'].get('upload_id') == upload_id}
+    return [span for span in spans if span['trace_id'] in trace_ids]
+
+
+def latency_breakdown(spans):
+    """Group spans by trace and sum the time of every stage
+
+    Returns one dict per trace, in order of their first span, with the upload_id and
+    job_id, the wall-clock seconds from the first span's start to the last span's end, and
+    stage -> {calls, seconds, items, self_seconds}. A stage's self time excludes its
+    children in the same process, so the self times of a sequential trace add up to its
+    duration; child spans of other threads and processes may overlap their parent.
+    """
+    traces = OrderedDict()
+    for span in sorted(spans, key=lambda span: span['start']):
+        traces.setdefault(span['trace_id'], []).append(span)
+    breakdowns = []
+    for trace_id, trace_spans in traces.items():
+        child_seconds = dict()
+        by_id = {span['span_id']: span for span in trace_spans}
+        for span in trace_spans:
+            parent = by_id.get(span['parent_id'])
+            if parent is not None and parent['pid'] == span['pid'] and parent['thread'] == span['thread']:
+                child_seconds[parent['span_id']] = child_seconds.get(parent['span_id'], 0.0) + span['seconds']
+        context = dict()
+        stages = dict()
+        for span in trace_spans:
+            for key, value in span['context'].items():
+                context.setdefault(key, value)
+            totals = stages.setdefault(span['name'], {'calls': 0, 'seconds': 0.0, 'items': 0, 'self_seconds': 0.0})
+            totals['calls'] += 1
+            totals['seconds'] += span['seconds']
+            totals['items'] += span['items']
+            totals['self_seconds'] += max(span['seconds'] - child_seconds.get(span['span_id'], 0.0), 0.0)
+        start = trace_spans[0]['start']
+        end = max(span['start'] + span['seconds'] for span in trace_spans)
+        breakdowns.append({
+            'trace_id': trace_id,
+            'upload_id': context.get('upload_id'),
+            'job_id': context.get('job_id'),
+            'spans': len(trace_spans),
+            'seconds': end - start,
+            'stages': stages,
+        })
+    return breakdowns
@@ -0,0 +1,303 @@
+"""
+ASGI Service Simulator for HDFS Log Analysis
+Asyncio variant of flask-simulator.py with the same endpoints and callbacks. Scoring runs
+on the job manager's worker threads. Callbacks go to the durable callback outbox, or, when
+it is disabled, are sent from the event loop with a pooled async HTTP client, so a slow
+Next.js endpoint never holds a worker.
+"""
+
+import asyncio
+import contextlib
+import os
+import threading
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Route
+
+import sys
+# The service package sits next to this script, wherever it is started from
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from analysis_service.service import (ANALYSIS_RESULTS_DIR, FLASK_HOST, FLASK_PORT, RESULT_DELIVERY,
+                                      CALLBACK_RETRIES, job_manager, callback_outbox, iter_results, score_upload,
+                                      result_stream, completion_body, completion_url,
+                                      submit_analysis, ingest_stream, submit_ingest, results_file_path,
+                                      query_results, health_payload, ready_payload, metrics_payload,
+                                      profile_job, profile_report, profile_file_path, models_payload,
+                                      activate_model, shadow_model, job_status, resume_jobs,
+                                      start_live_detection, live_payload)
+from analysis_service.ingest import UploadTooLargeError
+from analysis_service.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from loglizer import instrumentation
+
+CALLBACK_MAX_CONNECTIONS = int(os.getenv('CALLBACK_MAX_CONNECTIONS', 20))
+CALLBACK_TIMEOUT_SECONDS = float(os.getenv('CALLBACK_TIMEOUT_SECONDS', 10))
+CALLBACK_MAX_IN_FLIGHT = int(os.getenv('CALLBACK_MAX_IN_FLIGHT', 4))
+
+# /ingest body chunks are collected up to this size before they are parsed off the event loop
+INGEST_PARSE_BYTES = 1 << 20
+
+# Set by the lifespan handler; job threads hand callbacks over to this loop
+event_loop = None
+http_client = None
+pending_callbacks = set()
+
+class OrderedPoster(object):
+    """Post the requests of one job from the event loop, one after the other
+
+    Called from a job thread, which only waits when max_in_flight requests are still
+    unsent; that bounds the buffered batches while a slow endpoint catches up.
+    """
+
+    def __init__(self, max_in_flight=CALLBACK_MAX_IN_FLIGHT):
+        self._slots = threading.Semaphore(max_in_flight)
+        self._last = None
+
+    def __call__(self, url, body, headers):
+        self._slots.acquire()
+        # The loop does not share this thread's context, so the job's span is passed along
+        span = instrumentation.current_span()
+        future = asyncio.run_coroutine_threadsafe(self._send(self._last, url, body, headers, span), event_loop)
+        pending_callbacks.add(future)
+        future.add_done_callback(pending_callbacks.discard)
+        self._last = future
+
+    async def _send(self, previous, url, body, headers, span=None):
+        try:
+            if previous is not None:
+                # Keeps batches in order and the completion marker last
+                await asyncio.gather(asyncio.wrap_future(previous), return_exceptions=True)
+            for attempt in range(CALLBACK_RETRIES + 1):
+                try:
+                    with instrumentation.attach(span):
+                        with instrumentation.timed('callback_delivery', len(body), url=url,
+                                                   attempt=attempt + 1) as delivery:
+                            response = await http_client.post(url, content=body, headers=headers)
+                            delivery.attributes['status_code'] = response.status_code
+                            response.raise_for_status()
+                    return
+                except Exception as e:
+                    if attempt == CALLBACK_RETRIES:
+                        print(f"⚠️  Error sending {url}: {e}")
+                        return
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+        finally:
+            self._slots.release()
+
+def process_blocks_async(job, upload_id, block_ids, file_path, callback_url, analysis_filename, result_format,
+                         sessions=None):
+    """Score all blocks of an upload and queue its callbacks for delivery
+
+    Runs on a job manager worker, which is free again as soon as the callbacks are queued.
+    """
+    # The outbox persists callbacks and delivers them from its own threads
+    post = callback_outbox.poster(job.job_id) if callback_outbox is not None else OrderedPoster()
+    if RESULT_DELIVERY == 'stream':
+        stream = result_stream(upload_id, callback_url, post, result_format, job)
+        for chunk in iter_results(job, upload_id, block_ids, file_path, sessions, analysis_filename, stream):
+            stream.add(chunk)
+        stream.finish(analysis_filename)
+        print(f"✓ Queued {stream.blocks_sent} results in {stream.batches_sent} batches for {stream.batch_url}")
+        return
+
+    analysis_results = score_upload(job, upload_id, block_ids, file_path, sessions, analysis_filename)
+    # Serialize on the worker thread so the event loop only does I/O
+    body, headers = completion_body(upload_id, analysis_filename, analysis_results, result_format,
+                                    job.model_version, job.job_id)
+    post(completion_url(callback_url), body, headers)
+    print(f"✓ Queued {len(analysis_results)} results for {completion_url(callback_url)}")
+    print(f"Analysis complete for upload {upload_id}. Results sent directly to Next.js (no file saved)")
+
+async def analyze_hdfs_logs(request):
+    """Receive HDFS log analysis request from Next.js"""
+    try:
+        # Root span of the upload's trace; to_thread passes it on to the submission
+        with instrumentation.timed('analyze_request', bytes=int(request.headers.get('content-length') or 0)) as span:
+            with instrumentation.timed('request_parse') as stage:
+                data = await request.json()
+                stage.items = len(data.get('block_ids') or [])
+            span.items = stage.items
+            span.set_context(upload_id=data.get('upload_id'))
+            # Submission only validates and queues, but it takes the job manager lock
+            body, status, headers = await asyncio.to_thread(submit_analysis, data, process_blocks_async,
+                                                            request.headers.get('x-result-format'))
+            span.attributes['status_code'] = status
+        return JSONResponse(body, status_code=status, headers=headers)
+    except Exception as e:
+        print(f"✗ Error in analyze endpoint: {e}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def ingest_hdfs_log(request):
+    """Receive a raw or structured HDFS log as a streamed request body and analyze it"""
+    try:
+        params = request.query_params
+        with instrumentation.timed('ingest_request', context={'upload_id': params.get('upload_id')}) as span:
+            ingest = ingest_stream(params, request.headers.get('content-encoding'),
+                                   request.headers.get('content-length'))
+            pending = []
+            pending_bytes = 0
+            async for chunk in request.stream():
+                pending.append(chunk)
+                pending_bytes += len(chunk)
+                if pending_bytes >= INGEST_PARSE_BYTES:
+                    await asyncio.to_thread(ingest.write, b''.join(pending))
+                    pending = []
+                    pending_bytes = 0
+            await asyncio.to_thread(ingest.write, b''.join(pending))
+            span.attributes['bytes'] = ingest.received_bytes
+            body, status, headers = await asyncio.to_thread(submit_ingest, params, ingest, process_blocks_async,
+                                                            request.headers.get('x-result-format'))
+            span.items = ingest.builder.num_lines
+            span.attributes['status_code'] = status
+        return JSONResponse(body, status_code=status, headers=headers)
+    except UploadTooLargeError as e:
+        return JSONResponse({'error': str(e)}, status_code=413)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        print(f"✗ Error in ingest endpoint: {e}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def get_job_status(request):
+    """Get status of analysis job"""
+    body, status = await asyncio.to_thread(job_status, request.path_params['job_id'])
+    return JSONResponse(body, status_code=status)
+
+async def start_job_profile(request):
+    """Admin: profile a queued job, or sample a running one; body {"mode": "cprofile" | "sampling"}"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    body, status = profile_job(request.path_params['job_id'], data)
+    return JSONResponse(body, status_code=status)
+
+async def get_job_profile(request):
+    """Profile report of a finished job, with the names of its files"""
+    body, status = profile_report(request.path_params['job_id'])
+    return JSONResponse(body, status_code=status)
+
+async def download_job_profile(request):
+    """Download a profile report file, e.g. cprofile.pstats or sampling.collapsed"""
+    filename = request.path_params['filename']
+    filepath = profile_file_path(request.path_params['job_id'], filename)
+    if not filepath:
+        return JSONResponse({'error': 'File not found'}, status_code=404)
+    return FileResponse(filepath, filename=os.path.basename(filepath))
+
+async def get_analysis_results(request):
+    """Download analysis results file"""
+    try:
+        filepath = results_file_path(request.path_params['filename'])
+        if filepath:
+            # Streamed in chunks instead of read into memory; Range requests get partial responses
+            return FileResponse(filepath, media_type='text/csv')
+        return JSONResponse({'error': 'File not found'}, status_code=404)
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def get_upload_results(request):
+    """Page through the stored results of an upload"""
+    body, status = await asyncio.to_thread(query_results, request.path_params['upload_id'], request.query_params)
+    return JSONResponse(body, status_code=status)
+
+async def list_models(request):
+    """Model versions in the registry, the active and the shadow version"""
+    return JSONResponse(await asyncio.to_thread(models_payload))
+
+async def activate_model_version(request):
+    """Admin: load a model version in the background and swap it in for new jobs; body {"version": ...}"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    body, status = activate_model(data)
+    return JSONResponse(body, status_code=status)
+
+async def shadow_model_version(request):
+    """Admin: score sampled batches with a second version too; body {"version": ...}, null to stop"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    body, status = shadow_model(data)
+    return JSONResponse(body, status_code=status)
+
+async def get_metrics(request):
+    """Prometheus metrics: stage latencies, job queue, caches, callbacks and process memory"""
+    # Collectors query the outbox database and take component locks, so render off the loop
+    return Response(await asyncio.to_thread(metrics_payload), media_type=METRICS_CONTENT_TYPE)
+
+async def health_check(request):
+    """Health check endpoint"""
+    body, status = health_payload('HDFS Log Analysis ASGI Simulator')
+    return JSONResponse(body, status_code=status)
+
+async def readiness_check(request):
+    """Readiness check: 503 until the model is loaded and warmed up"""
+    body, status = ready_payload()
+    return JSONResponse(body, status_code=status)
+
+async def live_status(request):
+    """Live detection: open sessions, closed sessions by reason and the recent alerts"""
+    body, status = live_payload()
+    return JSONResponse(body, status_code=status)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global event_loop, http_client
+    event_loop = asyncio.get_running_loop()
+    limits = httpx.Limits(max_connections=CALLBACK_MAX_CONNECTIONS,
+                          max_keepalive_connections=CALLBACK_MAX_CONNECTIONS)
+    async with httpx.AsyncClient(limits=limits, timeout=CALLBACK_TIMEOUT_SECONDS) as client:
+        http_client = client
+        # Jobs interrupted when an earlier service process ended continue from their last checkpoint
+        resume_jobs(process_blocks_async)
+        # Alerts of the live log, if one is configured, are posted in order like a job's callbacks
+        start_live_detection(callback_outbox.poster('live') if callback_outbox is not None else OrderedPoster())
+        yield
+        # Let queued jobs finish and their callbacks go out before the client closes
+        await asyncio.to_thread(job_manager.shutdown)
+        await asyncio.gather(*[asyncio.wrap_future(future) for future in list(pending_callbacks)],
+                             return_exceptions=True)
+
+app = Starlette(routes=[
+    Route('/analyze', analyze_hdfs_logs, methods=['POST']),
+    Route('/ingest', ingest_hdfs_log, methods=['POST']),
+    Route('/status/{job_id}', get_job_status, methods=['GET']),
+    Route('/status/{job_id}/profile', start_job_profile, methods=['POST']),
+    Route('/status/{job_id}/profile', get_job_profile, methods=['GET']),
+    Route('/status/{job_id}/profile/{filename}', download_job_profile, methods=['GET']),
+    Route('/results/{filename}', get_analysis_results, methods=['GET']),
+    Route('/uploads/{upload_id}/results', get_upload_results, methods=['GET']),
+    Route('/models', list_models, methods=['GET']),
+    Route('/models/activate', activate_model_version, methods=['POST']),
+    Route('/models/shadow', shadow_model_version, methods=['POST']),
+    Route('/metrics', get_metrics, methods=['GET']),
+    Route('/health', health_check, methods=['GET']),
+    Route('/ready', readiness_check, methods=['GET']),
+    Route('/live', live_status, methods=['GET']),
+], lifespan=lifespan)
+
+if __name__ == '__main__':
+    print("🚀 Starting HDFS Log Analysis ASGI Simulator")
+    print(f"📁 Analysis results will be saved to: {os.path.abspath(ANALYSIS_RESULTS_DIR)}")
+    print(f"   Callback connections: {CALLBACK_MAX_CONNECTIONS} (timeout {CALLBACK_TIMEOUT_SECONDS}s)")
+    print("🔗 Available endpoints:")
+    print("   POST /analyze - Receive analysis requests")
+    print("   POST /ingest - Stream a log for analysis")
+    print("   GET /status/<job_id> - Check job status")
+    print("   POST /status/<job_id>/profile - Profile a job")
+    print("   GET /status/<job_id>/profile[/<file>] - Job profile report and files")
+    print("   GET /results/<filename> - Download results")
+    print("   GET /uploads/<upload_id>/results - Page through stored results")
+    print("   GET /models - Model versions; POST /models/activate, /models/shadow to swap or shadow one")
+    print("   GET /metrics - Prometheus metrics")
+    print("   GET /health - Health check")
+    print("   GET /ready - Readiness check (503 until the model is warmed up)")
+    print("   GET /live - Live detection of a growing log: open sessions and recent alerts")
+    print("\n" + "="*50)
+
+    uvicorn.run(app, host=FLASK_HOST, port=FLASK_PORT)
@@ -0,0 +1,925 @@
+"""
+Benchmarks for the HDFS log analysis pipeline
+Generates a synthetic structured HDFS log and measures the analysis stages on it
+
+Usage:
+    python benchmark-analyzer.py scoring --blocks 100000
+    python benchmark-analyzer.py workers --blocks 200000 --workers 1,2,4
+    python benchmark-analyzer.py scheduler --jobs 200
+    python benchmark-analyzer.py coalescing --clients 16 --sessions 20
+    python benchmark-analyzer.py outbox --messages 2000 --fail-rate 0.2
+    python benchmark-analyzer.py formats --sizes 10000,100000,1000000
+    python benchmark-analyzer.py store --blocks 1000000
+    python benchmark-analyzer.py checkpoints --blocks 1000000
+    python benchmark-analyzer.py stub-callback --port 3001 --fail-rate 0.2
+    python benchmark-analyzer.py traces analysis_results/traces.jsonl --upload-id <upload_id>
+    python benchmark-analyzer.py startup --service flask-simulator.py --runs 5
+    python benchmark-analyzer.py serving --workers 1,2,4 --jobs 16 --blocks 20000
+    python benchmark-analyzer.py live --blocks 10000 --rate 20000 --max-sessions 1000
+    python benchmark-analyzer.py windows --blocks 100000 --windows 60:60,300:10
+    python benchmark-analyzer.py ngram --sessions 200000 --window-size 10 --history 5 --top-g 3
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+import numpy as np
+import pandas as pd
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_dir)
+from loglizer import dataloader, preprocessing, instrumentation
+from loglizer.scoring import ScoringCache, score_sessions, render_reasons
+from analysis_service.parallel import ShardedScorer
+from analysis_service.jobs import JobManager, estimate_cost, size_class
+from analysis_service.batching import BatchCoalescer
+from analysis_service.outbox import CallbackOutbox
+from analysis_service.store import ResultStore
+from analysis_service.checkpoints import CheckpointStore
+from analysis_service.live import FileTail, LiveDetector
+from analysis_service.registry import DeployedModel
+from loglizer.sessions import LiveSessions
+from loglizer.models import NGram
+from analysis_service.tracing import read_spans, latency_breakdown
+from analysis_service.delivery import FORMAT_JSON, FORMAT_NDJSON, FORMAT_MSGPACK, encode_results, decode_results
+import joblib
+
+MODEL_PATH = os.path.join(script_dir, 'loglizer_LR_model_benchmark.joblib')
+
+# Event templates of the HDFS dataset used to render synthetic log lines
+HDFS_TEMPLATES = {
+    'E2': 'Verification succeeded for <*>',
+    'E3': 'Served block <*> to /<*>',
+    'E5': 'Receiving block <*> src: /<*> dest: /<*>',
+    'E7': 'writeBlock <*> received exception <*>',
+    'E9': 'Received block <*> of size <*> from /<*>',
+    'E11': 'PacketResponder <*> for block <*> terminating',
+    'E13': 'Receiving empty packet for block <*>',
+    'E21': 'Deleting block <*> file <*>',
+    'E22': 'BLOCK* NameSystem.allocateBlock:<*>',
+    'E23': 'BLOCK* NameSystem.delete: <*> is added to invalidSet of <*>',
+    'E26': 'BLOCK* NameSystem.addStoredBlock: blockMap updated: <*> is added to <*> size <*>',
+}
+
+# Typical block lifecycles; anomalous sessions append an exception event
+NORMAL_SESSIONS = [
+    ['E5', 'E22', 'E5', 'E5', 'E11', 'E11', 'E9', 'E9', 'E11', 'E9', 'E26', 'E26', 'E26'],
+    ['E5', 'E22', 'E5', 'E5', 'E11', 'E9', 'E11', 'E9', 'E11', 'E9', 'E26', 'E26', 'E26', 'E3'],
+    ['E22', 'E5', 'E5', 'E5', 'E26', 'E26', 'E11', 'E9', 'E11', 'E9', 'E26', 'E11', 'E9',
+     'E23', 'E23', 'E23', 'E21', 'E21', 'E21'],
+    ['E5', 'E5', 'E22', 'E5', 'E11', 'E9', 'E11', 'E9', 'E11', 'E9', 'E26', 'E26', 'E26', 'E2'],
+]
+ANOMALY_SUFFIXES = [['E7'], ['E13', 'E7'], ['E7', 'E7']]
+
+
+def generate_structured_log(path, num_blocks, anomaly_ratio=0.03, seed=0):
+    """Write a synthetic structured HDFS log with num_blocks block sessions"""
+    rng = np.random.RandomState(seed)
+    block_ids = ['blk_{}'.format(n) for n in rng.randint(-2 ** 62, 2 ** 62, size=num_blocks)]
+    sequences = []
+    for i in range(num_blocks):
+        sequence = list(NORMAL_SESSIONS[rng.randint(len(NORMAL_SESSIONS))])
+        if rng.rand() < anomaly_ratio:
+            sequence += ANOMALY_SUFFIXES[rng.randint(len(ANOMALY_SUFFIXES))]
+        sequences.append(sequence)
+    lengths = np.array([len(sequence) for sequence in sequences])
+    event_ids = np.concatenate([np.array(sequence) for sequence in sequences])
+    blocks = np.repeat(np.array(block_ids), lengths)
+    # Interleave the sessions the way concurrent block operations appear in a real log
+    order = np.argsort(np.repeat(np.arange(num_blocks), lengths) + rng.rand(len(blocks)) * 50,
+                       kind='stable')
+    event_ids, blocks = event_ids[order], blocks[order]
+    templates = pd.Series(event_ids).map(HDFS_TEMPLATES)
+    num_lines = len(event_ids)
+    struct_log = pd.DataFrame({
+        'LineId': np.arange(1, num_lines + 1),
+        'Date': '081109',
+        'Time': 203518 + np.arange(num_lines) // 1000,
+        'Pid': 143,
+        'Level': 'INFO',
+        'Component': 'dfs.DataNode$DataXceiver',
+        'Content': templates.str.replace('<*>', '', n=1, regex=False) + ' ' + blocks,
+        'EventId': event_ids,
+        'EventTemplate': templates,
+    })
+    struct_log.to_csv(path, index=False)
+    return block_ids
+
+
+def synthetic_log(args):
+    log_path = os.path.join(args.workdir, 'synthetic_{}.csv'.format(args.blocks))
+    if not os.path.exists(log_path):
+        print('Generating {} blocks into {}'.format(args.blocks, log_path))
+        generate_structured_log(log_path, args.blocks)
+    return log_path
+
+
+def bench_scoring(args):
+    log_path = synthetic_log(args)
+    model = joblib.load(MODEL_PATH)
+    # The same stage timings the service exports on /metrics
+    timer = instrumentation.StageTimer()
+    instrumentation.add_listener(timer)
+
+    start = time.time()
+    _, _, data_df = dataloader.load_HDFS(log_path, label_file=None, window='session',
+                                         train_ratio=0, split_type='sequential')
+    load_time = time.time() - start
+    x_test = data_df['EventSequence'].values
+    extractor = preprocessing.FeatureExtractor()
+    extractor.inference_mode()
+
+    rows = []
+    cache = ScoringCache()
+    for label, run_cache in [('no cache', None), ('cold cache', cache), ('warm cache', cache)]:
+        start = time.time()
+        scores, _, _ = score_sessions(model, extractor, x_test, batch_size=args.batch_size, cache=run_cache)
+        score_time = time.time() - start
+        rows.append((label, score_time, len(scores) / score_time))
+
+    start = time.time()
+    scores, top_idx, top_values = score_sessions(model, extractor, x_test, batch_size=args.batch_size,
+                                                 top_k=args.top_k)
+    reasons = render_reasons(top_idx, top_values, extractor.events, num_instances=len(scores))
+    explain_time = time.time() - start
+    rows.append(('top-{} explanations'.format(args.top_k), explain_time, len(reasons) / explain_time))
+
+    num_blocks = len(x_test)
+    print('\n====== Scoring benchmark: {} blocks ======'.format(num_blocks))
+    print('load_HDFS: {:.2f}s ({:.0f} blocks/s)'.format(load_time, num_blocks / load_time))
+    for label, score_time, rate in rows:
+        print('score ({}): {:.2f}s ({:.0f} blocks/s)'.format(label, score_time, rate))
+    total = load_time + rows[0][1]
+    print('end-to-end without cache: {:.2f}s ({:.0f} blocks/s)\n'.format(total, num_blocks / total))
+    instrumentation.remove_listener(timer)
+    timer.report()
+
+
+def bench_workers(args):
+    log_path = synthetic_log(args)
+    model = joblib.load(MODEL_PATH)
+    extractor = preprocessing.FeatureExtractor()
+    extractor.inference_mode()
+
+    # Single-process baseline: the path taken by uploads below PARALLEL_MIN_BLOCKS
+    start = time.time()
+    data_df, _ = dataloader.load_HDFS_sessions(log_path)
+    base_scores, base_idx, _ = score_sessions(model, extractor, data_df['EventSequence'].values,
+                                              top_k=args.top_k)
+    base_time = time.time() - start
+    num_blocks = len(base_scores)
+
+    rows = []
+    for num_workers in [int(n) for n in args.workers.split(',')]:
+        scorer = ShardedScorer(MODEL_PATH, num_workers, shard_size=args.shard_size, top_k=args.top_k)
+        start = time.time()
+        block_ids, X_counts, _ = scorer.count_blocks(log_path)
+        count_time = time.time() - start
+        shards = list(scorer.score_shards(X_counts))
+        total_time = time.time() - start
+        scorer.close()
+        scores = np.concatenate([shard[1] for shard in shards])
+        top_idx = np.concatenate([shard[2] for shard in shards]) if base_idx is not None else None
+        identical = (block_ids == data_df['BlockId'].tolist() and np.array_equal(scores, base_scores)
+                     and (base_idx is None or np.array_equal(top_idx, base_idx)))
+        rows.append((num_workers, count_time, total_time - count_time, total_time, identical))
+
+    print('\n====== Worker scaling benchmark: {} blocks, {} CPUs ======'.format(num_blocks, os.cpu_count()))
+    print('single process: {:.2f}s ({:.0f} blocks/s)'.format(base_time, num_blocks / base_time))
+    for num_workers, count_time, score_time, total_time, identical in rows:
+        print('{} workers: parse {:.2f}s + score {:.2f}s = {:.2f}s ({:.0f} blocks/s, {:.2f}x), '
+              'identical to single process: {}'.format(num_workers, count_time, score_time, total_time,
+                                                       num_blocks / total_time, base_time / total_time,
+                                                       identical))
+
+
+def bench_scheduler(args):
+    # Mixed workload: one heavy user uploads large logs while others upload small ones.
+    # Jobs sleep for a time proportional to their cost instead of running the pipeline.
+    rng = np.random.RandomState(args.seed)
+    workload = []
+    for idx in range(args.jobs):
+        if rng.rand() < 0.1:
+            user_id, total_entries = 'heavy', rng.randint(1000000, 5000000)
+        else:
+            user_id, total_entries = 'user_{}'.format(rng.randint(10)), rng.randint(1000, 200000)
+        workload.append((user_id, total_entries, total_entries // 15))
+
+    def run_job(job, seconds):
+        time.sleep(seconds)
+
+    print('\n====== Scheduler benchmark: {} jobs, {} workers ======'.format(args.jobs, args.workers))
+    for label, scheduled in [('arrival order', False), ('sjf + fair share', True)]:
+        manager = JobManager(max_workers=args.workers, max_queue=args.jobs,
+                             aging_seconds=args.aging_seconds, max_wait_seconds=args.max_wait_seconds)
+        for idx, (user_id, total_entries, num_blocks) in enumerate(workload):
+            cost = estimate_cost(total_entries, num_blocks)
+            # Equal costs and one user reduce the scheduler to arrival order
+            manager.submit('job_{}'.format(idx), run_job, cost / args.cost_per_second,
+                           user_id=user_id if scheduled else None, cost=cost if scheduled else 1,
+                           total_blocks=num_blocks)
+            time.sleep(rng.exponential(args.interarrival))
+        manager.shutdown()
+        # Size classes of the arrival-order run follow the real costs
+        jobs = [manager.get('job_{}'.format(idx)) for idx in range(len(workload))]
+        for name in ('small', 'medium', 'large'):
+            waits = sorted(job.started_at - job.submitted_at for job, (user_id, total_entries, num_blocks)
+                           in zip(jobs, workload)
+                           if size_class(estimate_cost(total_entries, num_blocks)) == name)
+            if waits:
+                print('{} / {}: {} jobs, queue wait p50 {:.3f}s p99 {:.3f}s'.format(
+                    label, name, len(waits), np.percentile(waits, 50), np.percentile(waits, 99)))
+
+
+def bench_coalescing(args):
+    # Concurrent clients each score many small uploads, as during a batch ingest window
+    rng = np.random.RandomState(args.seed)
+    sequences = []
+    for idx in range(args.clients * args.requests * args.sessions):
+        sequence = list(NORMAL_SESSIONS[rng.randint(len(NORMAL_SESSIONS))])
+        if rng.rand() < 0.03:
+            sequence += ANOMALY_SUFFIXES[rng.randint(len(ANOMALY_SUFFIXES))]
+        sequences.append(sequence)
+    x_all = np.empty(len(sequences), dtype=object)
+    x_all[:] = sequences
+    model = joblib.load(MODEL_PATH)
+    extractor = preprocessing.FeatureExtractor()
+    extractor.inference_mode()
+
+    def client(idx, batcher, latencies):
+        for request in range(args.requests):
+            start = (idx * args.requests + request) * args.sessions
+            begin = time.time()
+            score_sessions(model, extractor, x_all[start:start + args.sessions], top_k=args.top_k,
+                           batcher=batcher)
+            latencies.append(time.time() - begin)
+
+    print('\n====== Coalescing benchmark: {} clients x {} requests of {} sessions ======'.format(
+        args.clients, args.requests, args.sessions))
+    for max_wait_ms in [None] + [float(wait) for wait in args.max_wait_ms.split(',')]:
+        batcher = None if max_wait_ms is None else BatchCoalescer(args.max_batch_rows, max_wait_ms)
+        latencies = []
+        threads = [threading.Thread(target=client, args=(idx, batcher, latencies))
+                   for idx in range(args.clients)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        label = 'no coalescing' if batcher is None else 'max wait {:g} ms'.format(max_wait_ms)
+        batches = '' if batcher is None else ', {:.1f} requests/model call'.format(
+            batcher.stats()['mean_requests_per_batch'])
+        print('{}: {:.0f} requests/s, latency p50 {:.2f} ms p99 {:.2f} ms{}'.format(
+            label, len(latencies) / elapsed, np.percentile(latencies, 50) * 1000,
+            np.percentile(latencies, 99) * 1000, batches))
+
+
+def start_stub_callback(port=0, fail_rate=0.0, delay=0.0, seed=0):
+    """Serve a Next.js callback stand-in that fails a fraction of requests; returns (server, received)"""
+    rng = random.Random(seed)
+    received = []
+    lock = threading.Lock()
+
+    class StubCallbackHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(delay)
+            with lock:
+                failed = rng.random() < fail_rate
+                if not failed:
+                    received.append((self.path, body))
+            self.send_response(503 if failed else 200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{"success": false}' if failed else b'{"success": true}')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubCallbackHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, received
+
+
+def stub_callback(args):
+    server, received = start_stub_callback(args.port, args.fail_rate, args.delay)
+    print('Stub callback listening on http://127.0.0.1:{} (fail rate {:.0%}, delay {}s)'.format(
+        server.server_port, args.fail_rate, args.delay))
+    try:
+        while True:
+            time.sleep(5)
+            print('{} callbacks received'.format(len(received)))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+def bench_outbox(args):
+    # Jobs post their batches into the outbox; it is closed halfway with a backlog and
+    # reopened, as if the service restarted, and must still deliver everything in order
+    server, received = start_stub_callback(fail_rate=args.fail_rate, delay=args.delay, seed=args.seed)
+    url = 'http://127.0.0.1:{}/api/analysis-callback-batch'.format(server.server_port)
+    path = os.path.join(tempfile.mkdtemp(dir=args.workdir), 'outbox.sqlite3')
+    print('\n====== Outbox benchmark: {} messages in {} streams, {:.0%} failed requests ======'.format(
+        args.messages, args.streams, args.fail_rate))
+
+    def outbox():
+        return CallbackOutbox(path, workers=args.workers, base_delay_seconds=args.base_delay,
+                              max_delay_seconds=args.base_delay * 16)
+
+    box = outbox()
+    start = time.time()
+    for idx in range(args.messages):
+        stream = 'job_{}'.format(idx % args.streams)
+        body = json.dumps({'stream': stream, 'seq': idx // args.streams}).encode('utf-8')
+        box.enqueue(stream, url, body, {'Content-Type': 'application/json'})
+        if idx == args.messages // 2:
+            first = box.stats()
+            box.close()
+            box = outbox()
+            print('restart: {} delivered before, {} replayed from disk'.format(first['delivered'], box.replayed))
+    box.wait_idle()
+    elapsed = time.time() - start
+    stats = box.stats()
+    box.close()
+    server.shutdown()
+
+    sequences = {}
+    for _, body in received:
+        message = json.loads(body)
+        sequences.setdefault(message['stream'], []).append(message['seq'])
+    unique = sum(len(set(seqs)) for seqs in sequences.values())
+    in_order = all(seqs == sorted(seqs) for seqs in sequences.values())
+    print('delivered {} unique of {} ({} requests incl. duplicates), per-stream order kept: {}'.format(
+        unique, args.messages, len(received), in_order))
+    print('{:.0f} messages/s, {} failed attempts, {} dead, backlog {}'.format(
+        args.messages / elapsed, first['failed_attempts'] + stats['failed_attempts'], stats['dead'],
+        stats['backlog']))
+    print('delivery latency after restart: p50 {}s p99 {}s'.format(
+        stats['delivery_latency_p50_seconds'], stats['delivery_latency_p99_seconds']))
+
+
+def synthetic_results(num_blocks, top_k=3, anomaly_ratio=0.03, seed=0):
+    """Result rows as iter_results builds them, for sessions drawn like generate_structured_log"""
+    # Every distinct session is scored once with the model, then sampled per block
+    patterns = [normal + suffix for normal in NORMAL_SESSIONS for suffix in [[]] + ANOMALY_SUFFIXES]
+    x_patterns = np.empty(len(patterns), dtype=object)
+    x_patterns[:] = patterns
+    extractor = preprocessing.FeatureExtractor()
+    extractor.inference_mode()
+    probs, top_idx, top_values = score_sessions(joblib.load(MODEL_PATH), extractor, x_patterns, top_k=top_k)
+    reasons = render_reasons(top_idx, top_values, extractor.events, HDFS_TEMPLATES, num_instances=len(probs))
+
+    rng = np.random.RandomState(seed)
+    suffix = np.where(rng.rand(num_blocks) < anomaly_ratio, rng.randint(1, len(ANOMALY_SUFFIXES) + 1, num_blocks), 0)
+    pattern = rng.randint(len(NORMAL_SESSIONS), size=num_blocks) * (len(ANOMALY_SUFFIXES) + 1) + suffix
+    block_ids = rng.randint(-2 ** 62, 2 ** 62, size=num_blocks)
+    return [{
+        'block_id': 'blk_{}'.format(block_id),
+        'anomaly_score': round(float(probs[idx]) * 100, 2),
+        'anomaly_probability': float(probs[idx]),
+        'reason': reasons[idx]
+    } for block_id, idx in zip(block_ids.tolist(), pattern.tolist())]
+
+
+def bench_formats(args):
+    # Completion payloads of growing uploads in every wire format the callbacks accept
+    print('\n====== Result format benchmark ======')
+    variants = [(FORMAT_JSON, False), (FORMAT_JSON, True), (FORMAT_NDJSON, False),
+                (FORMAT_MSGPACK, False), (FORMAT_MSGPACK, True)]
+    for num_blocks in [int(size) for size in args.sizes.split(',')]:
+        results = synthetic_results(num_blocks, args.top_k)
+        payload = {'upload_id': 'benchmark', 'analysis_complete': True, 'total_blocks_processed': num_blocks,
+                   'results': results}
+        print('--- {} blocks, {} distinct reasons ---'.format(
+            num_blocks, len({result['reason'] for result in results})))
+        for fmt, compress in variants:
+            start = time.time()
+            body, headers = encode_results(payload, fmt, compress)
+            encode_time = time.time() - start
+            start = time.time()
+            decoded = decode_results(body, headers)
+            decode_time = time.time() - start
+            assert decoded['results'] == results
+            print('{:<13} {:>9.2f} MB, encode {:6.3f}s, decode {:6.3f}s'.format(
+                fmt + (' + gzip' if compress else ''), len(body) / 1e6, encode_time, decode_time))
+            del body, decoded
+
+
+def bench_store(args):
+    # One job writes its results in delivery-sized chunks, then the dashboard pages through them
+    results = synthetic_results(args.blocks, args.top_k)
+    workdir = tempfile.mkdtemp(dir=args.workdir)
+    store = ResultStore(os.path.join(workdir, 'results.sqlite3'), export_dir=workdir)
+    print('\n====== Result store benchmark: {} blocks ======'.format(args.blocks))
+    start = time.time()
+    writer = store.writer('benchmark', 'analysis_benchmark.csv')
+    for begin in range(0, len(results), args.chunk_size):
+        writer.add(results[begin:begin + args.chunk_size])
+    writer.close()
+    elapsed = time.time() - start
+    print('write: {:.1f}s ({:.0f} blocks/s), {} MB database, {:.0f} MB CSV export'.format(
+        elapsed, args.blocks / elapsed, store.stats()['size_mb'],
+        os.path.getsize(store.export_path('analysis_benchmark.csv')) / 1e6))
+
+    def timed(label, **query):
+        latencies = []
+        for _ in range(args.repeat):
+            begin = time.time()
+            page = store.query('benchmark', **query)
+            latencies.append(time.time() - begin)
+        print('{:<32} {:8.2f} ms  ({} rows of {})'.format(label, np.median(latencies) * 1000,
+                                                         len(page['results']), page['total']))
+        return page
+
+    page = timed('first page of 100 by score', limit=100)
+    timed('next page by cursor', limit=100, cursor=page['next_cursor'])
+    deep = store.query('benchmark', limit=args.blocks // 2)
+    timed('page after {} rows'.format(args.blocks // 2), limit=100, cursor=deep['next_cursor'])
+    timed('top 100 with score >= 1', limit=100, min_score=1)
+    timed('block id lookup', block_id=results[len(results) // 3]['block_id'])
+    timed('first page by block id', limit=100, order='block')
+
+
+def bench_checkpoints(args):
+    # One job writes its results in delivery-sized chunks, without checkpoints and with a
+    # checkpoint after every chunk, the most often the service saves one
+    results = synthetic_results(args.blocks, args.top_k)
+    block_ids = [result['block_id'] for result in results]
+    print('\n====== Checkpoint benchmark: {} blocks in chunks of {} ======'.format(args.blocks, args.chunk_size))
+    for checkpointed in (False, True):
+        workdir = tempfile.mkdtemp(dir=args.workdir)
+        store = ResultStore(os.path.join(workdir, 'results.sqlite3'), export_dir=workdir)
+        checkpoints = CheckpointStore(os.path.join(workdir, 'checkpoints.sqlite3'))
+        start = time.time()
+        if checkpointed:
+            checkpoints.create('job_benchmark', 'benchmark', {'block_ids': block_ids})
+        created = time.time() - start
+        writer = store.writer('benchmark', 'analysis_benchmark.csv')
+        saves = []
+        for begin in range(0, len(results), args.chunk_size):
+            writer.add(results[begin:begin + args.chunk_size])
+            if checkpointed:
+                save_start = time.time()
+                checkpoints.save('job_benchmark', begin + args.chunk_size, begin // args.chunk_size + 1,
+                                 writer.export_bytes())
+                saves.append(time.time() - save_start)
+        writer.close()
+        elapsed = time.time() - start
+        if not checkpointed:
+            print('no checkpoints: {:.2f}s'.format(elapsed))
+            continue
+        print('checkpoint after every chunk: {:.2f}s; recording the job {:.3f}s, {} checkpoints of '
+              'p50 {:.3f} ms p99 {:.3f} ms'.format(elapsed, created, len(saves), np.percentile(saves, 50) * 1000,
+                                                  np.percentile(saves, 99) * 1000))
+        for interval in (1, 10):
+            print('every {}s: {:.4%} of the job time'.format(interval, np.mean(saves) / interval))
+        start = time.time()
+        resumed = {row['block_id']: row for row in store.rows('benchmark')}
+        print('reading back {} stored results to resume a job without streaming: {:.2f}s'.format(
+            len(resumed), time.time() - start))
+
+
+def _http_status(url):
+    try:
+        with urlopen(url, timeout=1) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+    except (URLError, ConnectionError, socket.timeout):
+        return None, None
+
+
+def bench_startup(args):
+    # Cold starts of the service: until it accepts connections, and until /ready answers 200
+    print('\n====== Startup benchmark: {} ======'.format(args.service))
+    listen_times, ready_times = [], []
+    for run in range(args.runs):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        env = dict(os.environ, FLASK_HOST='127.0.0.1', FLASK_PORT=str(port),
+                   ANALYSIS_RESULTS_DIR=tempfile.mkdtemp(dir=args.workdir))
+        start = time.time()
+        process = subprocess.Popen([sys.executable, os.path.join(script_dir, args.service)], cwd=script_dir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        listening = None
+        try:
+            while time.time() - start < args.timeout:
+                status, body = _http_status('http://127.0.0.1:{}/ready'.format(port))
+                if status is not None and listening is None:
+                    listening = time.time() - start
+                if status == 200:
+                    ready = time.time() - start
+                    listen_times.append(listening)
+                    ready_times.append(ready)
+                    print('run {}: listening after {:.2f}s, ready after {:.2f}s '
+                          '(model load {:.2f}s, warm-up {:.2f}s, {:.2f}s after process start)'.format(
+                              run + 1, listening, ready, body['load_seconds'], body['warmup_seconds'] or 0,
+                              body['time_to_ready_seconds']))
+                    break
+                if process.poll() is not None:
+                    print('run {}: service exited with code {}'.format(run + 1, process.returncode))
+                    break
+                time.sleep(0.02)
+            else:
+                print('run {}: not ready after {}s'.format(run + 1, args.timeout))
+        finally:
+            process.terminate()
+            process.wait()
+    if ready_times:
+        print('median: listening after {:.2f}s, ready after {:.2f}s'.format(np.median(listen_times),
+                                                                            np.median(ready_times)))
+
+def _process_memory(pid):
+    """Rss and Pss of a process in bytes; Pss splits each shared page among its sharers"""
+    memory = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            fields = line.split()
+            if fields[0] in ('Rss:', 'Pss:'):
+                memory[fields[0][:-1].lower()] = int(fields[1]) * 1024
+    return memory
+
+
+def _child_pids(pid):
+    with open('/proc/{0}/task/{0}/children'.format(pid)) as f:
+        return [int(child) for child in f.read().split()]
+
+
+def bench_serving(args):
+    # Throughput and memory of the pre-fork gunicorn deployment per worker count: jobs are
+    # submitted at once and timed until every completion callback arrived
+    log_path = synthetic_log(args)
+    block_ids = pd.read_csv(log_path, usecols=['Content'])['Content'].str.extract(r'(blk_-?\d+)')[0].unique().tolist()
+    server, received = start_stub_callback()
+    callback_url = 'http://127.0.0.1:{}/api/analysis-callback'.format(server.server_port)
+    print('\n====== Serving benchmark: {} jobs of {} blocks ======'.format(args.jobs, len(block_ids)))
+    for num_workers in [int(workers) for workers in args.workers.split(',')]:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        base_url = 'http://127.0.0.1:{}'.format(port)
+        env = dict(os.environ, FLASK_HOST='127.0.0.1', FLASK_PORT=str(port), GUNICORN_WORKERS=str(num_workers),
+                   WORKER_MAX_JOBS='0', PARALLEL_WORKERS='0', ANALYSIS_RESULTS_DIR=tempfile.mkdtemp(dir=args.workdir))
+        process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'flask-simulator:app'],
+                                   cwd=script_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            # Requests land on any worker, so poll until every worker has reported ready
+            ready_pids = set()
+            deadline = time.time() + args.timeout
+            while len(ready_pids) < num_workers and time.time() < deadline and process.poll() is None:
+                status, body = _http_status(base_url + '/health')
+                if status == 200 and body['model']['ready']:
+                    ready_pids.add(body['worker']['pid'])
+                time.sleep(0.05)
+            if len(ready_pids) < num_workers:
+                print('{} workers: not ready after {}s'.format(num_workers, args.timeout))
+                continue
+            del received[:]
+            start = time.time()
+            for job in range(args.jobs):
+                payload = {'upload_id': 'serving-{}-{}'.format(num_workers, job), 'block_ids': block_ids,
+                           'file_path': log_path, 'callback_url': callback_url}
+                request = Request(base_url + '/analyze', data=json.dumps(payload).encode('utf-8'),
+                                  headers={'Content-Type': 'application/json'})
+                with urlopen(request, timeout=30) as response:
+                    response.read()
+            completed = 0
+            deadline = time.time() + args.timeout
+            while time.time() < deadline:
+                completed = sum(1 for path, _ in list(received) if path.endswith('-complete'))
+                if completed >= args.jobs:
+                    break
+                time.sleep(0.05)
+            elapsed = time.time() - start
+            memory = [_process_memory(pid) for pid in _child_pids(process.pid)]
+            master = _process_memory(process.pid)
+            print('{} workers: {}/{} jobs in {:.2f}s, {:.2f} jobs/s, {:.0f} blocks/s; '
+                  'per worker Rss {:.0f} MB Pss {:.0f} MB, master Pss {:.0f} MB, total Pss {:.0f} MB'.format(
+                      num_workers, completed, args.jobs, elapsed, completed / elapsed,
+                      completed * len(block_ids) / elapsed, np.mean([m['rss'] for m in memory]) / 2 ** 20,
+                      np.mean([m['pss'] for m in memory]) / 2 ** 20, master['pss'] / 2 ** 20,
+                      (master['pss'] + sum(m['pss'] for m in memory)) / 2 ** 20))
+        finally:
+            process.terminate()
+            process.wait()
+    server.shutdown()
+
+
+def raw_log_lines(log_path):
+    """Render the lines of a synthetic structured log as raw HDFS log lines"""
+    struct_log = pd.read_csv(log_path, usecols=['Time', 'Content'])
+    return ('081109 ' + struct_log['Time'].astype(str).str.zfill(6) + ' 143 INFO dfs.DataNode$DataXceiver: '
+            + struct_log['Content'] + '\n').str.encode('utf-8').tolist()
+
+
+def bench_live(args):
+    log_path = synthetic_log(args)
+    lines = raw_log_lines(log_path)
+    deployed = DeployedModel('benchmark', MODEL_PATH, joblib.load(MODEL_PATH))
+    data_df, _ = dataloader.load_HDFS_sessions(log_path)
+    scores, _, _ = score_sessions(deployed.model, deployed.extractor, data_df['EventSequence'].values)
+    expected = set(data_df['BlockId'][scores >= args.threshold])
+    num_blocks = len(data_df)
+    print('\n====== Live detection benchmark: {} lines of {} blocks, {} anomalous in batch scoring ======'.format(
+        len(lines), num_blocks, len(expected)))
+
+    # Lines fed as fast as they can be parsed and scored, with every session open at once and
+    # with at most max_sessions open; closing is driven by the terminal events and eviction
+    for max_sessions in (num_blocks, args.max_sessions):
+        for measure_memory in (False, True):
+            alerted = set()
+            sessions = LiveSessions(max_sessions=max_sessions, idle_timeout=3600, terminal_grace=args.grace)
+            detector = LiveDetector(sessions, lambda: deployed,
+                                    lambda alerts: alerted.update(alert['block_id'] for alert in alerts),
+                                    threshold=args.threshold, tick_seconds=3600).start()
+            if measure_memory:
+                tracemalloc.start()
+            start = time.time()
+            for begin in range(0, len(lines), 1000):
+                detector.feed(lines[begin:begin + 1000])
+                detector.expire()
+            detector.stop()
+            elapsed = time.time() - start
+            if measure_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print('  peak traced memory: {:.1f} MB'.format(peak / 1024 ** 2))
+                continue
+            while detector.stats()['alerts_pending']:
+                time.sleep(0.01)
+            stats = detector.stats()
+            print('max {} open sessions: {:.2f}s ({:.0f} lines/s), at most {} open, closed {}'.format(
+                max_sessions, elapsed, len(lines) / elapsed, stats['max_open_sessions'], stats['closed_sessions']))
+            print('  {} alerts, {} of the batch anomalies, {} not anomalous in batch scoring'.format(
+                len(alerted), len(alerted & expected), len(alerted - expected)))
+
+    # Lines appended to a file at a fixed rate and followed like tail -F; latency is measured
+    # from writing a block's last line until its alert, and from the session closing until its score
+    workdir = tempfile.mkdtemp(dir=args.workdir)
+    live_path = os.path.join(workdir, 'hdfs_live.log')
+    open(live_path, 'wb').close()
+    last_written = dict()
+    alerts = []
+    sessions = LiveSessions(idle_timeout=args.idle_seconds, terminal_grace=args.grace)
+    detector = LiveDetector(sessions, lambda: deployed, alerts.extend, threshold=args.threshold).start()
+    tail = FileTail(live_path, detector.feed, poll_seconds=args.poll_seconds).start()
+    time.sleep(0.2)
+    burst = max(int(args.rate / 100), 1)
+    start = time.time()
+    with open(live_path, 'ab', buffering=0) as f:
+        for begin in range(0, len(lines), burst):
+            chunk = lines[begin:begin + burst]
+            f.write(b''.join(chunk))
+            now = time.time()
+            for line in chunk:
+                last_written[line.rsplit(b' ', 1)[1].strip().decode()] = now
+            delay = start + (begin + burst) / args.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    written = time.time() - start
+    deadline = time.time() + args.idle_seconds + 10
+    while len(sessions) and time.time() < deadline:
+        time.sleep(0.1)
+    time.sleep(0.2)
+    tail.stop()
+    stats = detector.stats()
+    print('followed file at {:.0f} lines/s: at most {} open sessions, closed {}, {} lines unmatched'.format(
+        len(lines) / written, stats['max_open_sessions'], stats['closed_sessions'], stats['unmatched_lines']))
+    print('  session due -> scored: p50 {:.1f} ms p99 {:.1f} ms'.format(
+        stats['score_latency_p50_seconds'] * 1000, stats['score_latency_p99_seconds'] * 1000))
+    for reason in sorted(set(alert['closed_by'] for alert in alerts)):
+        latencies = [alert['detected_at'] - last_written[alert['block_id']] for alert in alerts
+                     if alert['closed_by'] == reason]
+        print('  {} alerts closed by {}: last line written -> alert p50 {:.3f}s p99 {:.3f}s'.format(
+            len(latencies), reason, np.percentile(latencies, 50), np.percentile(latencies, 99)))
+    alerted = set(alert['block_id'] for alert in alerts)
+    print('  {} alerts, {} of the batch anomalies, {} not anomalous in batch scoring'.format(
+        len(alerted), len(alerted & expected), len(alerted - expected)))
+
+
+def bench_windows(args):
+    log_path = synthetic_log(args)
+    num_lines = sum(1 for _ in open(log_path, 'rb')) - 1
+    print('\n====== Sliding window benchmark: {} lines ======'.format(num_lines))
+    for spec in args.windows.split(','):
+        interval, step = [int(value) for value in spec.split(':')]
+        start = time.time()
+        with instrumentation.StageTimer() as timer:
+            X_counts, window_df, events = dataloader.load_HDFS_windows(log_path, interval, step)
+        elapsed = time.time() - start
+        window_seconds = timer.summary()['sliding_windows']['seconds']
+        tracemalloc.start()
+        dataloader.load_HDFS_windows(log_path, interval, step)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('{}s windows every {}s: {} windows, {} non-zero counts in {:.2f}s ({:.0f} lines/s), of which '
+              'windowing {:.2f}s; peak traced memory {:.0f} MB'.format(
+                  interval, step, X_counts.shape[0], X_counts.nnz, elapsed, num_lines / elapsed, window_seconds,
+                  peak / 1024 ** 2))
+
+        # The same windows from per-window lists of the lines in each window, after the same read
+        start = time.time()
+        struct_log = pd.read_csv(log_path, usecols=['Date', 'Time', 'EventId'], na_filter=False)
+        timestamps = dataloader._hdfs_timestamps(struct_log)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, event_ids = timestamps[order], struct_log['EventId'].to_numpy()[order].tolist()
+        columns = {event: idx for idx, event in enumerate(events)}
+        rows = []
+        for window_start in range(timestamps[0], timestamps[-1] + 1, step):
+            lines = [idx for idx in range(np.searchsorted(timestamps, window_start),
+                                          np.searchsorted(timestamps, window_start + interval))]
+            row = np.zeros(len(events))
+            for idx in lines:
+                row[columns[event_ids[idx]]] += 1
+            rows.append(row)
+        baseline = time.time() - start
+        same = np.array_equal(np.array(rows), X_counts.toarray())
+        print('  per-window lists: {:.2f}s ({:.1f}x the time), same counts: {}'.format(
+            baseline, baseline / elapsed, same))
+
+
+def synthetic_sessions(num_sessions, anomaly_ratio=0.03, seed=0):
+    """Block sessions in lifecycle order, without the interleaving of a log; anomalous
+    sessions get an exception inserted at a random position"""
+    rng = np.random.RandomState(seed)
+    x_seq = np.empty(num_sessions, dtype=object)
+    y = np.zeros(num_sessions, dtype=int)
+    for i in range(num_sessions):
+        sequence = list(NORMAL_SESSIONS[rng.randint(len(NORMAL_SESSIONS))])
+        if rng.rand() < anomaly_ratio:
+            position = rng.randint(len(sequence))
+            sequence[position:position] = ANOMALY_SUFFIXES[rng.randint(len(ANOMALY_SUFFIXES))]
+            y[i] = 1
+        x_seq[i] = sequence
+    return x_seq, y
+
+
+def bench_ngram(args):
+    x_seq, y = synthetic_sessions(args.sessions)
+    num_train = len(x_seq) // 2
+    start = time.time()
+    x_train, next_train, y_train = dataloader.slice_hdfs(x_seq[:num_train], y[:num_train], args.window_size)
+    x_test, next_test, y_test = dataloader.slice_hdfs(x_seq[num_train:], y[num_train:], args.window_size)
+    slice_time = time.time() - start
+    normal = y_train.to_numpy() == 0
+
+    model = NGram(history=args.history, top_g=args.top_g)
+    start = time.time()
+    model.fit(x_train[normal], next_train[normal])
+    fit_time = time.time() - start
+    start = time.time()
+    model.predict(x_test, next_test)
+    predict_time = time.time() - start
+    num_windows = len(next_test)
+    print('\n====== n-gram benchmark: {} sessions, windows of {} ======'.format(args.sessions, args.window_size))
+    print('slice_hdfs: {:.2f}s for {} windows'.format(slice_time, normal.size + num_windows))
+    print('fit: {:.2f}s ({:.0f} windows/s)'.format(fit_time, normal.sum() / fit_time))
+    print('predict: {:.2f}s ({:.0f} windows/s, {:.1f}M windows/min)'.format(
+        predict_time, num_windows / predict_time, num_windows / predict_time * 60 / 1e6))
+    model.evaluate(x_test, next_test, y_test)
+
+
+def trace_report(args):
+    # Latency breakdown of the uploads traced by a running service
+    for trace in latency_breakdown(read_spans(args.file, args.upload_id)):
+        print('\n====== Upload {} ({}): {:.3f}s, {} spans ======'.format(
+            trace['upload_id'], trace['job_id'] or 'no job', trace['seconds'], trace['spans']))
+        print('{:<30} {:>6} {:>10} {:>10} {:>12}'.format('stage', 'calls', 'seconds', 'self', 'items'))
+        for stage, totals in sorted(trace['stages'].items(), key=lambda item: -item[1]['self_seconds']):
+            print('{:<30} {:>6} {:>10.3f} {:>10.3f} {:>12}'.format(
+                stage, totals['calls'], totals['seconds'], totals['self_seconds'], totals['items']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workdir', default='/tmp', help='directory for generated logs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scoring = subparsers.add_parser('scoring', help='load, transform and score one upload')
+    scoring.add_argument('--blocks', type=int, default=100000)
+    scoring.add_argument('--batch-size', type=int, default=10000)
+    scoring.add_argument('--top-k', type=int, default=3)
+    scoring.set_defaults(func=bench_scoring)
+
+    workers = subparsers.add_parser('workers', help='scale sharded parsing and scoring across processes')
+    workers.add_argument('--blocks', type=int, default=200000)
+    workers.add_argument('--workers', default='1,2,4', help='comma-separated worker counts')
+    workers.add_argument('--shard-size', type=int, default=20000)
+    workers.add_argument('--top-k', type=int, default=3)
+    workers.set_defaults(func=bench_workers)
+
+    scheduler = subparsers.add_parser('scheduler', help='queue waits per size class with and without scheduling')
+    scheduler.add_argument('--jobs', type=int, default=200)
+    scheduler.add_argument('--workers', type=int, default=2)
+    scheduler.add_argument('--interarrival', type=float, default=0.02, help='mean seconds between submissions')
+    scheduler.add_argument('--cost-per-second', type=float, default=1.2e7, help='simulated job cost processed per second')
+    scheduler.add_argument('--aging-seconds', type=float, default=0.5, help='scaled down with the simulated job times')
+    scheduler.add_argument('--max-wait-seconds', type=float, default=5.0)
+    scheduler.add_argument('--seed', type=int, default=0)
+    scheduler.set_defaults(func=bench_scheduler)
+
+    coalescing = subparsers.add_parser('coalescing', help='concurrent small requests with and without micro-batching')
+    coalescing.add_argument('--clients', type=int, default=16)
+    coalescing.add_argument('--requests', type=int, default=200, help='requests per client')
+    coalescing.add_argument('--sessions', type=int, default=20, help='sessions per request')
+    coalescing.add_argument('--max-wait-ms', default='1,2,5', help='comma-separated max waits')
+    coalescing.add_argument('--max-batch-rows', type=int, default=4096)
+    coalescing.add_argument('--top-k', type=int, default=3)
+    coalescing.add_argument('--seed', type=int, default=0)
+    coalescing.set_defaults(func=bench_coalescing)
+
+    outbox = subparsers.add_parser('outbox', help='callback delivery with failures and a restart in between')
+    outbox.add_argument('--messages', type=int, default=2000)
+    outbox.add_argument('--streams', type=int, default=20, help='concurrent jobs posting callbacks')
+    outbox.add_argument('--workers', type=int, default=2)
+    outbox.add_argument('--fail-rate', type=float, default=0.2)
+    outbox.add_argument('--delay', type=float, default=0.0, help='seconds the stub takes per request')
+    outbox.add_argument('--base-delay', type=float, default=0.05, help='first retry backoff in seconds')
+    outbox.add_argument('--seed', type=int, default=0)
+    outbox.set_defaults(func=bench_outbox)
+
+    formats = subparsers.add_parser('formats', help='size and encode/decode time of the result formats')
+    formats.add_argument('--sizes', default='10000,100000,1000000', help='comma-separated block counts')
+    formats.add_argument('--top-k', type=int, default=3)
+    formats.set_defaults(func=bench_formats)
+
+    store = subparsers.add_parser('store', help='write and page through the results of one large upload')
+    store.add_argument('--blocks', type=int, default=1000000)
+    store.add_argument('--chunk-size', type=int, default=1000, help='results per write, as delivered')
+    store.add_argument('--repeat', type=int, default=5)
+    store.add_argument('--top-k', type=int, default=3)
+    store.set_defaults(func=bench_store)
+
+    checkpoints = subparsers.add_parser('checkpoints', help='cost of saving job progress while results are written')
+    checkpoints.add_argument('--blocks', type=int, default=1000000)
+    checkpoints.add_argument('--chunk-size', type=int, default=1000, help='results per write, as delivered')
+    checkpoints.add_argument('--top-k', type=int, default=3)
+    checkpoints.set_defaults(func=bench_checkpoints)
+
+    stub = subparsers.add_parser('stub-callback', help='serve a flaky Next.js callback stand-in')
+    stub.add_argument('--port', type=int, default=3001)
+    stub.add_argument('--fail-rate', type=float, default=0.2)
+    stub.add_argument('--delay', type=float, default=0.0, help='seconds per request')
+    stub.set_defaults(func=stub_callback)
+
+    startup = subparsers.add_parser('startup', help='time until a service listens and until /ready succeeds')
+    startup.add_argument('--service', default='flask-simulator.py', help='flask-simulator.py or asgi-simulator.py')
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--timeout', type=float, default=120.0, help='seconds to wait for /ready per run')
+    startup.set_defaults(func=bench_startup)
+
+    serving = subparsers.add_parser('serving', help='job throughput and memory of gunicorn per worker count')
+    serving.add_argument('--workers', default='1,2,4', help='comma-separated gunicorn worker counts')
+    serving.add_argument('--jobs', type=int, default=16, help='jobs submitted at once per worker count')
+    serving.add_argument('--blocks', type=int, default=20000, help='blocks per job')
+    serving.add_argument('--timeout', type=float, default=300.0, help='seconds to wait for readiness and for the jobs')
+    serving.set_defaults(func=bench_serving)
+
+    live = subparsers.add_parser('live', help='alert latency and memory of live detection on a growing log')
+    live.add_argument('--blocks', type=int, default=10000)
+    live.add_argument('--rate', type=float, default=20000, help='lines per second appended to the followed file')
+    live.add_argument('--max-sessions', type=int, default=1000, help='open session limit of the bounded run')
+    live.add_argument('--idle-seconds', type=float, default=2.0, help='idle timeout of the followed file')
+    live.add_argument('--grace', type=float, default=0.5, help='seconds a session stays open after a terminal event')
+    live.add_argument('--poll-seconds', type=float, default=0.05, help='poll interval of the followed file')
+    # The bundled model scores one of the synthetic normal lifecycles at 0.47, so this alerts on a share of them
+    live.add_argument('--threshold', type=float, default=0.4, help='alert threshold')
+    live.set_defaults(func=bench_live)
+
+    windows = subparsers.add_parser('windows', help='sliding window event counts of a large log')
+    windows.add_argument('--blocks', type=int, default=100000)
+    windows.add_argument('--windows', default='60:60,300:10', help='comma-separated interval:step pairs in seconds')
+    windows.set_defaults(func=bench_windows)
+
+    ngram = subparsers.add_parser('ngram', help='fit and score the n-gram next-event model on sliced sessions')
+    ngram.add_argument('--sessions', type=int, default=200000)
+    ngram.add_argument('--window-size', type=int, default=10)
+    ngram.add_argument('--history', type=int, default=5, help='preceding events the next event is predicted from')
+    ngram.add_argument('--top-g', type=int, default=3, help='candidate next events accepted per context')
+    ngram.set_defaults(func=bench_ngram)
+
+    traces = subparsers.add_parser('traces', help='latency breakdown per upload from a service trace file')
+    traces.add_argument('file', help='the TRACE_PATH of the service')
+    traces.add_argument('--upload-id', help='only the traces of this upload')
+    traces.set_defaults(func=trace_report)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
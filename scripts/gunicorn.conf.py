@@ -0,0 +1,45 @@
+"""
+Gunicorn configuration for pre-fork serving of the Flask analysis service
+    gunicorn -c gunicorn.conf.py flask-simulator:app
+
+The master loads the model once and forks GUNICORN_WORKERS worker processes sharing it
+copy-on-write, so scoring is no longer limited to one core by the GIL. The service itself
+(job threads, outbox, result store) is imported in each worker after the fork. A worker
+is replaced after WORKER_MAX_JOBS jobs; it finishes its jobs before it exits.
+"""
+
+import multiprocessing
+import os
+import sys
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from analysis_service import prefork
+
+load_dotenv()
+
+bind = f"{os.getenv('FLASK_HOST', '0.0.0.0')}:{os.getenv('FLASK_PORT', 5555)}"
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+# Requests only queue jobs or read state, so a few threads per worker are plenty
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# The app starts threads when it is imported, and threads do not survive a fork
+preload_app = False
+# A recycled or stopped worker gets this long to finish its queued and running jobs
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 300))
+WORKER_MAX_JOBS = int(os.getenv('WORKER_MAX_JOBS', 500))
+WORKER_MAX_JOBS_JITTER = int(os.getenv('WORKER_MAX_JOBS_JITTER', 50))
+
+
+def on_starting(server):
+    prefork.preload_model()
+
+
+def post_fork(server, worker):
+    # The heartbeat file is closed before worker_exit runs, so drain() notifies through a copy
+    prefork.worker_started(os.dup(worker.tmp.fileno()), WORKER_MAX_JOBS, WORKER_MAX_JOBS_JITTER)
+
+
+def worker_exit(server, worker):
+    prefork.drain(graceful_timeout)
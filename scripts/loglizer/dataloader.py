@@ -9,10 +9,13 @@ Authors:
 
 import pandas as pd
 import os
+import io
+import csv
 import numpy as np
 import re
-from sklearn.utils import shuffle
-from collections import OrderedDict
+from scipy import sparse
+
+from . import instrumentation
 
 def _split_data(x_data, y_data=None, train_ratio=0, split_type='uniform'):
     if split_type == 'uniform' and y_data is not None:
@@ -37,21 +40,243 @@ def _split_data(x_data, y_data=None, train_ratio=0, split_type='uniform'):
         else:
             y_train = y_data[0:num_train]
             y_test = y_data[num_train:]
-    # Random shuffle
+    # Random shuffle; sklearn is imported here since only training needs it, and importing
+    # it takes longer than the rest of the module
+    from sklearn.utils import shuffle
     indexes = shuffle(np.arange(x_train.shape[0]))
     x_train = x_train[indexes]
     if y_train is not None:
         y_train = y_train[indexes]
     return (x_train, y_train), (x_test, y_test)
 
-def load_HDFS(log_file, label_file=None, window='session', train_ratio=0.5, split_type='sequential', save_csv=False, window_size=0):
+_HDFS_COLUMNS = ('Content', 'EventId', 'EventTemplate')
+
+def _block_event_pairs(struct_log):
+    """ Extract the (BlockId, EventId) pair of every block mention of a structured HDFS log
+
+    Arguments
+    ---------
+        struct_log: DataFrame, the structured log with `Content` and `EventId` columns
+
+    Returns
+    -------
+        pairs: DataFrame with `BlockId` and `EventId` columns in log order
+    """
+    block_ids = struct_log['Content'].str.findall(r'(blk_-?\d+)')
+    pairs = pd.DataFrame({'BlockId': block_ids, 'EventId': struct_log['EventId']}).explode('BlockId')
+    pairs = pairs[pairs['BlockId'].notna()].reset_index()
+    # A line mentioning the same block twice counts once for that block
+    pairs = pairs.drop_duplicates(['index', 'BlockId'])
+    return pairs[['BlockId', 'EventId']]
+
+def _group_sessions(struct_log):
+    """ Group the events of a structured HDFS log into one sequence per block id
+
+    Arguments
+    ---------
+        struct_log: DataFrame, the structured log with `Content` and `EventId` columns
+
+    Returns
+    -------
+        data_df: DataFrame with `BlockId` and `EventSequence` columns, blocks in order of
+            first appearance and events in log order
+    """
+    pairs = _block_event_pairs(struct_log)
+    # Stable sort by block keeps log order within a block; much faster than groupby().agg(list)
+    block_codes, blocks = pd.factorize(pairs['BlockId'])
+    order = np.argsort(block_codes, kind='stable')
+    bounds = np.cumsum(np.bincount(block_codes, minlength=len(blocks)))[:-1]
+    sequences = np.empty(len(blocks), dtype=object)
+    if len(blocks) > 0:
+        for idx, events in enumerate(np.split(pairs['EventId'].to_numpy(dtype=object)[order], bounds)):
+            sequences[idx] = events.tolist()
+    return pd.DataFrame({'BlockId': np.asarray(blocks), 'EventSequence': sequences})
+
+def _templates(struct_log):
+    if 'EventTemplate' not in struct_log.columns:
+        return dict()
+    event_templates = struct_log[['EventId', 'EventTemplate']].drop_duplicates('EventId')
+    return dict(zip(event_templates['EventId'], event_templates['EventTemplate']))
+
+def split_log_file(log_file, num_parts):
+    """ Split a structured log with a header line into byte ranges of whole lines
+
+    Arguments
+    ---------
+        log_file: str, the file path of structured log.
+        num_parts: int, the number of ranges to aim for; small files may yield fewer.
+
+    Returns
+    -------
+        ranges: list of (start, end) byte offsets in file order. Every line after the
+            header starts in exactly one range.
+    """
+    size = os.path.getsize(log_file)
+    with open(log_file, 'rb') as f:
+        f.readline()
+        offsets = [f.tell()]
+        for part in range(1, num_parts):
+            position = max(offsets[-1], offsets[0] + (size - offsets[0]) * part // num_parts)
+            # Move to the start of the next line
+            f.seek(max(position - 1, 0))
+            f.readline()
+            offsets.append(min(f.tell(), size))
+        offsets.append(size)
+    return [(start, end) for start, end in zip(offsets[:-1], offsets[1:]) if end > start]
+
+def load_HDFS_pairs(log_file, start=0, end=None):
+    """ Load the block-event pairs of the lines of an HDFS structured log within a byte range
+
+    Arguments
+    ---------
+        log_file: str, the file path of structured log.
+        start, end: int, a byte range from `split_log_file`; by default the whole file.
+
+    Returns
+    -------
+        pairs: DataFrame with `BlockId` and `EventId` columns in log order
+        templates: dict, EventId -> EventTemplate of the range
+    """
+    with instrumentation.timed('load_HDFS') as stage:
+        with open(log_file, 'rb') as f:
+            header = f.readline()
+            start = max(start, f.tell())
+            f.seek(start)
+            data = f.read(-1 if end is None else max(end - start, 0))
+        columns = next(csv.reader([header.decode('utf-8')]))
+        struct_log = pd.read_csv(io.BytesIO(data), engine='c', header=None, names=columns,
+                usecols=lambda col: col in _HDFS_COLUMNS, na_filter=False)
+        stage.items = len(struct_log)
+        stage.attributes['bytes'] = len(data)
+        return _block_event_pairs(struct_log), _templates(struct_log)
+
+def load_HDFS_sessions(log_file):
+    """ Load the block sessions and event templates of an HDFS structured log
+
+    Arguments
+    ---------
+        log_file: str, the file path of structured log.
+
+    Returns
+    -------
+        data_df: DataFrame with `BlockId` and `EventSequence` columns
+        templates: dict, EventId -> EventTemplate, empty if the log has no template column
+    """
+    with instrumentation.timed('load_HDFS', bytes=os.path.getsize(log_file)) as stage:
+        struct_log = pd.read_csv(log_file, engine='c', usecols=lambda col: col in _HDFS_COLUMNS,
+                na_filter=False, memory_map=True)
+        stage.items = len(struct_log)
+        return _group_sessions(struct_log), _templates(struct_log)
+
+def _hdfs_timestamps(struct_log):
+    """ Seconds since the epoch of every line of a structured HDFS log, from its `Date`
+    (YYMMDD) and `Time` (HHMMSS) columns """
+    date = struct_log['Date'].to_numpy(dtype=np.int64)
+    time = struct_log['Time'].to_numpy(dtype=np.int64)
+    # Logs span few days, so only the distinct dates go through pandas
+    days, date_codes = np.unique(date, return_inverse=True)
+    day_seconds = pd.to_datetime(pd.DataFrame({'year': 2000 + days // 10000, 'month': days // 100 % 100,
+                                               'day': days % 100})).to_numpy().astype('datetime64[s]').astype(np.int64)
+    return day_seconds[date_codes] + time // 10000 * 3600 + time // 100 % 100 * 60 + time % 100
+
+def _line_labels(struct_log, label_file):
+    """ Whether each line of a structured HDFS log mentions a block labelled `Anomaly` """
+    label_data = pd.read_csv(label_file, engine='c', na_filter=False, memory_map=True)
+    anomalous = set(label_data['BlockId'][label_data['Label'] == 'Anomaly'])
+    block_ids = struct_log['Content'].str.findall(r'(blk_-?\d+)').explode()
+    line_anomalous = block_ids.isin(anomalous)
+    return line_anomalous.groupby(level=0).any().reindex(struct_log.index, fill_value=False).to_numpy()
+
+def load_HDFS_windows(log_file, time_interval=60, stepping_size=60, label_file=None, events=None):
+    """ Count the events of an HDFS structured log in sliding time windows
+
+    Windows start every `stepping_size` seconds from the first line and span
+    `time_interval` seconds, so they overlap when the interval is longer than the step.
+    Lines are sorted by time once; every (second, event) count is then added to the rows
+    of the windows covering that second, and the window boundaries are found by binary
+    search, so no per-window lists are built.
+
+    Arguments
+    ---------
+        log_file: str, the file path of structured log, with `Date` and `Time` columns.
+        time_interval: int, the length of a window in seconds.
+        stepping_size: int, the seconds between the starts of consecutive windows.
+        label_file: str, the file path of block anomaly labels; a window is anomalous when
+            one of its lines mentions an anomalous block. None for unlabeled data.
+        events: list, the event vocabulary of the columns; by default the events of the
+            log in natural order (E2 before E10). Other events are not counted.
+
+    Returns
+    -------
+        X_counts: scipy.sparse.csr_matrix, the event count matrix of shape
+            num_windows-by-num_events
+        window_df: DataFrame with `StartTime`, `EndTime` and `NumLines` columns, and
+            `Label` when label_file is given
+        events: list, the event of each column of X_counts
+    """
+    assert time_interval > 0 and stepping_size > 0, "time_interval and stepping_size must be positive."
+    columns = ('Date', 'Time', 'EventId') + (('Content',) if label_file else ())
+    with instrumentation.timed('load_HDFS', bytes=os.path.getsize(log_file)) as stage:
+        struct_log = pd.read_csv(log_file, engine='c', usecols=lambda col: col in columns, na_filter=False,
+                                 memory_map=True, dtype={'EventId': 'category'})
+        stage.items = len(struct_log)
+    with instrumentation.timed('sliding_windows', len(struct_log)) as stage:
+        timestamps = _hdfs_timestamps(struct_log)
+        line_labels = _line_labels(struct_log, label_file) if label_file else None
+        if len(timestamps) > 1 and np.any(np.diff(timestamps) < 0):
+            order = np.argsort(timestamps, kind='stable')
+            timestamps = timestamps[order]
+            event_ids = struct_log['EventId'].take(order)
+            line_labels = line_labels[order] if label_file else None
+        else:
+            event_ids = struct_log['EventId']
+        if events is None:
+            events = sorted(event_ids.cat.categories, key=lambda event: [int(part) if part.isdigit() else part
+                                                                          for part in re.split(r'(\d+)', event)])
+        events = list(events)
+        codes = pd.Index(events).get_indexer(event_ids.cat.categories)[event_ids.cat.codes.to_numpy()]
+
+        first = timestamps[0] if len(timestamps) else 0
+        seconds = timestamps - first
+        num_windows = int(seconds[-1] // stepping_size) + 1 if len(seconds) else 0
+        # Lines of the same second and event fall in the same windows, so they are counted once
+        known = codes >= 0
+        keys, counts = np.unique(seconds[known] * len(events) + codes[known], return_counts=True)
+        pair_seconds, pair_codes = keys // len(events), keys % len(events)
+        # Window k covers [k * stepping_size, k * stepping_size + time_interval)
+        first_window = np.maximum((pair_seconds - time_interval) // stepping_size + 1, 0)
+        last_window = np.minimum(pair_seconds // stepping_size, num_windows - 1)
+        spans = np.maximum(last_window - first_window + 1, 0)
+        offsets = np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans)
+        X_counts = sparse.csr_matrix((np.repeat(counts, spans).astype(float),
+                                      (np.repeat(first_window, spans) + offsets, np.repeat(pair_codes, spans))),
+                                     shape=(num_windows, len(events)))
+
+        starts = first + np.arange(num_windows, dtype=np.int64) * stepping_size
+        lower = np.searchsorted(timestamps, starts, side='left')
+        upper = np.searchsorted(timestamps, starts + time_interval, side='left')
+        window_df = pd.DataFrame({'StartTime': pd.to_datetime(starts, unit='s'),
+                                  'EndTime': pd.to_datetime(starts + time_interval, unit='s'),
+                                  'NumLines': upper - lower})
+        if label_file:
+            anomalies = np.concatenate([[0], np.cumsum(line_labels)])
+            window_df['Label'] = (anomalies[upper] - anomalies[lower] > 0).astype(int)
+        stage.attributes['windows'] = num_windows
+    return X_counts, window_df, events
+
+def load_HDFS(log_file, label_file=None, window='session', train_ratio=0.5, split_type='sequential', save_csv=False, window_size=0,
+              time_interval=60, stepping_size=60):
     """ Load HDFS structured log into train and test data
 
     Arguments
     ---------
         log_file: str, the file path of structured log.
         label_file: str, the file path of anomaly labels, None for unlabeled data
-        window: str, the window options including `session` (default).
+        window: str, the window options including `session` (default) and `sliding`. Sliding
+            windows count the events of all blocks in time windows, see `load_HDFS_windows`;
+            their x data are sparse event count matrices instead of event sequences.
+        time_interval: int, the length of a sliding window in seconds.
+        stepping_size: int, the seconds between the starts of sliding windows.
         train_ratio: float, the ratio of training data for train/test split.
         split_type: `uniform` or `sequential`, which determines how to split dataset. `uniform` means
             to split positive samples and negative samples equally when setting label_file. `sequential`
@@ -73,20 +298,29 @@ def load_HDFS(log_file, label_file=None, window='session', train_ratio=0.5, spli
         y_data = data['y_data']
         (x_train, y_train), (x_test, y_test) = _split_data(x_data, y_data, train_ratio, split_type)
 
-    elif log_file.endswith('.csv'):
-        assert window == 'session', "Only window=session is supported for HDFS dataset."
+    elif log_file.endswith(('.csv', '.log')) and window == 'sliding':
         print("Loading", log_file)
-        struct_log = pd.read_csv(log_file, engine='c',
-                na_filter=False, memory_map=True)
-        data_dict = OrderedDict()
-        for idx, row in struct_log.iterrows():
-            blkId_list = re.findall(r'(blk_-?\d+)', row['Content'])
-            blkId_set = set(blkId_list)
-            for blk_Id in blkId_set:
-                if not blk_Id in data_dict:
-                    data_dict[blk_Id] = []
-                data_dict[blk_Id].append(row['EventId'])
-        data_df = pd.DataFrame(list(data_dict.items()), columns=['BlockId', 'EventSequence'])
+        X_counts, window_df, events = load_HDFS_windows(log_file, time_interval, stepping_size, label_file)
+        window_df.attrs['events'] = events
+        print('{} sliding windows of {}s every {}s, {} events'.format(X_counts.shape[0], time_interval,
+                                                                      stepping_size, len(events)))
+        if save_csv:
+            window_df.to_csv('data_instances.csv', index=False)
+        # Windows follow each other in time, so they are split sequentially and not shuffled
+        num_train = int(train_ratio * X_counts.shape[0])
+        x_train, x_test = X_counts[:num_train], X_counts[num_train:]
+        if label_file is None:
+            print('Total: {} instances, train: {} instances, test: {} instances'.format(
+                  X_counts.shape[0], x_train.shape[0], x_test.shape[0]))
+            return (x_train, None), (x_test, None), window_df
+        y_data = window_df['Label'].to_numpy()
+        y_train, y_test = y_data[:num_train], y_data[num_train:]
+
+    elif log_file.endswith(('.csv', '.log')):
+        # Uploaded structured logs keep their .log extension
+        assert window == 'session', "Only window=session and window=sliding are supported for HDFS dataset."
+        print("Loading", log_file)
+        data_df, _ = load_HDFS_sessions(log_file)
         
         if label_file:
             # Split training and validation set in a class-uniform way
@@ -124,7 +358,7 @@ def load_HDFS(log_file, label_file=None, window='session', train_ratio=0.5, spli
                   x_data.shape[0], x_train.shape[0], x_test.shape[0]))
             return (x_train, None), (x_test, None), data_df
     else:
-        raise NotImplementedError('load_HDFS() only support csv and npz files!')
+        raise NotImplementedError('load_HDFS() only support csv (structured .log) and npz files!')
 
     num_train = x_train.shape[0]
     num_test = x_test.shape[0]
@@ -0,0 +1,237 @@
+"""
+The on-disk feature store for transformed event count matrices.
+
+A store is a directory holding the matrix rows (dense via `np.memmap`, or sparse
+as CSR triplets), the labels and the event vocabulary. Rows are appended chunk
+by chunk and read back in row-chunks through memory maps, so several training
+processes can share one store through the page cache without copying it.
+
+`PCA` accumulates its covariance from the store in row-chunks. `LR`, `SVM`,
+`DecisionTree` and `IsolationForest` are fit on the memory-mapped matrix as a
+whole; scikit-learn copies it when it needs another dtype or layout. Every one of
+these models predicts a store chunk by chunk. `InvariantsMiner` and `LogClustering`
+take in-memory matrices only.
+
+Layout
+------
+    meta.json: format, dtype, shape, number of non-zeros and labelling state
+    events.json: the event vocabulary (`FeatureExtractor.events`)
+    X.bin: dense rows in C order (format=`dense`)
+    data.bin, indices.bin, indptr.bin: CSR triplets (format=`csr`)
+    y.bin: int8 labels, only when rows were appended with labels
+
+"""
+
+import os
+import json
+import numpy as np
+from scipy import sparse
+
+_INDEX_DTYPE = np.int64
+_LABEL_DTYPE = np.int8
+
+
+class FeatureStore(object):
+
+    def __init__(self, path):
+        """ Open an existing feature store
+
+        Arguments
+        ---------
+            path: str, the directory of the store created by `FeatureStore.create`.
+
+        Attributes
+        ----------
+            format: str, `dense` or `csr`
+            dtype: numpy dtype of the stored values
+            num_rows: int, the number of appended rows
+            num_events: int, the number of columns
+            nnz: int, the number of stored values (equals num_rows * num_events when dense)
+            labeled: bool, whether labels were appended along with the rows
+            events: list, the event vocabulary of the stored columns
+        """
+        self.path = path
+        assert os.path.isfile(self._file('meta.json')), 'No feature store found in {}'.format(path)
+        with open(self._file('meta.json')) as f:
+            meta = json.load(f)
+        with open(self._file('events.json')) as f:
+            self.events = json.load(f)
+        self.format = meta['format']
+        self.dtype = np.dtype(meta['dtype'])
+        self.num_rows = meta['num_rows']
+        self.num_events = meta['num_events']
+        self.nnz = meta['nnz']
+        self.labeled = meta['labeled']
+
+    @classmethod
+    def create(cls, path, events, num_events=None, format='dense', dtype='float32', overwrite=False):
+        """ Create an empty feature store
+
+        Arguments
+        ---------
+            path: str, the directory of the store
+            events: list, the event vocabulary, e.g. `FeatureExtractor.events`
+            num_events: int, the number of columns. Defaults to len(events); pass
+                len(events) + 1 for matrices transformed with oov=True.
+            format: `dense` (np.memmap rows) or `csr` (sparse triplets)
+            dtype: str, the dtype of stored values. float32 halves the footprint of
+                the float64 matrices produced by `FeatureExtractor`.
+            overwrite: bool, whether to replace an existing store at path
+
+        Returns
+        -------
+            store: FeatureStore, the opened empty store
+        """
+        assert format in ('dense', 'csr'), 'format must be `dense` or `csr`.'
+        if os.path.exists(os.path.join(path, 'meta.json')) and not overwrite:
+            raise IOError('Feature store {} already exists.'.format(path))
+        os.makedirs(path, exist_ok=True)
+        events = [str(event) for event in events]
+        if num_events is None:
+            num_events = len(events)
+        names = ['X.bin'] if format == 'dense' else ['data.bin', 'indices.bin', 'indptr.bin']
+        for name in names + ['y.bin']:
+            open(os.path.join(path, name), 'wb').close()
+        if format == 'csr':
+            with open(os.path.join(path, 'indptr.bin'), 'wb') as f:
+                f.write(np.zeros(1, dtype=_INDEX_DTYPE).tobytes())
+        with open(os.path.join(path, 'events.json'), 'w') as f:
+            json.dump(events, f)
+        meta = {'format': format, 'dtype': np.dtype(dtype).name, 'num_rows': 0,
+                'num_events': int(num_events), 'nnz': 0, 'labeled': None}
+        _write_json(os.path.join(path, 'meta.json'), meta)
+        return cls(path)
+
+    @property
+    def shape(self):
+        return (self.num_rows, self.num_events)
+
+    def append(self, X, y=None):
+        """ Append a chunk of rows to the store
+
+        Arguments
+        ---------
+            X: ndarray or scipy sparse matrix of shape num_instances-by-num_events
+            y: ndarray, the labels of the chunk. Either every chunk or none carries labels.
+        """
+        num_instances, num_events = X.shape
+        assert num_events == self.num_events, \
+            'Expected {} columns, got {}.'.format(self.num_events, num_events)
+        labeled = y is not None
+        assert self.labeled is None or self.labeled == labeled, \
+            'Labels must be appended with either all chunks or none.'
+        if num_instances == 0:
+            return
+
+        if self.format == 'dense':
+            if sparse.issparse(X):
+                X = X.toarray()
+            with open(self._file('X.bin'), 'ab') as f:
+                f.write(np.ascontiguousarray(X, dtype=self.dtype).tobytes())
+            nnz = num_instances * num_events
+        else:
+            X = sparse.csr_matrix(X, dtype=self.dtype)
+            X.sum_duplicates()
+            with open(self._file('data.bin'), 'ab') as f:
+                f.write(X.data.tobytes())
+            with open(self._file('indices.bin'), 'ab') as f:
+                f.write(X.indices.astype(_INDEX_DTYPE).tobytes())
+            with open(self._file('indptr.bin'), 'ab') as f:
+                f.write((X.indptr[1:].astype(_INDEX_DTYPE) + self.nnz).tobytes())
+            nnz = X.nnz
+        if labeled:
+            y = np.asarray(y).reshape(-1)
+            assert y.shape[0] == num_instances, 'X and y have different numbers of rows.'
+            with open(self._file('y.bin'), 'ab') as f:
+                f.write(y.astype(_LABEL_DTYPE).tobytes())
+
+        # The metadata is written last, so readers never see a partially appended chunk.
+        self.num_rows += num_instances
+        self.nnz += nnz
+        self.labeled = labeled
+        _write_json(self._file('meta.json'), {
+            'format': self.format, 'dtype': self.dtype.name, 'num_rows': self.num_rows,
+            'num_events': self.num_events, 'nnz': self.nnz, 'labeled': self.labeled})
+
+    def load(self):
+        """ Memory-map the whole store
+
+        Returns
+        -------
+            X: read-only np.memmap (dense) or csr_matrix over memory-mapped data/indices
+            y: read-only np.memmap of labels, None for unlabeled stores
+        """
+        if self.format == 'dense':
+            X = self._memmap('X.bin', self.dtype, self.num_rows * self.num_events)
+            X = X.reshape(self.num_rows, self.num_events)
+        else:
+            X = self._csr_rows(0, self.num_rows)
+        return X, self._labels(0, self.num_rows)
+
+    def iter_chunks(self, chunk_size=10000):
+        """ Iterate over the store in row-chunks
+
+        Arguments
+        ---------
+            chunk_size: int, the maximal number of rows per chunk
+
+        Returns
+        -------
+            generator of (X_chunk, y_chunk), where X_chunk is a read-only view on the
+            memory map (dense) or a csr_matrix (csr), and y_chunk is None when unlabeled
+        """
+        if self.format == 'dense':
+            X, _ = self.load()
+        for start in range(0, self.num_rows, chunk_size):
+            end = min(start + chunk_size, self.num_rows)
+            if self.format == 'dense':
+                X_chunk = X[start:end]
+            else:
+                X_chunk = self._csr_rows(start, end)
+            yield X_chunk, self._labels(start, end)
+
+    def predict(self, model, chunk_size=10000):
+        """ Predict the whole store chunk by chunk with a fitted model
+
+        Arguments
+        ---------
+            model: object, any loglizer model with a `predict` method
+            chunk_size: int, the maximal number of rows per chunk
+
+        Returns
+        -------
+            y_pred: ndarray, the predicted label vector of shape (num_rows,)
+        """
+        y_pred = [model.predict(X_chunk) for X_chunk, _ in self.iter_chunks(chunk_size)]
+        if not y_pred:
+            return np.zeros(0)
+        return np.concatenate(y_pred)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _memmap(self, name, dtype, length, offset=0):
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode='r', shape=(length,),
+                         offset=offset * np.dtype(dtype).itemsize)
+
+    def _labels(self, start, end):
+        if not self.labeled:
+            return None
+        return self._memmap('y.bin', _LABEL_DTYPE, end - start, offset=start)
+
+    def _csr_rows(self, start, end):
+        indptr = np.array(self._memmap('indptr.bin', _INDEX_DTYPE, end - start + 1, offset=start))
+        first, last = int(indptr[0]), int(indptr[-1])
+        data = self._memmap('data.bin', self.dtype, last - first, offset=first)
+        indices = self._memmap('indices.bin', _INDEX_DTYPE, last - first, offset=first)
+        return sparse.csr_matrix((data, indices, indptr - first), shape=(end - start, self.num_events),
+                                 copy=False)
+
+
+def _write_json(path, obj):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,215 @@
+"""
+Timing and tracing hooks for the stages of the loglizer pipeline.
+
+Pipeline functions (loading, event counting, transforming, scoring) report each call as a
+span: how long it took and how many items it handled. Registered listeners receive every
+finished span. A service can export them as metrics or traces, while a batch job can
+collect them with a `StageTimer`:
+
+    with instrumentation.StageTimer() as timer:
+        (x_train, _), (x_test, _), _ = dataloader.load_HDFS(log_file)
+        ...
+    timer.report()
+
+A span opened while another one is current becomes its child and inherits its trace id
+and context, e.g. the upload_id and job_id of a request. The current span follows the
+thread or asyncio task; to continue a trace in another thread or process, pass the span
+along and `attach` it there.
+
+Listeners are per process: the workers of a process pool have to send their spans back,
+to be passed to `record` in the parent.
+
+"""
+
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+_listeners = []
+_lock = threading.Lock()
+_current = contextvars.ContextVar('loglizer_span', default=None)
+
+
+def add_listener(listener):
+    """ Register a listener called as listener(span) after every stage
+
+    Listeners run in the thread of the stage and must be cheap and thread-safe.
+    """
+    with _lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+def remove_listener(listener):
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def record(span):
+    """ Report a finished span, e.g. one sent back by a worker process """
+    for listener in list(_listeners):
+        listener(span)
+
+
+class Span(object):
+
+    def __init__(self, name, parent=None, items=0, context=None, attributes=None):
+        """ One timed call of a stage, part of a trace
+
+        Attributes
+        ----------
+            name: str, the stage name, e.g. `predict_proba`
+            trace_id, span_id, parent_id: str, hex ids linking the span into its trace;
+                parent_id is None for the root span
+            context: dict, values every descendant span carries, e.g. upload_id
+            attributes: dict, values of this span only, e.g. bytes sent
+            items: int, the number of items handled, e.g. sessions or log lines
+            start: float, the wall-clock start time in seconds since the epoch
+            seconds: float, the duration, set when the span ends
+            failed: bool, whether the timed block raised
+            pid, thread: the process id and thread name the span ran in
+        """
+        self.name = name
+        if parent is None:
+            self.trace_id = os.urandom(16).hex()
+            self.parent_id = None
+            self.context = dict()
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.context = dict(parent.context)
+        self.span_id = os.urandom(8).hex()
+        if context:
+            self.context.update(context)
+        self.attributes = dict(attributes or ())
+        self.items = items
+        self.start = time.time()
+        self.seconds = 0.0
+        self.failed = False
+        self.pid = os.getpid()
+        self.thread = threading.current_thread().name
+
+    def set_context(self, **values):
+        """ Add context values, inherited by the spans started after this call """
+        self.context.update(values)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'seconds': self.seconds,
+            'items': self.items,
+            'failed': self.failed,
+            'pid': self.pid,
+            'thread': self.thread,
+            'context': self.context,
+            'attributes': self.attributes,
+        }
+
+
+class _Stage(object):
+    # Stand-in yielded by `timed` while nobody listens
+
+    def __init__(self):
+        self.items = 0
+        self.context = dict()
+        self.attributes = dict()
+
+    def set_context(self, **values):
+        pass
+
+
+def current_span():
+    """ Return the span current in this thread or asyncio task, or None """
+    return _current.get()
+
+
+@contextmanager
+def attach(span):
+    """ Make span the current span of the enclosed block, e.g. in a worker thread
+
+    Spans started in the block become children of span; None leaves the current span as is.
+    """
+    if span is None:
+        yield span
+        return
+    token = _current.set(span)
+    try:
+        yield span
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(stage, items=0, context=None, **attributes):
+    """ Time the enclosed block as one call of the stage
+
+    Arguments
+    ---------
+        stage: str, the stage name, e.g. `predict_proba`
+        items: int, the number of items handled; can also be set on the yielded object
+            once known, e.g. the number of sessions loaded
+        context: dict, values passed on to every span started in the block, e.g. job_id
+        attributes: further values recorded on this span only, e.g. bytes=len(body)
+
+    Returns
+    -------
+        a context manager yielding the `Span`, current while the block runs. The stage is
+        reported as failed when the block raises.
+    """
+    if not _listeners:
+        yield _Stage()
+        return
+    span = Span(stage, _current.get(), items, context, attributes)
+    token = _current.set(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        span.failed = True
+        raise
+    finally:
+        span.seconds = time.perf_counter() - start
+        _current.reset(token)
+        record(span)
+
+
+class StageTimer(object):
+    """ Accumulate the calls, time and items of every stage while it is listening """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = dict()
+
+    def __call__(self, span):
+        with self._lock:
+            totals = self.stages.setdefault(span.name, {'calls': 0, 'seconds': 0.0, 'items': 0, 'failed': 0})
+            totals['calls'] += 1
+            totals['seconds'] += span.seconds
+            totals['items'] += span.items
+            totals['failed'] += int(span.failed)
+
+    def __enter__(self):
+        add_listener(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        remove_listener(self)
+
+    def summary(self):
+        """ Return stage -> dict of calls, seconds, items, failed and items_per_second """
+        with self._lock:
+            return {stage: dict(totals, items_per_second=totals['items'] / totals['seconds'] if totals['seconds'] else 0.0)
+                    for stage, totals in self.stages.items()}
+
+    def report(self):
+        print('====== Stage timings ======')
+        for stage, totals in sorted(self.summary().items(), key=lambda item: -item[1]['seconds']):
+            print('{:<30} {:>6} calls {:>9.3f}s {:>10} items {:>12.0f} items/s'.format(
+                stage, totals['calls'], totals['seconds'], totals['items'], totals['items_per_second']))
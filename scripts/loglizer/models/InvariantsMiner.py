@@ -36,15 +36,22 @@ class InvariantsMiner(object):
         self.scale_list = scale_list
         self.invariants_dict = None
 
-    def fit(self, X):
+    def fit(self, X, sample_weight=None):
         """
         Arguments
         ---------
-            X: ndarray, the event count matrix of shape num_instances-by-num_events
+            X: ndarray, the event count matrix of shape num_instances-by-num_events. The
+                invariant search scans whole columns repeatedly, so a FeatureStore is not
+                accepted; pass the dense matrix of `FeatureStore.load` instead.
+            sample_weight: ndarray, the multiplicity of each instance, None for unit weights.
+                The covariance and the invariant support are computed with these weights.
         """
         print('====== Model summary ======')
-        invar_dim = self._estimate_invarant_space(X)
-        self._invariants_search(X, invar_dim)
+        if sample_weight is None:
+            sample_weight = np.ones(X.shape[0])
+        sample_weight = np.asarray(sample_weight, dtype=float)
+        invar_dim = self._estimate_invarant_space(X, sample_weight)
+        self._invariants_search(X, invar_dim, sample_weight)
 
     def predict(self, X):
         """ Predict anomalies with mined invariants
@@ -64,19 +71,20 @@ class InvariantsMiner(object):
         y_pred = (y_sum > 1e-6).astype(int)
         return y_pred
 
-    def evaluate(self, X, y_true):
+    def evaluate(self, X, y_true, sample_weight=None):
         print('====== Evaluation summary ======')
         y_pred = self.predict(X)
-        precision, recall, f1 = metrics(y_pred, y_true)
+        precision, recall, f1 = metrics(y_pred, y_true, sample_weight)
         print('Precision: {:.3f}, recall: {:.3f}, F1-measure: {:.3f}\n'.format(precision, recall, f1))
         return precision, recall, f1
 
-    def _estimate_invarant_space(self, X):
+    def _estimate_invarant_space(self, X, sample_weight):
         """ Estimate the dimension of invariant space using SVD decomposition
 
         Arguments
         ---------
             X: ndarray, the event count matrix of shape num_instances-by-num_events
+            sample_weight: ndarray, the multiplicity of each instance
             percentage: float, percentage of samples satisfying the condition that |X_j * V_i| < epsilon
             epsilon: float, the threshold for estimating the invariant space
 
@@ -84,27 +92,29 @@ class InvariantsMiner(object):
         -------
             r: the dimension of invariant space
         """
-        covariance_matrix = np.dot(X.T, X)
+        covariance_matrix = np.dot(X.T * sample_weight, X)
         U, sigma, V = np.linalg.svd(covariance_matrix)  # SVD decomposition
         # Start from the right most column of matrix V, sigular values are in ascending order
         num_instances, num_events = X.shape
+        total_weight = np.sum(sample_weight)
         r = 0
         for i in range(num_events - 1, -1, -1):
-            zero_count = sum(abs(np.dot(X, U[:, i])) < self.epsilon)
-            if zero_count / float(num_instances) < self.percentage:
+            zero_count = np.sum(sample_weight[abs(np.dot(X, U[:, i])) < self.epsilon])
+            if zero_count / total_weight < self.percentage:
                 break
             r += 1
         print('Invariant space dimension: {}'.format(r))
 
         return r
 
-    def _invariants_search(self, X, r):
+    def _invariants_search(self, X, r, sample_weight):
         """ Mine invariant relationships from X
 
         Arguments
         ---------
             X: ndarray, the event count matrix of shape num_instances-by-num_events
             r: the dimension of invariant space
+            sample_weight: ndarray, the multiplicity of each instance
         """
 
         num_instances, num_events = X.shape
@@ -142,7 +152,7 @@ class InvariantsMiner(object):
                 if not self._check_candi_valid(tuple(item), length, search_space) and length > 2:
                     search_space.remove(item)
                     continue # an item must be superset of all other subitems in searchSpace, else skip
-                validity, scaled_theta = self._check_invar_validity(X, item)
+                validity, scaled_theta = self._check_invar_validity(X, item, sample_weight)
                 if validity:
                     self._prune(invariants_dict.keys(), set(item), search_space)
                     invariants_dict[tuple(item)] = scaled_theta.tolist()
@@ -158,13 +168,14 @@ class InvariantsMiner(object):
         print('Mined {} invariants: {}\n'.format(len(invariants_dict), invariants_dict))
         self.invariants_dict = invariants_dict
 
-    def _compute_eigenvector(self, X):
+    def _compute_eigenvector(self, X, sample_weight):
         """ calculate the smallest eigenvalue and corresponding eigenvector (theta in the paper) 
             for a given sub_matrix
 
         Arguments
         ---------
             X: the event count matrix (each row is a log sequence vector, each column represents an event)
+            sample_weight: ndarray, the multiplicity of each instance
 
         Returns
         -------
@@ -174,7 +185,7 @@ class InvariantsMiner(object):
 
         FLAG_contain_zero = False
         count_zero = 0
-        dot_result = np.dot(X.T, X)
+        dot_result = np.dot(X.T * sample_weight, X)
         U, S, V = np.linalg.svd(dot_result)
         min_vec = U[:, -1]
         count_zero = sum(np.fabs(min_vec) < 1e-6)
@@ -183,13 +194,14 @@ class InvariantsMiner(object):
         return min_vec, FLAG_contain_zero
 
 
-    def _check_invar_validity(self, X, selected_columns):
+    def _check_invar_validity(self, X, selected_columns, sample_weight):
         """ scale the eigenvector of float number into integer, and check whether the scaled number is valid
 
         Arguments
         ---------
             X: the event count matrix (each row is a log sequence vector, each column represents an event)
             selected_columns: select columns from all column list
+            sample_weight: ndarray, the multiplicity of each instance
 
         Returns
         -------
@@ -198,9 +210,9 @@ class InvariantsMiner(object):
         """
 
         sub_matrix = X[:, selected_columns]
-        inst_num = X.shape[0]
+        inst_num = np.sum(sample_weight)
         validity = False
-        min_theta, FLAG_contain_zero = self._compute_eigenvector(sub_matrix)
+        min_theta, FLAG_contain_zero = self._compute_eigenvector(sub_matrix, sample_weight)
         abs_min_theta = [np.fabs(it) for it in min_theta]
         if FLAG_contain_zero:
             return validity, []
@@ -214,10 +226,7 @@ class InvariantsMiner(object):
                 if 0 in np.fabs(scaled_theta):
                     continue
                 dot_submat_theta = np.dot(sub_matrix, scaled_theta)
-                count_zero = 0
-                for j in dot_submat_theta:
-                    if np.fabs(j) < 1e-8:
-                        count_zero += 1
+                count_zero = np.sum(sample_weight[np.fabs(dot_submat_theta) < 1e-8])
                 if count_zero >= self.percentage * inst_num:
                     validity = True
                     # print('A valid invariant is found: ',scaled_theta, selected_columns)
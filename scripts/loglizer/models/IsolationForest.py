@@ -17,6 +17,7 @@ Reference:
 import numpy as np
 from sklearn.ensemble import IsolationForest as iForest
 from ..utils import metrics
+from ..feature_store import FeatureStore
 
 class IsolationForest(iForest):
 
@@ -61,15 +62,19 @@ class IsolationForest(iForest):
             contamination=contamination, **kwargs)
 
 
-    def fit(self, X):
+    def fit(self, X, sample_weight=None):
         """
         Auguments
         ---------
-            X: ndarray, the event count matrix of shape num_instances-by-num_events
+            X: ndarray, the event count matrix of shape num_instances-by-num_events, or a
+                FeatureStore, fitted on through its memory maps
+            sample_weight: ndarray, the multiplicity of each instance, None for unit weights
         """
 
         print('====== Model summary ======')
-        super(IsolationForest, self).fit(X)
+        if isinstance(X, FeatureStore):
+            X = X.load()[0]
+        super(IsolationForest, self).fit(X, sample_weight=sample_weight)
 
     def predict(self, X):
         """ Predict anomalies with mined invariants
@@ -83,14 +88,16 @@ class IsolationForest(iForest):
             y_pred: ndarray, the predicted label vector of shape (num_instances,)
         """
         
+        if isinstance(X, FeatureStore):
+            return X.predict(self)
         y_pred = super(IsolationForest, self).predict(X)
         y_pred = np.where(y_pred > 0, 0, 1)
         return y_pred
 
-    def evaluate(self, X, y_true):
+    def evaluate(self, X, y_true, sample_weight=None):
         print('====== Evaluation summary ======')
         y_pred = self.predict(X)
-        precision, recall, f1 = metrics(y_pred, y_true)
+        precision, recall, f1 = metrics(y_pred, y_true, sample_weight)
         print('Precision: {:.3f}, recall: {:.3f}, F1-measure: {:.3f}\n'.format(precision, recall, f1))
         return precision, recall, f1
 
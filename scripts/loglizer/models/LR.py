@@ -15,6 +15,7 @@ Reference:
 import numpy as np
 from sklearn.linear_model import LogisticRegression
 from ..utils import metrics
+from ..feature_store import FeatureStore
 
 class LR(object):
 
@@ -28,14 +29,21 @@ class LR(object):
         self.classifier = LogisticRegression(penalty=penalty, C=C, tol=tol, class_weight=class_weight,
                                              max_iter=max_iter)
 
-    def fit(self, X, y):
+    def fit(self, X, y=None, sample_weight=None):
         """
         Arguments
         ---------
-            X: ndarray, the event count matrix of shape num_instances-by-num_events
+            X: ndarray, the event count matrix of shape num_instances-by-num_events, or a
+                FeatureStore, fitted on through its memory maps
+            y: ndarray, the labels; defaults to the labels of a FeatureStore
+            sample_weight: ndarray, the multiplicity of each instance, None for unit weights
         """
         print('====== Model summary ======')
-        self.classifier.fit(X, y)
+        if isinstance(X, FeatureStore):
+            X, y_store = X.load()
+            y = y_store if y is None else y
+        assert y is not None, 'Labels are required to fit the classifier.'
+        self.classifier.fit(X, y, sample_weight=sample_weight)
 
     def predict(self, X):
         """ Predict anomalies with mined invariants
@@ -48,6 +56,8 @@ class LR(object):
         -------
             y_pred: ndarray, the predicted label vector of shape (num_instances,)
         """
+        if isinstance(X, FeatureStore):
+            return X.predict(self)
         y_pred = self.classifier.predict(X)
         return y_pred
 
@@ -65,9 +75,9 @@ class LR(object):
         y_pred = self.classifier.predict_proba(X)
         return y_pred
 
-    def evaluate(self, X, y_true):
+    def evaluate(self, X, y_true, sample_weight=None):
         print('====== Evaluation summary ======')
         y_pred = self.predict(X)
-        precision, recall, f1 = metrics(y_pred, y_true)
+        precision, recall, f1 = metrics(y_pred, y_true, sample_weight)
         print('Precision: {:.3f}, recall: {:.3f}, F1-measure: {:.3f}\n'.format(precision, recall, f1))
         return precision, recall, f1
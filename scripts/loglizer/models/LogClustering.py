@@ -42,19 +42,32 @@ class LogClustering(object):
         self.representatives = list()
         self.cluster_size_dict = dict()
 
-    def fit(self, X):   
+    def fit(self, X, sample_weight=None):
+        """
+        Arguments
+        ---------
+            X: ndarray, the event count matrix of shape num_instances-by-num_events. The
+                clustering needs pairwise distances of all rows, so a FeatureStore is not
+                accepted; pass the dense matrix of `FeatureStore.load` instead.
+            sample_weight: ndarray, the multiplicity of each instance (see
+                `preprocessing.deduplicate`), None for unit weights. Cluster sizes and
+                centroids are weighted, and pdist only runs over the given rows.
+        """
         print('====== Model summary ======')         
+        if sample_weight is None:
+            sample_weight = np.ones(X.shape[0])
+        sample_weight = np.asarray(sample_weight, dtype=float)
         if self.mode == 'offline':
             # The offline mode can process about 10K samples only due to huge memory consumption.
-            self._offline_clustering(X)
+            self._offline_clustering(X, sample_weight)
         elif self.mode == 'online':
-            # Bootstrapping phase
-            if self.num_bootstrap_samples > 0:
-                X_bootstrap = X[0:self.num_bootstrap_samples, :]
-                self._offline_clustering(X_bootstrap)
+            # Bootstrapping phase: the first rows covering num_bootstrap_samples instances
+            num_bootstrap = int(np.sum(np.cumsum(sample_weight) - sample_weight < self.num_bootstrap_samples))
+            if num_bootstrap > 0:
+                self._offline_clustering(X[0:num_bootstrap, :], sample_weight[0:num_bootstrap])
             # Online learning phase
-            if X.shape[0] > self.num_bootstrap_samples:
-                self._online_clustering(X)
+            if X.shape[0] > num_bootstrap:
+                self._online_clustering(X, num_bootstrap, sample_weight)
 
     def predict(self, X):
         y_pred = np.zeros(X.shape[0])
@@ -64,48 +77,53 @@ class LogClustering(object):
                 y_pred[i] = 1
         return y_pred
 
-    def evaluate(self, X, y_true):
+    def evaluate(self, X, y_true, sample_weight=None):
         print('====== Evaluation summary ======')
         y_pred = self.predict(X)
-        precision, recall, f1 = metrics(y_pred, y_true)
+        precision, recall, f1 = metrics(y_pred, y_true, sample_weight)
         print('Precision: {:.3f}, recall: {:.3f}, F1-measure: {:.3f}\n' \
               .format(precision, recall, f1))
         return precision, recall, f1
 
-    def _offline_clustering(self, X):
+    def _offline_clustering(self, X, sample_weight):
         print('Starting offline clustering...')
-        p_dist = pdist(X, metric=self._distance_metric)
-        Z = linkage(p_dist, 'complete')
-        cluster_index = fcluster(Z, self.max_dist, criterion='distance')
-        self._extract_representatives(X, cluster_index)
+        if X.shape[0] > 1:
+            p_dist = pdist(X, metric=self._distance_metric)
+            Z = linkage(p_dist, 'complete')
+            cluster_index = fcluster(Z, self.max_dist, criterion='distance')
+        else:
+            cluster_index = np.ones(X.shape[0], dtype=int)
+        self._extract_representatives(X, cluster_index, sample_weight)
         print('Processed {} instances.'.format(X.shape[0]))
         print('Found {} clusters offline.\n'.format(len(self.representatives)))
         # print('The representive vectors are:')
         # pprint.pprint(self.representatives.tolist())
 
-    def _extract_representatives(self, X, cluster_index):
+    def _extract_representatives(self, X, cluster_index, sample_weight):
         num_clusters = len(set(cluster_index))
         for clu in range(num_clusters):
             clu_idx = np.argwhere(cluster_index == clu + 1)[:, 0]
-            self.cluster_size_dict[clu] = clu_idx.shape[0]
-            repre_center = np.average(X[clu_idx, :], axis=0)
+            self.cluster_size_dict[clu] = np.sum(sample_weight[clu_idx])
+            repre_center = np.average(X[clu_idx, :], axis=0, weights=sample_weight[clu_idx])
             self.representatives.append(repre_center)
 
-    def _online_clustering(self, X):
+    def _online_clustering(self, X, start, sample_weight):
         print("Starting online clustering...")
-        for i in range(self.num_bootstrap_samples, X.shape[0]):
+        for i in range(start, X.shape[0]):
             if (i + 1) % 2000 == 0:
                 print('Processed {} instances.'.format(i + 1))
             instance_vec = X[i, :]
+            weight = sample_weight[i]
             if len(self.representatives) > 0:
                 min_dist, clu_id = self._get_min_cluster_dist(instance_vec)
                 if min_dist <= self.max_dist:
-                    self.cluster_size_dict[clu_id] += 1
+                    # Same centroid as adding the instance `weight` times one by one
+                    self.cluster_size_dict[clu_id] += weight
                     self.representatives[clu_id] = self.representatives[clu_id] \
                                                  + (instance_vec - self.representatives[clu_id]) \
-                                                 / self.cluster_size_dict[clu_id]
+                                                 * weight / self.cluster_size_dict[clu_id]
                     continue
-            self.cluster_size_dict[len(self.representatives)] = 1
+            self.cluster_size_dict[len(self.representatives)] = weight
             self.representatives.append(instance_vec)
         print('Processed {} instances.'.format(X.shape[0]))
         print('Found {} clusters online.\n'.format(len(self.representatives)))
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+The implementation of an n-gram next-event model for anomaly detection, a count-based
+variant of the top-g next-event check of DeepLog.
+
+Reference:
+    [1] Min Du, Feifei Li, Guineng Zheng, Vivek Srikumar. DeepLog: Anomaly Detection and
+        Diagnosis from System Logs through Deep Learning. ACM SIGSAC Conference on Computer
+        and Communications Security (CCS), 2017.
+
+"""
+
+import numpy as np
+import pandas as pd
+from itertools import chain
+from ..utils import metrics
+
+# Multiplier of the rolling hash of contexts too long to pack exactly into 64 bits
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class NGram(object):
+
+    def __init__(self, history=None, top_g=9, backoff=True, batch_size=100000):
+        """ The n-gram next-event model for anomaly detection
+
+        A window is anomalous when the event following it is not among the `top_g` events
+        that most often followed its last `history` events in training. Contexts never seen
+        in training back off to their shorter suffixes, down to the most frequent events
+        overall; without backoff they are anomalous.
+
+        Attributes
+        ----------
+            history: int, the number of preceding events the next event is predicted from,
+                by default the whole window
+            top_g: int, the number of candidate next events accepted per context
+            backoff: bool, whether unseen contexts back off to shorter contexts
+            batch_size: int, the maximal number of windows encoded and scored at once
+            events: list, the event vocabulary; unknown events get the code len(events)
+            tables: list, the count table of every context length from 0 to history, see
+                `_fit_table`
+        """
+        self.history = history
+        self.top_g = top_g
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.events = None
+        self.tables = None
+        self._multiplier = None
+
+    def fit(self, X, next_events, sample_weight=None):
+        """
+        Arguments
+        ---------
+            X: DataFrame with an `EventSequence` column of equal-length windows, as returned
+                by `dataloader.slice_hdfs`, or a sequence of windows; windows of normal
+                sessions only
+            next_events: the event following each window, e.g. `#Pad` at the end of a session
+            sample_weight: ndarray, the multiplicity of each window, None for unit weights
+        """
+        print('====== Model summary ======')
+        windows = _windows(X)
+        next_events = np.asarray(next_events, dtype=object)
+        self.events = pd.unique(np.concatenate([np.fromiter(chain.from_iterable(windows), dtype=object),
+                                                next_events])).tolist()
+        window_size = len(windows[0]) if len(windows) else 0
+        self.history = window_size if self.history is None else min(self.history, window_size)
+        base = len(self.events) + 1
+        # Contexts are packed exactly while base ** history fits into 63 bits, else hashed
+        self._multiplier = np.uint64(base) if self.history * np.log2(base) < 63 else _HASH_MULTIPLIER
+        codes = self._encode(windows)
+        next_codes = self._encode_events(next_events)
+        weights = np.ones(len(next_codes)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+        self.tables = [self._fit_table(self._context_keys(codes, length), next_codes, weights)
+                       for length in range(self.history + 1)]
+        print('{} windows, {} events, contexts of up to {} events: {} distinct contexts'.format(
+            len(next_codes), len(self.events), self.history, len(self.tables[-1]['keys'])))
+
+    def predict(self, X, next_events):
+        """ Predict anomalous windows
+
+        Arguments
+        ---------
+            X: the windows, see `fit`
+            next_events: the event following each window
+
+        Returns
+        -------
+            y_pred: ndarray, the predicted label vector of shape (num_windows,)
+        """
+        return self._score(X, next_events)[0]
+
+    def next_event_probability(self, X, next_events):
+        """ Return the training frequency of each next event after its (backed-off) context
+
+        Arguments
+        ---------
+            X: the windows, see `fit`
+            next_events: the event following each window
+
+        Returns
+        -------
+            probability: ndarray of shape (num_windows,), 0 for unseen contexts and events
+        """
+        return self._score(X, next_events)[1]
+
+    def evaluate(self, X, next_events, y_true, sample_weight=None):
+        """ Evaluate the predictions per session when X has a `SessionId` column, else per window
+
+        A session is anomalous when one of its windows is. y_true and sample_weight are given
+        per window, e.g. the session labels returned by `dataloader.slice_hdfs`.
+        """
+        print('====== Evaluation summary ======')
+        y_pred = self.predict(X, next_events)
+        y_true = np.asarray(y_true)
+        if isinstance(X, pd.DataFrame) and 'SessionId' in X.columns:
+            sessions = pd.DataFrame({'SessionId': X['SessionId'].to_numpy(), 'pred': y_pred, 'true': y_true})
+            if sample_weight is not None:
+                sessions['weight'] = sample_weight
+            sessions = sessions.groupby('SessionId', sort=False).agg(
+                {'pred': 'max', 'true': 'max', **({'weight': 'first'} if sample_weight is not None else {})})
+            y_pred, y_true = sessions['pred'].to_numpy(), sessions['true'].to_numpy()
+            sample_weight = sessions['weight'].to_numpy() if sample_weight is not None else None
+        precision, recall, f1 = metrics(y_pred, y_true, sample_weight)
+        print('Precision: {:.3f}, recall: {:.3f}, F1-measure: {:.3f}\n'.format(precision, recall, f1))
+        return precision, recall, f1
+
+    def _score(self, X, next_events):
+        windows = _windows(X)
+        next_events = np.asarray(next_events, dtype=object)
+        y_pred = np.zeros(len(next_events), dtype=int)
+        probability = np.zeros(len(next_events))
+        for start in range(0, len(next_events), self.batch_size):
+            end = start + self.batch_size
+            codes = self._encode(windows[start:end])
+            next_codes = self._encode_events(next_events[start:end])
+            y_pred[start:end], probability[start:end] = self._score_codes(codes, next_codes)
+        return y_pred, probability
+
+    def _score_codes(self, codes, next_codes):
+        num_window = len(next_codes)
+        anomalous = np.ones(num_window, dtype=bool)
+        probability = np.zeros(num_window)
+        pending = np.arange(num_window)
+        # Longest context first; windows whose context was seen are settled at that length
+        for length in range(self.history, -1, -1):
+            if len(pending) == 0:
+                break
+            table = self.tables[length]
+            contexts = _lookup(table['keys'], self._context_keys(codes[pending], length))
+            found = contexts >= 0
+            rows, contexts = pending[found], contexts[found]
+            anomalous[rows] = ~np.any(table['candidates'][contexts] == next_codes[rows, None], axis=1)
+            pairs = _lookup(table['pair_keys'], contexts * (len(self.events) + 1) + next_codes[rows])
+            probability[rows] = np.where(pairs >= 0, table['pair_counts'][np.maximum(pairs, 0)], 0) \
+                / table['totals'][contexts]
+            pending = pending[~found]
+            if not self.backoff:
+                break
+        return anomalous.astype(int), probability
+
+    def _fit_table(self, context_keys, next_codes, weights):
+        """ Count the next events of every distinct context
+
+        Returns a dict of `keys`, the sorted context keys, `totals`, their weighted counts,
+        `candidates`, their top_g next event codes by count (-1 when fewer were seen), and
+        `pair_keys` and `pair_counts`, the sorted (context index, next event) keys and counts.
+        """
+        base = len(self.events) + 1
+        keys, contexts = np.unique(context_keys, return_inverse=True)
+        pair_keys, pairs = np.unique(contexts.reshape(-1) * base + next_codes, return_inverse=True)
+        pair_counts = np.bincount(pairs.reshape(-1), weights=weights, minlength=len(pair_keys))
+        pair_contexts, pair_next = pair_keys // base, pair_keys % base
+        totals = np.bincount(pair_contexts, weights=pair_counts, minlength=len(keys))
+        # Most frequent first within each context; the rank within a context picks the top_g
+        order = np.lexsort((pair_next, -pair_counts, pair_contexts))
+        starts = np.searchsorted(pair_contexts[order], np.arange(len(keys)))
+        ranks = np.arange(len(order)) - starts[pair_contexts[order]]
+        keep = ranks < self.top_g
+        candidates = np.full((len(keys), self.top_g), -1, dtype=np.int64)
+        candidates[pair_contexts[order][keep], ranks[keep]] = pair_next[order][keep]
+        return {'keys': keys, 'totals': totals, 'candidates': candidates, 'pair_keys': pair_keys,
+                'pair_counts': pair_counts}
+
+    def _context_keys(self, codes, length):
+        # Rolling key of the last `length` codes; uint64 arithmetic wraps around when hashing
+        keys = np.zeros(codes.shape[0], dtype=np.uint64)
+        for column in range(codes.shape[1] - length, codes.shape[1]):
+            keys = keys * self._multiplier + codes[:, column].astype(np.uint64)
+        return keys
+
+    def _encode(self, windows):
+        num_window = len(windows)
+        window_size = len(windows[0]) if num_window else self.history
+        flat = np.fromiter(chain.from_iterable(windows), dtype=object, count=num_window * window_size)
+        return self._encode_events(flat).reshape(num_window, window_size)
+
+    def _encode_events(self, events):
+        codes = pd.Index(self.events).get_indexer(np.asarray(events, dtype=object))
+        codes[codes < 0] = len(self.events)
+        return codes.astype(np.int64)
+
+
+def _windows(X):
+    if isinstance(X, pd.DataFrame):
+        return X['EventSequence'].to_numpy()
+    return np.asarray(X, dtype=object) if not isinstance(X, np.ndarray) else X
+
+
+def _lookup(sorted_keys, keys):
+    """ Return the index of each key in sorted_keys, -1 when absent """
+    if len(sorted_keys) == 0:
+        return np.full(len(keys), -1, dtype=np.int64)
+    idx = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return np.where(sorted_keys[idx] == keys, idx, -1)
@@ -12,7 +12,9 @@ Reference:
 """
 
 import numpy as np
+from scipy import sparse
 from ..utils import metrics
+from ..feature_store import FeatureStore
 
 class PCA(object):
 
@@ -45,16 +47,27 @@ class PCA(object):
         self.c_alpha = c_alpha
 
 
-    def fit(self, X):
+    def fit(self, X, sample_weight=None):
         """
         Auguments
         ---------
-            X: ndarray, the event count matrix of shape num_instances-by-num_events
+            X: ndarray, the event count matrix of shape num_instances-by-num_events, or a
+                FeatureStore whose covariance is accumulated in row-chunks
+            sample_weight: ndarray, the multiplicity of each instance, None for unit weights
         """
 
         print('====== Model summary ======')
         num_instances, num_events = X.shape
-        X_cov = np.dot(X.T, X) / float(num_instances)
+        if isinstance(X, FeatureStore):
+            assert sample_weight is None, 'sample_weight is not supported for a FeatureStore.'
+            X_cov = np.zeros((num_events, num_events))
+            for X_chunk, _ in X.iter_chunks():
+                X_cov += _gram(X_chunk)
+            X_cov /= float(num_instances)
+        elif sample_weight is None:
+            X_cov = _gram(X) / float(num_instances)
+        else:
+            X_cov = _gram(X, sample_weight) / float(np.sum(sample_weight))
         U, sigma, V = np.linalg.svd(X_cov)
         n_components = self.n_components
         if n_components < 1:
@@ -88,18 +101,29 @@ class PCA(object):
 
     def predict(self, X):
         assert self.proj_C is not None, 'PCA model needs to be trained before prediction.'
-        y_pred = np.zeros(X.shape[0])
-        for i in range(X.shape[0]):
-            y_a = np.dot(self.proj_C, X[i, :])
-            SPE = np.dot(y_a, y_a)
-            if SPE > self.threshold:
-                y_pred[i] = 1
+        if isinstance(X, FeatureStore):
+            return X.predict(self)
+        # proj_C is symmetric, so the rows of X.dot(proj_C) are the residual vectors y_a
+        y_a = X.dot(self.proj_C)
+        SPE = np.sum(y_a * y_a, axis=1)
+        y_pred = (SPE > self.threshold).astype(float)
         return y_pred
 
-    def evaluate(self, X, y_true):
+    def evaluate(self, X, y_true, sample_weight=None):
         print('====== Evaluation summary ======')
         y_pred = self.predict(X)
-        precision, recall, f1 = metrics(y_pred, y_true)
+        precision, recall, f1 = metrics(y_pred, y_true, sample_weight)
         print('Precision: {:.3f}, recall: {:.3f}, F1-measure: {:.3f}\n'.format(precision, recall, f1))
         return precision, recall, f1
 
+
+def _gram(X, sample_weight=None):
+    if sample_weight is None:
+        gram = X.T.dot(X)
+    elif sparse.issparse(X):
+        gram = X.T.dot(sparse.diags(np.asarray(sample_weight, dtype=float)).dot(X))
+    else:
+        gram = np.dot(X.T * np.asarray(sample_weight, dtype=float), X)
+    if sparse.issparse(gram):
+        gram = gram.toarray()
+    return np.asarray(gram, dtype=float)
@@ -6,3 +6,4 @@ from .SVM import SVM
 from .DecisionTree import DecisionTree
 from .IsolationForest import IsolationForest
 
+from .NGram import NGram
@@ -13,8 +13,12 @@ import numpy as np
 import re
 from collections import Counter
 from scipy.special import expit
-from itertools import compress
+from itertools import compress, chain
 
+from . import instrumentation
+
+# The event templates of the HDFS dataset (LogHub), as produced by the structured log
+HDFS_EVENTS = ['E{}'.format(idx) for idx in range(1, 30)]
 
 
 class FeatureExtractor(object):
@@ -27,7 +31,8 @@ class FeatureExtractor(object):
         self.normalization = None
         self.oov = None
 
-    def fit_transform(self, X_seq, term_weighting=None, normalization=None, oov=False, min_count=1):
+    def fit_transform(self, X_seq, term_weighting=None, normalization=None, oov=False, min_count=1,
+                      sample_weight=None):
         """ Fit and transform the data matrix
 
         Arguments
@@ -37,6 +42,8 @@ class FeatureExtractor(object):
             normalization: None or `zero-mean`
             oov: bool, whether to use OOV event
             min_count: int, the minimal occurrence of events (default 0), only valid when oov=True.
+            sample_weight: ndarray, the multiplicity of each sequence (see `deduplicate`), None
+                for unit weights. The fitted idf and mean vectors equal those of the expanded data.
 
         Returns
         -------
@@ -55,10 +62,13 @@ class FeatureExtractor(object):
         X_df = X_df.fillna(0)
         self.events = X_df.columns
         X = X_df.values
+        if sample_weight is None:
+            sample_weight = np.ones(X.shape[0])
+        sample_weight = np.asarray(sample_weight, dtype=float)
         if self.oov:
             oov_vec = np.zeros(X.shape[0])
             if min_count > 1:
-                idx = np.sum(X > 0, axis=0) >= min_count
+                idx = np.dot(sample_weight, X > 0) >= min_count
                 oov_vec = np.sum(X[:, ~idx] > 0, axis=1)
                 X = X[:, idx]
                 self.events = np.array(X_df.columns)[idx].tolist()
@@ -66,12 +76,12 @@ class FeatureExtractor(object):
         
         num_instance, num_event = X.shape
         if self.term_weighting == 'tf-idf':
-            df_vec = np.sum(X > 0, axis=0)
-            self.idf_vec = np.log(num_instance / (df_vec + 1e-8))
+            df_vec = np.dot(sample_weight, X > 0)
+            self.idf_vec = np.log(sample_weight.sum() / (df_vec + 1e-8))
             idf_matrix = X * np.tile(self.idf_vec, (num_instance, 1)) 
             X = idf_matrix
         if self.normalization == 'zero-mean':
-            mean_vec = X.mean(axis=0)
+            mean_vec = np.average(X, axis=0, weights=sample_weight)
             self.mean_vec = mean_vec.reshape(1, num_event)
             X = X - np.tile(self.mean_vec, (num_instance, 1))
         elif self.normalization == 'sigmoid':
@@ -81,6 +91,21 @@ class FeatureExtractor(object):
         print('Train data shape: {}-by-{}\n'.format(X_new.shape[0], X_new.shape[1])) 
         return X_new
 
+    def inference_mode(self, events=None):
+        """ Prepare an unfitted extractor for scoring raw event counts with a pre-trained model
+
+        Arguments
+        ---------
+            events: list, the event vocabulary the model was trained on. Defaults to the
+                HDFS templates `HDFS_EVENTS` (E1 to E29), without weighting or normalization.
+        """
+        self.events = list(HDFS_EVENTS if events is None else events)
+        self.term_weighting = None
+        self.normalization = None
+        self.oov = False
+        self.idf_vec = None
+        self.mean_vec = None
+
     def transform(self, X_seq):
         """ Transform the data matrix with trained parameters
 
@@ -94,30 +119,129 @@ class FeatureExtractor(object):
             X_new: The transformed data matrix
         """
         print('====== Transformed test data summary ======')
-        X_counts = []
-        for i in range(X_seq.shape[0]):
-            event_counts = Counter(X_seq[i])
-            X_counts.append(event_counts)
-        X_df = pd.DataFrame(X_counts)
-        X_df = X_df.fillna(0)
-        empty_events = set(self.events) - set(X_df.columns)
-        for event in empty_events:
-            X_df[event] = [0] * len(X_df)
-        X = X_df[self.events].values
-        if self.oov:
-            oov_vec = np.sum(X_df[X_df.columns.difference(self.events)].values > 0, axis=1)
-            X = np.hstack([X, oov_vec.reshape(X.shape[0], 1)])
-        
-        num_instance, num_event = X.shape
-        if self.term_weighting == 'tf-idf':
-            idf_matrix = X * np.tile(self.idf_vec, (num_instance, 1)) 
-            X = idf_matrix
-        if self.normalization == 'zero-mean':
-            X = X - np.tile(self.mean_vec, (num_instance, 1))
-        elif self.normalization == 'sigmoid':
-            X[X != 0] = expit(X[X != 0])
-        X_new = X
+        X_new = self.transform_counts(self.count_events(X_seq))
 
         print('Test data shape: {}-by-{}\n'.format(X_new.shape[0], X_new.shape[1])) 
 
         return X_new
+
+    def count_events(self, X_seq):
+        """ Count the events of each sequence against the fitted vocabulary
+
+        Arguments
+        ---------
+            X_seq: ndarray, log sequences matrix
+
+        Returns
+        -------
+            X_counts: ndarray, the raw event count matrix, with the OOV column appended
+                when oov=True. Identical sessions yield identical rows.
+        """
+        num_instance = X_seq.shape[0]
+        with instrumentation.timed('FeatureExtractor.count_events', num_instance):
+            lengths = np.fromiter((len(seq) for seq in X_seq), dtype=np.int64, count=num_instance)
+            rows = np.repeat(np.arange(num_instance), lengths)
+            events = np.fromiter(chain.from_iterable(X_seq), dtype=object, count=lengths.sum())
+            return self.count_pairs(rows, events, num_instance)
+
+    def count_pairs(self, rows, events, num_instance):
+        """ Count event occurrences given as (instance, event) pairs against the fitted vocabulary
+
+        Counts of disjoint pair sets add up, except for the OOV column, which counts
+        distinct unknown events.
+
+        Arguments
+        ---------
+            rows: ndarray of int, the instance index of each occurrence
+            events: ndarray, the event of each occurrence
+            num_instance: int, the number of instances
+
+        Returns
+        -------
+            X_counts: ndarray, the raw event count matrix of shape num_instance-by-num_event,
+                with the OOV column appended when oov=True
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        num_event = len(self.events)
+        codes = pd.Index(self.events).get_indexer(np.asarray(events, dtype=object))
+        known = codes >= 0
+        X = np.bincount(rows[known] * num_event + codes[known],
+                        minlength=num_instance * num_event).astype(float)
+        X = X.reshape(num_instance, num_event)
+        if self.oov:
+            # The OOV feature is the number of distinct unknown events in an instance
+            oov_codes, oov_events = pd.factorize(np.asarray(events, dtype=object)[~known])
+            num_code = max(len(oov_events), 1)
+            oov_pairs = np.unique(rows[~known] * num_code + oov_codes)
+            oov_vec = np.bincount(oov_pairs // num_code, minlength=num_instance)
+            X = np.hstack([X, oov_vec.reshape(num_instance, 1)])
+        return X
+
+    def transform_counts(self, X):
+        """ Apply the fitted term weighting and normalization to raw event counts
+
+        Arguments
+        ---------
+            X: ndarray, the event count matrix returned by `count_events`
+
+        Returns
+        -------
+            X_new: The transformed data matrix
+        """
+        # Reported as the transform stage; transform() reports count_events separately
+        with instrumentation.timed('FeatureExtractor.transform', len(X)):
+            X = np.array(X, dtype=float)
+            num_instance, num_event = X.shape
+            if self.term_weighting == 'tf-idf':
+                idf_matrix = X * np.tile(self.idf_vec, (num_instance, 1)) 
+                X = idf_matrix
+            if self.normalization == 'zero-mean':
+                X = X - np.tile(self.mean_vec, (num_instance, 1))
+            elif self.normalization == 'sigmoid':
+                X[X != 0] = expit(X[X != 0])
+            X_new = X
+            return X_new
+
+
+def deduplicate(X, y=None):
+    """ Collapse identical instances into unique instances plus multiplicities
+
+    Arguments
+    ---------
+        X: ndarray, either an event count matrix, whose identical rows are collapsed, or a
+            1-D array of log sequences, which are collapsed when their event counts are equal
+        y: ndarray, the labels. Instances with equal features but different labels are kept apart.
+
+    Returns
+    -------
+        X_unique: the unique instances, in order of their first occurrence
+        y_unique: the labels of the unique instances, None if y is None
+        sample_weight: ndarray, the multiplicity of each unique instance
+        inverse: ndarray, the index into X_unique of every original instance, i.e.
+            X_unique[inverse] restores X
+    """
+    num_instance = X.shape[0]
+    if X.ndim == 1:
+        # Log sequences: the key is the event count vector, i.e. the multiset of events
+        keys = [tuple(sorted(Counter(seq).items())) for seq in X]
+        if y is not None:
+            keys = list(zip(keys, y))
+        index_dict = dict()
+        inverse = np.array([index_dict.setdefault(key, len(index_dict)) for key in keys], dtype=int)
+        # Keys are numbered by first occurrence, so the first indices come out in order
+        _, first_index = np.unique(inverse, return_index=True)
+    else:
+        rows = X if y is None else np.hstack([X, np.asarray(y).reshape(num_instance, 1)])
+        _, first_index, inverse = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        # np.unique sorts the rows; restore the order of first occurrence
+        order = np.argsort(first_index)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0])
+        first_index = first_index[order]
+        inverse = rank[inverse]
+    sample_weight = np.bincount(inverse, minlength=first_index.shape[0]).astype(float)
+    X_unique = X[first_index]
+    y_unique = None if y is None else np.asarray(y)[first_index]
+    print('Deduplicated {} instances into {} unique instances.'.format(num_instance, X_unique.shape[0]))
+    return X_unique, y_unique, sample_weight, inverse
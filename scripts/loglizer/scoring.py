@@ -0,0 +1,375 @@
+"""
+The utilities for scoring log sessions with fitted models at inference time.
+
+"""
+
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from . import instrumentation
+
+# Approximate bookkeeping cost of one cache entry (dict slot, key object, array header)
+_ENTRY_OVERHEAD = 200
+
+# Reason of the rows scored without contributors
+_NO_CONTRIBUTORS = 'No event contributions available for this model'
+
+
+class ScoringCache(object):
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, model_version=None):
+        """ A memoizing cache of per-session scores with LRU eviction
+
+        Identical sessions have identical event count vectors, so each row is keyed by
+        a hash of its event counts plus the model version, and only the unique rows
+        that miss the cache are scored, in one batch.
+
+        Attributes
+        ----------
+            max_bytes: int, the memory cap of the cached scores; least recently used
+                entries are evicted beyond it
+            model_version: str, the version of the model the cached scores belong to.
+                Changing it through `set_model_version` invalidates the cache.
+            hits, misses, duplicates, evictions: int, the cache counters since creation.
+                Every row is counted once: as a hit when its score was cached, as a miss
+                when it was scored, or as a duplicate when it shared the score of an
+                identical missed row of the same call.
+        """
+        self.max_bytes = max_bytes
+        self.model_version = model_version
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Incremented on every invalidation, so scores computed before it are not stored
+        self._generation = 0
+        self._entries = OrderedDict()
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+
+    def set_model_version(self, model_version):
+        """ Switch the model version, dropping every entry scored by another version """
+        with self._lock:
+            if model_version == self.model_version:
+                return
+            self.model_version = model_version
+            self._entries.clear()
+            self._num_bytes = 0
+            self.invalidations += 1
+            self._generation += 1
+
+    def score(self, X_counts, score_func, variant='', model_version=None):
+        """ Score an event count matrix, reusing cached scores of identical rows
+
+        Arguments
+        ---------
+            X_counts: ndarray, the raw event count matrix of shape num_instances-by-num_events,
+                e.g. from `FeatureExtractor.count_events`
+            score_func: callable, maps a count matrix of unique rows to a score array
+                with one row per input row, e.g. transform followed by `predict_proba`
+            variant: str, part of the key that tells apart score functions sharing the cache
+            model_version: str, the version of the model score_func scores with, when
+                several versions share the cache; defaults to the cache's model_version
+
+        Returns
+        -------
+            scores: ndarray, the scores of every row of X_counts
+        """
+        X_counts = np.ascontiguousarray(X_counts, dtype=float)
+        num_instances = X_counts.shape[0]
+        if num_instances == 0:
+            return score_func(X_counts)
+        # Unique rows via a bytes view, much faster than np.unique(axis=0)
+        row_view = X_counts.view(np.dtype((np.void, X_counts.dtype.itemsize * X_counts.shape[1]))).ravel()
+        _, unique_idx, inverse = np.unique(row_view, return_index=True, return_inverse=True)
+        X_unique = X_counts[unique_idx]
+        inverse = inverse.reshape(-1)
+        row_counts = np.bincount(inverse, minlength=len(unique_idx))
+
+        with self._lock:
+            generation = self._generation
+            version = '{}/{}'.format(model_version or self.model_version, variant).encode('utf-8')
+            keys = [hashlib.blake2b(version + row.tobytes(), digest_size=16).digest() for row in X_unique]
+            unique_scores = [self._entries.get(key) for key in keys]
+            for key, value in zip(keys, unique_scores):
+                if value is not None:
+                    self._entries.move_to_end(key)
+        miss_idx = [idx for idx, value in enumerate(unique_scores) if value is None]
+
+        if miss_idx:
+            miss_scores = np.asarray(score_func(X_unique[miss_idx]))
+            with self._lock:
+                # Scores of a version invalidated meanwhile are returned but not stored
+                stale = generation != self._generation
+                for idx, value in zip(miss_idx, miss_scores):
+                    unique_scores[idx] = value
+                    if not stale:
+                        self._put(keys[idx], np.array(value))
+
+        # Counters are per session, so the hit rate reflects the scoring work saved
+        num_misses = len(miss_idx)
+        num_missed_rows = int(row_counts[miss_idx].sum()) if miss_idx else 0
+        with self._lock:
+            self.misses += num_misses
+            self.duplicates += num_missed_rows - num_misses
+            self.hits += num_instances - num_missed_rows
+        return np.asarray(unique_scores)[inverse]
+
+    def stats(self):
+        """ Return the cache counters and size as a dict """
+        with self._lock:
+            lookups = self.hits + self.misses + self.duplicates
+            return {
+                'model_version': self.model_version,
+                'entries': len(self._entries),
+                'bytes': self._num_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'duplicates': self.duplicates,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+            }
+
+    def _put(self, key, value):
+        if key in self._entries:
+            return
+        self._entries[key] = value
+        self._num_bytes += _entry_size(key, value)
+        while self._num_bytes > self.max_bytes and self._entries:
+            old_key, old_value = self._entries.popitem(last=False)
+            self._num_bytes -= _entry_size(old_key, old_value)
+            self.evictions += 1
+
+
+def _entry_size(key, value):
+    return len(key) + value.nbytes + _ENTRY_OVERHEAD
+
+
+def model_version(model_path):
+    """ Return the version string of a model artifact, derived from its content
+
+    Arguments
+    ---------
+        model_path: str, the path of the artifact, e.g. a joblib file
+
+    Returns
+    -------
+        version: str, the first 12 hex digits of the sha1 of the file
+    """
+    digest = hashlib.sha1()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def anomaly_scores(model, X):
+    """ Return the anomaly probability of each row, or the 0/1 prediction for models
+        without `predict_proba`
+
+    Arguments
+    ---------
+        model: object, a fitted loglizer model
+        X: ndarray, the transformed data matrix
+
+    Returns
+    -------
+        scores: ndarray of shape (num_instances,), in [0, 1]
+    """
+    with instrumentation.timed('predict_proba', X.shape[0]):
+        if hasattr(model, 'predict_proba'):
+            return np.asarray(model.predict_proba(X))[:, 1]
+        return np.asarray(model.predict(X), dtype=float)
+
+
+def feature_contributions(model, X):
+    """ Compute the contribution of every feature to the anomaly score of every row
+
+    Arguments
+    ---------
+        model: object, a fitted LR, SVM or PCA model, see `has_contributions`
+        X: ndarray, the transformed data matrix
+
+    Returns
+    -------
+        contributions: ndarray of shape num_instances-by-num_events. For LR/SVM it is
+            coef * x, the additive terms of the decision function; for PCA it is the
+            squared residual-space component, which sums up to the SPE.
+    """
+    classifier = getattr(model, 'classifier', model)
+    if hasattr(classifier, 'coef_'):
+        return X * np.asarray(classifier.coef_).reshape(1, -1)
+    if getattr(model, 'proj_C', None) is not None:
+        y_a = X.dot(model.proj_C)
+        return y_a * y_a
+    raise NotImplementedError('Contributions are only supported for LR, SVM and PCA models.')
+
+
+def has_contributions(model):
+    """ Return whether `feature_contributions` supports the model, i.e. LR, SVM and PCA """
+    classifier = getattr(model, 'classifier', model)
+    return hasattr(classifier, 'coef_') or getattr(model, 'proj_C', None) is not None
+
+
+def top_contributors(contributions, top_k=3):
+    """ Select the top-k contributing features of every row in one vectorized pass
+
+    Arguments
+    ---------
+        contributions: ndarray, the output of `feature_contributions`
+        top_k: int, the number of features to keep per row
+
+    Returns
+    -------
+        top_idx: ndarray of shape num_instances-by-k, feature indices by decreasing contribution
+        top_values: ndarray of shape num_instances-by-k, the matching contributions
+    """
+    top_k = min(top_k, contributions.shape[1])
+    top_idx = np.argpartition(-contributions, top_k - 1, axis=1)[:, :top_k]
+    top_values = np.take_along_axis(contributions, top_idx, axis=1)
+    order = np.argsort(-top_values, axis=1)
+    return np.take_along_axis(top_idx, order, axis=1), np.take_along_axis(top_values, order, axis=1)
+
+
+def render_reasons(top_idx, top_values, events, templates=None, num_instances=None):
+    """ Render the top contributors of every row as a reason string
+
+    Only features pushing towards an anomaly (positive contributions) are listed. Rows
+    with the same contributors are rendered once.
+
+    Arguments
+    ---------
+        top_idx, top_values: ndarray, the output of `top_contributors`, or None when no
+            contributors were computed, e.g. top_k 0 in `score_sessions`
+        events: list, the feature names, e.g. `FeatureExtractor.events`
+        templates: dict, EventId -> EventTemplate shown next to each event
+        num_instances: int, the number of rows, only needed when top_idx is None
+
+    Returns
+    -------
+        reasons: list of str, one per row
+    """
+    if top_idx is None:
+        return [_NO_CONTRIBUTORS] * (num_instances or 0)
+    with instrumentation.timed('render_reasons', top_idx.shape[0]):
+        return _render_reasons(top_idx, top_values, events, templates or dict())
+
+
+def _render_reasons(top_idx, top_values, events, templates):
+    keys = np.hstack([top_idx.astype(float), np.round(top_values, 2)])
+    key_view = np.ascontiguousarray(keys).view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+    _, unique_idx, inverse = np.unique(key_view, return_index=True, return_inverse=True)
+    unique_reasons = []
+    for row in unique_idx:
+        parts = []
+        for idx, value in zip(top_idx[row], top_values[row]):
+            if value <= 0:
+                break
+            event = str(events[idx]) if idx < len(events) else 'OOV'
+            template = templates.get(event)
+            label = '{} ({})'.format(event, template) if template else event
+            parts.append('{} +{:.2f}'.format(label, value))
+        if parts:
+            unique_reasons.append('Top contributing events: ' + '; '.join(parts))
+        else:
+            unique_reasons.append('No event contributes towards an anomaly')
+    return [unique_reasons[idx] for idx in inverse.reshape(-1)]
+
+
+def score_sessions(model, extractor, X_seq, batch_size=10000, cache=None, top_k=0, progress=None,
+                   batcher=None, model_version=None):
+    """ Score log sessions in bounded-size vectorized batches
+
+    Arguments
+    ---------
+        model: object, a fitted loglizer model
+        extractor: FeatureExtractor, fitted or in inference mode
+        X_seq: ndarray, log sequences matrix
+        batch_size: int, the maximal number of sessions transformed and scored at once
+        cache: ScoringCache, reuses scores of identical sessions when given
+        top_k: int, the number of top contributing features to return per session, 0 for none.
+            Models without contributions (see `has_contributions`) are scored with 0
+        progress: callable, called as progress(num_scored, num_instances) after every batch
+        batcher: object with a `score(X_counts, score_func, key)` method that may score the
+            rows together with those of concurrent callers sharing the key, e.g. a
+            `BatchCoalescer` of the analysis service; None scores in the calling thread
+        model_version: str, the version of model the cached scores are keyed by, see
+            `ScoringCache.score`
+
+    Returns
+    -------
+        scores: ndarray of shape (num_instances,), the anomaly score of every session
+        top_idx, top_values: ndarray of shape num_instances-by-k (see `top_contributors`),
+            None when no contributors were computed
+    """
+    top_k = _clip_top_k(model, extractor, top_k)
+
+    def score_func(X_counts):
+        return _score_counts(model, extractor, X_counts, top_k)
+
+    if batcher is not None:
+        # Calls may only share a batch when model, extractor state and top_k are the same
+        key = (id(model), top_k, tuple(extractor.events), extractor.term_weighting, extractor.normalization,
+               extractor.oov, id(extractor.idf_vec), id(extractor.mean_vec))
+        unbatched_func = score_func
+
+        def score_func(X_counts):
+            return batcher.score(X_counts, unbatched_func, key=key)
+
+    results = [np.zeros((0, 1 + 2 * top_k)) if top_k else np.zeros(0)]
+    for start in range(0, X_seq.shape[0], batch_size):
+        X_counts = extractor.count_events(X_seq[start:start + batch_size])
+        if cache is None:
+            results.append(score_func(X_counts))
+        else:
+            results.append(cache.score(X_counts, score_func, variant='top{}'.format(top_k),
+                                       model_version=model_version))
+        if progress is not None:
+            progress(start + X_counts.shape[0], X_seq.shape[0])
+    return _unpack(np.concatenate(results), top_k)
+
+
+def score_counts(model, extractor, X_counts, top_k=0):
+    """ Score an event count matrix in one vectorized pass
+
+    Arguments
+    ---------
+        model: object, a fitted loglizer model
+        extractor: FeatureExtractor, fitted or in inference mode
+        X_counts: ndarray, the raw event count matrix, e.g. from `FeatureExtractor.count_pairs`
+        top_k: int, the number of top contributing features to return per row, 0 for none
+
+    Returns
+    -------
+        the same as `score_sessions`, one entry per row of X_counts
+    """
+    top_k = _clip_top_k(model, extractor, top_k)
+    return _unpack(_score_counts(model, extractor, X_counts, top_k), top_k)
+
+
+def _clip_top_k(model, extractor, top_k):
+    if top_k and not has_contributions(model):
+        return 0
+    return min(top_k, len(extractor.events) + (1 if extractor.oov else 0))
+
+
+def _score_counts(model, extractor, X_counts, top_k):
+    # Scores, top indices and top values packed as one matrix so the cache stores them together
+    X = extractor.transform_counts(X_counts)
+    scores = anomaly_scores(model, X)
+    if top_k == 0:
+        return scores
+    with instrumentation.timed('explain', X.shape[0]):
+        top_idx, top_values = top_contributors(feature_contributions(model, X), top_k)
+    return np.hstack([scores.reshape(-1, 1), top_idx, top_values])
+
+
+def _unpack(results, top_k):
+    if top_k == 0:
+        return results, None, None
+    return results[:, 0], results[:, 1:1 + top_k].astype(int), results[:, 1 + top_k:]
@@ -0,0 +1,300 @@
+"""
+Incremental construction of block sessions from a streamed HDFS log, either raw log
+lines or a structured log, without holding the whole log in memory, and tracking of the
+open sessions of a log that is still being written.
+
+"""
+
+import io
+import csv
+import re
+import pandas as pd
+from collections import OrderedDict, deque
+
+from . import instrumentation
+from .dataloader import _HDFS_COLUMNS, _group_sessions
+
+# The event templates of the HDFS dataset (LogHub), E1 to E29
+HDFS_TEMPLATES = OrderedDict([
+    ('E1', 'Adding an already existing block <*>'),
+    ('E2', 'Verification succeeded for <*>'),
+    ('E3', 'Served block <*> to /<*>'),
+    ('E4', 'Got exception while serving <*> to /<*>'),
+    ('E5', 'Receiving block <*> src: /<*> dest: /<*>'),
+    ('E6', 'Received block <*> src: /<*> dest: /<*> of size <*>'),
+    ('E7', 'writeBlock <*> received exception <*>'),
+    ('E8', 'PacketResponder <*> for block <*> Interrupted.'),
+    ('E9', 'Received block <*> of size <*> from /<*>'),
+    ('E10', 'PacketResponder <*> <*> Exception <*>'),
+    ('E11', 'PacketResponder <*> for block <*> terminating'),
+    ('E12', '<*>:Exception writing block <*> to mirror <*>'),
+    ('E13', 'Receiving empty packet for block <*>'),
+    ('E14', 'Exception in receiveBlock for block <*> <*>'),
+    ('E15', 'Changing block file offset of block <*> from <*> to <*> meta file offset to <*>'),
+    ('E16', '<*>:Transmitted block <*> to /<*>'),
+    ('E17', '<*>:Failed to transfer <*> to <*> got <*>'),
+    ('E18', '<*> Starting thread to transfer block <*> to <*>'),
+    ('E19', 'Reopen Block <*>'),
+    ('E20', 'Unexpected error trying to delete block <*>. BlockInfo not found in volumeMap.'),
+    ('E21', 'Deleting block <*> file <*>'),
+    ('E22', 'BLOCK* NameSystem.allocateBlock: <*>'),
+    ('E23', 'BLOCK* NameSystem.delete: <*> is added to invalidSet of <*>'),
+    ('E24', 'BLOCK* Removing block <*> from neededReplications as it does not belong to any file.'),
+    ('E25', 'BLOCK* ask <*> to replicate <*> to <*>'),
+    ('E26', 'BLOCK* NameSystem.addStoredBlock: blockMap updated: <*> is added to <*> size <*>'),
+    ('E27', 'BLOCK* NameSystem.addStoredBlock: Redundant addStoredBlock request received for <*> on <*> size <*>'),
+    ('E28', 'BLOCK* NameSystem.addStoredBlock: addStoredBlock request received for <*> on <*> size <*> '
+            'But it does not belong to any file.'),
+    ('E29', 'PendingReplicationMonitor timed out block <*>'),
+])
+
+# Date, time, pid, level and component in front of the message of a raw HDFS log line
+_RAW_LINE = re.compile(r'^\d{6} \d{6} \d+ \w+ [^:\s]+: (.*)$')
+
+_BLOCK_ID = re.compile(r'(blk_-?\d+)')
+
+
+class TemplateMatcher(object):
+    """ Assign raw log messages to event templates
+
+    Templates use `<*>` for variable parts. When several templates match a message the
+    one with the most literal text wins, e.g. E6 over E9 for a `Received block` message.
+    """
+
+    def __init__(self, templates=None):
+        """
+        Arguments
+        ---------
+            templates: dict, EventId -> EventTemplate, by default `HDFS_TEMPLATES`
+        """
+        self.templates = dict(HDFS_TEMPLATES if templates is None else templates)
+        self._candidates = []
+        for event in sorted(self.templates, key=lambda event: -len(re.sub(r'<\*>|\s', '', self.templates[event]))):
+            parts = [part.split() for part in self.templates[event].split('<*>')]
+            pattern = '.*?'.join(r'\s+'.join(re.escape(word) for word in words) for words in parts)
+            # A substring test on the longest word rules out most templates before the regex runs
+            keyword = max((word for words in parts for word in words), key=len)
+            self._candidates.append((event, keyword, re.compile(pattern, re.DOTALL)))
+
+    def match(self, message):
+        """ Return the EventId of a message, or None if no template matches """
+        for event, keyword, pattern in self._candidates:
+            if keyword in message and pattern.search(message):
+                return event
+        return None
+
+
+class SessionBuilder(object):
+    """ Build block sessions from a log fed in arbitrary byte chunks
+
+    The first line decides the input format: a structured log (CSV with `Content` and
+    `EventId` columns, as loaded by `dataloader.load_HDFS_sessions`) or raw HDFS log lines,
+    whose messages are assigned to events with a `TemplateMatcher`. Complete lines are
+    parsed in batches of about `batch_bytes`; only the sessions are kept.
+    """
+
+    def __init__(self, matcher=None, batch_bytes=4 << 20):
+        self.matcher = matcher
+        self.batch_bytes = batch_bytes
+        self.sessions = OrderedDict()
+        self.templates = dict()
+        self.structured = None
+        self.num_lines = 0
+        self.num_unmatched = 0
+        self._columns = None
+        self._pending = []
+        self._pending_bytes = 0
+        self._partial = b''
+
+    def feed(self, data):
+        """ Add the next chunk of the log; lines may span chunks """
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        if not lines:
+            return
+        if self.structured is None:
+            self._detect(lines[0])
+            if self.structured:
+                lines = lines[1:]
+        self._pending.extend(lines)
+        self._pending_bytes += len(data)
+        if self._pending_bytes >= self.batch_bytes:
+            self._parse_pending()
+
+    def close(self):
+        """ Parse what is left after the last chunk; returns self """
+        if self._partial.strip():
+            self.feed(b'\n')
+        self._parse_pending()
+        return self
+
+    def to_dataframe(self):
+        """ Return the sessions like `dataloader.load_HDFS_sessions`
+
+        Returns
+        -------
+            data_df: DataFrame with `BlockId` and `EventSequence` columns
+            templates: dict, EventId -> EventTemplate
+        """
+        return pd.DataFrame({'BlockId': list(self.sessions.keys()),
+                             'EventSequence': list(self.sessions.values())}), self.templates
+
+    def _detect(self, first_line):
+        header = next(csv.reader([first_line.decode('utf-8', errors='replace').strip()]), [])
+        self.structured = 'Content' in header and 'EventId' in header
+        if self.structured:
+            self._columns = header
+        elif self.matcher is None:
+            self.matcher = TemplateMatcher()
+
+    def _parse_pending(self):
+        lines = [line.rstrip(b'\r') for line in self._pending if line.strip()]
+        num_bytes = self._pending_bytes
+        self._pending = []
+        self._pending_bytes = 0
+        if not lines:
+            return
+        self.num_lines += len(lines)
+        with instrumentation.timed('build_sessions', len(lines), bytes=num_bytes):
+            self._parse_lines(lines)
+
+    def _parse_lines(self, lines):
+        if self.structured:
+            struct_log = pd.read_csv(io.BytesIO(b'\n'.join(lines)), engine='c', header=None, names=self._columns,
+                                     usecols=lambda col: col in _HDFS_COLUMNS, na_filter=False)
+            if 'EventTemplate' in struct_log.columns:
+                templates = struct_log[['EventId', 'EventTemplate']].drop_duplicates('EventId')
+                self.templates.update(zip(templates['EventId'], templates['EventTemplate']))
+        else:
+            contents = []
+            event_ids = []
+            for line in lines:
+                line = line.decode('utf-8', errors='replace')
+                found = _RAW_LINE.match(line)
+                content = found.group(1) if found else line
+                event_id = self.matcher.match(content)
+                if event_id is None:
+                    self.num_unmatched += 1
+                    continue
+                contents.append(content)
+                event_ids.append(event_id)
+            if not event_ids:
+                return
+            struct_log = pd.DataFrame({'Content': contents, 'EventId': event_ids})
+            for event_id in set(event_ids):
+                self.templates[event_id] = self.matcher.templates[event_id]
+        data_df = _group_sessions(struct_log)
+        for block_id, events in zip(data_df['BlockId'], data_df['EventSequence']):
+            session = self.sessions.get(block_id)
+            if session is None:
+                self.sessions[block_id] = events
+            else:
+                session.extend(events)
+
+
+CLOSED_TERMINAL = 'terminal'
+CLOSED_IDLE = 'idle'
+CLOSED_EVICTED = 'evicted'
+CLOSED_MAX_EVENTS = 'max_events'
+CLOSED_FLUSH = 'flush'
+
+
+class LiveSessions(object):
+    """ Bounded set of the open block sessions of a growing raw HDFS log
+
+    Lines are added as the log is written. A session closes `terminal_grace` seconds after
+    one of `terminal_events` (events of the block within the grace still count, e.g. the
+    deletes of the other replicas), once it was idle for `idle_timeout` seconds, or when
+    it reaches `max_events` events. Adding a block while `max_sessions` sessions are open
+    closes the least recently updated one first, so memory is bounded by `max_sessions`
+    times `max_events` events.
+
+    Closed sessions are returned as (block_id, events, reason, due) tuples, where reason is
+    one of the CLOSED_* constants and due is the time the session was due to close.
+    Times are seconds on any monotonic clock, passed in by the caller.
+    """
+
+    def __init__(self, max_sessions=100000, idle_timeout=30.0, terminal_events=('E21',), terminal_grace=0.5,
+                 max_events=1000, matcher=None):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.terminal_events = frozenset(terminal_events)
+        self.terminal_grace = terminal_grace
+        self.max_events = max_events
+        self.matcher = matcher or TemplateMatcher()
+        self.num_lines = 0
+        self.num_unmatched = 0
+        # block id -> [events, last update, terminal deadline], least recently updated first
+        self._open = OrderedDict()
+        # (deadline, block id) in deadline order, since the grace is the same for every session
+        self._terminal = deque()
+
+    def __len__(self):
+        return len(self._open)
+
+    def add_lines(self, lines, now):
+        """ Add complete raw log lines (bytes or str) seen at time now; returns the sessions they closed """
+        closed = []
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', errors='replace')
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            self.num_lines += 1
+            found = _RAW_LINE.match(line)
+            content = found.group(1) if found else line
+            event_id = self.matcher.match(content)
+            if event_id is None:
+                self.num_unmatched += 1
+                continue
+            # A line mentioning the same block twice counts once for that block
+            for block_id in OrderedDict.fromkeys(_BLOCK_ID.findall(content)):
+                self.add(block_id, event_id, now, closed)
+        return closed
+
+    def add(self, block_id, event_id, now, closed=None):
+        """ Add one event of a block; returns the list of closed sessions, extended by this event's """
+        closed = [] if closed is None else closed
+        session = self._open.get(block_id)
+        if session is None:
+            if len(self._open) >= self.max_sessions:
+                evicted_id, evicted = self._open.popitem(last=False)
+                closed.append((evicted_id, evicted[0], CLOSED_EVICTED, now))
+            session = self._open[block_id] = [[], now, None]
+        else:
+            self._open.move_to_end(block_id)
+        session[0].append(event_id)
+        session[1] = now
+        if session[2] is None and event_id in self.terminal_events:
+            session[2] = now + self.terminal_grace
+            self._terminal.append((session[2], block_id))
+        if len(session[0]) >= self.max_events:
+            del self._open[block_id]
+            closed.append((block_id, session[0], CLOSED_MAX_EVENTS, now))
+        return closed
+
+    def expire(self, now):
+        """ Close the sessions due at time now and return them """
+        closed = []
+        while self._terminal and self._terminal[0][0] <= now:
+            deadline, block_id = self._terminal.popleft()
+            session = self._open.get(block_id)
+            # The block may have been closed, and even reopened, since
+            if session is not None and session[2] == deadline:
+                del self._open[block_id]
+                closed.append((block_id, session[0], CLOSED_TERMINAL, deadline))
+        while self._open:
+            block_id, session = next(iter(self._open.items()))
+            if now - session[1] < self.idle_timeout:
+                break
+            del self._open[block_id]
+            closed.append((block_id, session[0], CLOSED_IDLE, session[1] + self.idle_timeout))
+        return closed
+
+    def close_all(self, now):
+        """ Close every open session, e.g. at the end of the log """
+        closed = [(block_id, session[0], CLOSED_FLUSH, now) for block_id, session in self._open.items()]
+        self._open.clear()
+        self._terminal.clear()
+        return closed
@@ -10,13 +10,14 @@ from sklearn.metrics import precision_recall_fscore_support
 import numpy as np
 
 
-def metrics(y_pred, y_true):
+def metrics(y_pred, y_true, sample_weight=None):
     """ Calucate evaluation metrics for precision, recall, and f1.
 
     Arguments
     ---------
         y_pred: ndarry, the predicted result list
         y_true: ndarray, the ground truth label list
+        sample_weight: ndarray, the multiplicity of each instance, None for unit weights
 
     Returns
     -------
@@ -24,6 +25,7 @@ def metrics(y_pred, y_true):
         recall: float, recall value
         f1: float, f1 measure value
     """
-    precision, recall, f1, _ = precision_recall_fscore_support(y_true, y_pred, average='binary')
+    precision, recall, f1, _ = precision_recall_fscore_support(y_true, y_pred, average='binary',
+                                                                 sample_weight=sample_weight)
     return precision, recall, f1
 
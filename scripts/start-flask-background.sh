@@ -46,8 +46,17 @@ echo "🔄 Starting Flask service on port ${FLASK_PORT:-5555}..."
 nohup python flask-simulator.py > flask.log 2>&1 &
 FLASK_PID=$!
 
-# Wait a moment and check if it started successfully
-sleep 3
+# Wait until the model is loaded and warmed up (up to 60s), or the process exits
+for i in $(seq 1 120); do
+    if ! ps -p $FLASK_PID > /dev/null; then
+        break
+    fi
+    if curl -sf "http://localhost:${FLASK_PORT:-5555}/ready" > /dev/null 2>&1; then
+        echo "✅ Flask service is ready"
+        break
+    fi
+    sleep 0.5
+done
 if ps -p $FLASK_PID > /dev/null; then
     echo "✅ Flask service started successfully!"
     echo "   PID: $FLASK_PID"